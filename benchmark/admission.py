@@ -0,0 +1,84 @@
+"""
+过载基准测试：LLM 同时只能处理 capacity 个请求，请求以超过其处理能力的速率 rate 到达，
+比较不做准入控制与使用 AdmissionController 时，在客户端超时之前成功的请求数、被快速拒绝的请求数以及延迟
+
+    python -m benchmark.admission --rate 120 --duration 5 --capacity 8 --client-timeout 3
+"""
+import time
+import asyncio
+import argparse
+
+from pydantic import PrivateAttr
+
+import main
+from service import DialogueProcessor
+from service.utils.admission import AdmissionController
+from benchmark.concurrency import SleepyChatModel
+from benchmark.ttft import post
+
+
+class SaturatedChatModel(SleepyChatModel):
+    """
+    同时最多处理 capacity 个请求的假模型，其余请求排队，模拟饱和的 LLM 后端
+    """
+    capacity: int = 8
+    _semaphore: asyncio.Semaphore = PrivateAttr(default=None)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.capacity)
+        async with self._semaphore:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+
+async def request(i, client_timeout):
+    body = {"messages": [{"role": "user", "content": "We received some data, could you help with processing it ?"}],
+            "metadata": {"chat_id": f"admission-{i}", "user_id": f"user-{i % 50}"}}
+    start = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(post(body), client_timeout)
+    except asyncio.TimeoutError:
+        return "timeout", time.perf_counter() - start
+    status = "rejected" if getattr(response, "status_code", 200) in (429, 503) else "ok"
+    return status, time.perf_counter() - start
+
+
+async def run(args):
+    main.chat = DialogueProcessor(SaturatedChatModel(latency=args.latency, capacity=args.capacity))
+    main.chat.compile()
+    tasks = []
+    for i in range(int(args.rate * args.duration)):
+        tasks.append(asyncio.create_task(request(i, args.client_timeout)))
+        await asyncio.sleep(1 / args.rate)
+    results = await asyncio.gather(*tasks)
+
+    summary = {}
+    for status in ("ok", "rejected", "timeout"):
+        latencies = sorted(t for s, t in results if s == status)
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        summary[status] = (len(latencies), p50)
+    return summary
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=120, help="每秒到达的请求数")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--client-timeout", type=float, default=3.0)
+    args = parser.parse_args()
+
+    for name, admission in (("no admission", AdmissionController()),
+                            ("admission", AdmissionController(max_concurrency=args.capacity, max_per_user=2,
+                                                              max_queue=args.capacity * 4,
+                                                              queue_timeout=args.client_timeout / 2))):
+        main.admission = admission
+        summary = asyncio.run(run(args))
+        print(f"{name:<13} " + "  ".join(f"{status} {n:4d} (p50 {p50 * 1000:7.1f} ms)" for status, (n, p50) in summary.items()))
+        if name == "admission":
+            print(f"{'':<13} {admission.stats()}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,83 @@
+"""
+checkpointer 基准测试
+    1. 每轮对话的延迟：MemorySaver 与 SQLiteSaver 下 graph.ainvoke 的平均耗时，以及 SQLiteSaver 的写入耗时
+    2. 重启时间：打开包含大量会话的 SQLite 数据库，并恢复其中一个会话所需的时间
+
+    python -m benchmark.checkpoint --threads 200 --turns 10
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from service import DialogueProcessor
+from service.utils.checkpoint import SQLiteSaver
+from benchmark.concurrency import SleepyChatModel
+
+
+class TimedSQLiteSaver(SQLiteSaver):
+    """
+    记录每次 aput/aput_writes 耗时的 SQLiteSaver
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_times = []
+
+    async def aput(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = await super().aput(*args, **kwargs)
+        self.write_times.append(time.perf_counter() - start)
+        return result
+
+    async def aput_writes(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = await super().aput_writes(*args, **kwargs)
+        self.write_times.append(time.perf_counter() - start)
+        return result
+
+
+async def run_turns(checkpointer, threads, turns):
+    chat = DialogueProcessor(SleepyChatModel(latency=0, reply="I am a knowledgeable AI agent"), checkpointer=checkpointer)
+    graph = chat.compile()
+    start = time.perf_counter()
+    for turn in range(turns):
+        for thread in range(threads):
+            config = {"configurable": {"thread_id": f"thread-{thread}"}}
+            await graph.ainvoke({"messages": HumanMessage(content=f"message {turn}")}, config=config)
+    return (time.perf_counter() - start) / (threads * turns)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite")
+
+    memory_turn = asyncio.run(run_turns(MemorySaver(), args.threads, args.turns))
+    saver = TimedSQLiteSaver(path)
+    sqlite_turn = asyncio.run(run_turns(saver, args.threads, args.turns))
+    saver.close()
+
+    start = time.perf_counter()
+    restarted = SQLiteSaver(path)
+    opened = time.perf_counter() - start
+    restarted.get_tuple({"configurable": {"thread_id": f"thread-{args.threads // 2}"}})
+    resumed = time.perf_counter() - start
+
+    writes = sorted(saver.write_times)
+    print(f"threads: {args.threads}, turns: {args.turns}, database: {os.path.getsize(path) / 1e6:.1f} MB")
+    print(f"per-turn latency (memory) : {memory_turn * 1000:8.2f} ms")
+    print(f"per-turn latency (sqlite) : {sqlite_turn * 1000:8.2f} ms")
+    print(f"sqlite write p50 / p99    : {writes[len(writes) // 2] * 1000:8.2f} / {writes[int(len(writes) * 0.99)] * 1000:.2f} ms")
+    print(f"restart: open database    : {opened * 1000:8.2f} ms")
+    print(f"restart: first resume     : {resumed * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+并发基准测试：比较 /v1/chat/completions 的同步路径（在事件循环中调用 graph.invoke）
+与异步路径（await graph.ainvoke）在并发请求下的吞吐量
+
+    python -m benchmark.concurrency --requests 64 --latency 0.2
+"""
+import time
+import uuid
+import asyncio
+import argparse
+
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from service import DialogueProcessor
+
+
+class SleepyChatModel(BaseChatModel):
+    """
+    模拟 Ollama 往返延迟的假模型，总是回复固定内容，流式输出时每个词之间等待 token_latency 秒
+    """
+    latency: float = 0.2
+    token_latency: float = 0.0
+    reply: str = "pipeline"
+
+    @property
+    def _llm_type(self) -> str:
+        return "sleepy-fake"
+
+    @property
+    def generation_time(self) -> float:
+        return self.latency + self.token_latency * len(self.reply.split(" "))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.generation_time)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.generation_time)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(self.reply.split(" ")):
+            token = word if i == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.token_latency)
+
+
+def make_input(text="We received some data, could you help with processing it ?"):
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    return {"messages": HumanMessage(content=text)}, config
+
+
+async def sync_request(graph):
+    # 旧的实现：在 async 的端点中直接调用同步的 graph.invoke，阻塞事件循环
+    messages, config = make_input()
+    return graph.invoke(messages, config=config)
+
+
+async def async_request(graph):
+    messages, config = make_input()
+    return await graph.ainvoke(messages, config=config)
+
+
+async def run(request, graph, n):
+    start = time.perf_counter()
+    await asyncio.gather(*[request(graph) for _ in range(n)])
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    chat = DialogueProcessor(SleepyChatModel(latency=args.latency))
+    graph = chat.compile()
+
+    sync_rps = asyncio.run(run(sync_request, graph, args.requests))
+    async_rps = asyncio.run(run(async_request, graph, args.requests))
+
+    print(f"requests: {args.requests}, llm latency: {args.latency}s")
+    print(f"sync  (graph.invoke)  : {sync_rps:8.2f} req/s")
+    print(f"async (graph.ainvoke) : {async_rps:8.2f} req/s")
+    print(f"speedup               : {async_rps / sync_rps:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
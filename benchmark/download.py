@@ -0,0 +1,104 @@
+"""
+下载的基准测试：在本地启动 benchmark/file_server.py（每个连接限速 --rate-mb MB/s，模拟对象存储单个连接的带宽），
+下载 --files 个 --size-mb MB 的文件，比较以下方式的总吞吐量：
+    sequential: 一个连接，依次下载每个文件
+    files:      --concurrency 个连接，每个文件一个连接
+    parts:      --concurrency 个连接，文件按 --part-mb MB 分段
+    budget:     与 parts 相同，总带宽限制为 --budget-mb MB/s
+
+    python -m benchmark.download --files 4 --size-mb 256 --rate-mb 50 --concurrency 8
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmark.workers import ROOT, free_port
+from service.tasks.download import MiB, Downloader, HttpSource, TransferBudget
+
+
+def generate(directory: str, files: int, size: int) -> list[str]:
+    block = os.urandom(min(size, 16 * MiB))
+    names = []
+    for i in range(files):
+        name = f"sample_{i}.fastq.gz"
+        with open(os.path.join(directory, name), "wb") as f:
+            written = 0
+            while written < size:
+                written += f.write(block[:size - written])
+        names.append(name)
+    return names
+
+
+def start_server(root: str, port: int, rate_mb: float) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, "-m", "benchmark.file_server", root, "--port", str(port),
+                               "--rate-mb", str(rate_mb)], cwd=ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.head(f"http://127.0.0.1:{port}/missing")
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("file server did not start")
+
+
+async def run(port: int, names: list[str], target: str, concurrency: int, part_size: int, rate=None) -> dict:
+    shutil.rmtree(target, ignore_errors=True)
+    source = HttpSource(f"http://127.0.0.1:{port}", max_connections=concurrency)
+    try:
+        downloader = Downloader(TransferBudget(concurrency, rate), part_size=part_size)
+        summary = await downloader.download(source, [(name, os.path.join(target, name)) for name in names])
+    finally:
+        await source.aclose()
+    assert summary["ok"], [f for f in summary["files"] if f["status"] != "ok"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--rate-mb", type=float, default=50, help="文件服务每个连接的速度（MB/s）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--part-mb", type=int, default=32)
+    parser.add_argument("--budget-mb", type=float, default=100, help="budget 场景的总带宽（MB/s）")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="download-bench-")
+    root, target = os.path.join(workdir, "remote"), os.path.join(workdir, "local")
+    os.makedirs(root)
+    try:
+        names = generate(root, args.files, args.size_mb * MiB)
+        port = free_port()
+        server = start_server(root, port, args.rate_mb)
+        print(f"{args.files} files x {args.size_mb} MB, {args.rate_mb} MB/s per connection, cpus: {os.cpu_count()}")
+        try:
+            whole = args.size_mb * MiB
+            scenarios = {
+                "sequential": (1, whole, None),
+                "files": (args.concurrency, whole, None),
+                "parts": (args.concurrency, args.part_mb * MiB, None),
+                "budget": (args.concurrency, args.part_mb * MiB, args.budget_mb * MiB),
+            }
+            for name, (concurrency, part_size, rate) in scenarios.items():
+                summary = asyncio.run(run(port, names, target, concurrency, part_size, rate))
+                rates = [f["mb_per_s"] for f in summary["files"]]
+                print(f"{name:10s} {summary['bytes'] / MiB:6.0f} MiB in {summary['seconds']:6.2f}s, "
+                      f"{summary['mb_per_s']:6.1f} MB/s aggregate, per file {min(rates):.1f} - {max(rates):.1f} MB/s")
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
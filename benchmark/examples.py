@@ -0,0 +1,63 @@
+"""
+few-shot 示例选择基准测试：比较发送全部示例与按 token 预算选择示例时，task_new 的 formatter/question 提示的 token 数（估算值）
+
+    python -m benchmark.examples --k 4 --token-budget 800
+"""
+import argparse
+
+from langchain_core.messages import HumanMessage
+
+from service.chat.states import PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder
+from service.chat.pipeline.examples import estimate_tokens
+
+# (用户输入, 这一轮 formatter 提取到的参数)
+TURNS = [
+    ("I have a batch of WES data from the project METAPRISM, please start the first batch processing.",
+     {"project_name": "METAPRISM", "batch_id": "batch01", "sequencing_type": "WES"}),
+    ("Please use GeSA.", {"pipeline_name": "GeSA"}),
+    ("There are both mouse and human data to process in this dataset.", {}),
+    ("Let's process the human samples first.", {"sequencing_species": "human"}),
+    ("part of the sample don't have control data", {}),
+    ("Tumor only please.", {"analysis_mode": "Tonly"}),
+    ("It is from iRODS.", {"data_source_type": "iRODS"}),
+]
+
+
+def prompt_tokens(builder):
+    state = PipelineState(messages=[])
+    formatter_tokens, question_tokens = [], []
+    for user_input, args in TURNS:
+        state.messages.append(HumanMessage(content=user_input))
+        formatter_prompt, question_prompt = builder.new_pipeline_task_prompt(state)
+        messages = formatter_prompt.format_messages(user_input=user_input)
+        formatter_tokens.append(estimate_tokens("\n".join(m.content for m in messages)))
+
+        state.args.update(args)
+        tip = builder.build_tip("task_new", state, bool(args)) or ""
+        _, question_prompt = builder.new_pipeline_task_prompt(state)
+        messages = question_prompt.format_messages(user_input=user_input, tip=tip)
+        question_tokens.append(estimate_tokens("\n".join(m.content for m in messages)))
+    return sum(formatter_tokens) / len(TURNS), sum(question_tokens) / len(TURNS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--token-budget", type=int, default=800)
+    args = parser.parse_args()
+
+    full = prompt_tokens(pipeline_prompt_builder())
+    builder = pipeline_prompt_builder(few_shot_k=args.k, few_shot_token_budget=args.token_budget)
+    selected = prompt_tokens(builder)
+
+    print(f"{'prompt':<10} {'all examples':>14} {'selected':>10} {'saved':>8}")
+    for name, before, after in zip(("formatter", "question"), full, selected):
+        print(f"{name:<10} {before:>14.0f} {after:>10.0f} {1 - after / before:>8.1%}")
+    for (task_name, prompt_type), selector in builder.selectors.items():
+        stats = selector.stats()
+        print(f"{prompt_type} examples: {stats['tokens_before']:.0f} -> {stats['tokens_after']:.0f} tokens per call")
+
+
+if __name__ == "__main__":
+    main()
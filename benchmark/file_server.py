@@ -0,0 +1,75 @@
+"""
+下载测试用的本地 HTTP 文件服务：支持 HEAD 和 Range 请求，可以限制每个连接的速度，模拟对象存储和 iRODS 网关
+单个连接的带宽有限、总带宽更高的情况
+
+    python -m benchmark.file_server /data/files --port 8900 --rate-mb 50
+"""
+import os
+import asyncio
+import argparse
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+BLOCK = 256 * 1024
+
+
+def file_app(root: str, rate: float = None, ranges: bool = True) -> Starlette:
+    """
+    rate 为每个连接的速度（字节/秒），None 表示不限制；ranges 为 False 时忽略 Range 请求
+    """
+    stats = {"requests": 0, "bytes": 0}
+
+    async def serve(request: Request):
+        path = os.path.join(root, request.path_params["path"])
+        if not os.path.isfile(path):
+            return Response(status_code=404)
+        size = os.path.getsize(path)
+        headers = {"accept-ranges": "bytes"} if ranges else {}
+        if request.method == "HEAD":
+            return Response(headers={**headers, "content-length": str(size)})
+
+        stats["requests"] += 1
+        start, end, status = 0, size, 200
+        if ranges and "range" in request.headers:
+            first, last = request.headers["range"].removeprefix("bytes=").split("-")
+            start, end, status = int(first), min(size, int(last) + 1) if last else size, 206
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+
+        async def body():
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = f.read(min(BLOCK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    stats["bytes"] += len(chunk)
+                    if rate:
+                        await asyncio.sleep(len(chunk) / rate)
+                    yield chunk
+
+        return StreamingResponse(body(), status_code=status,
+                                 headers={**headers, "content-length": str(end - start)})
+
+    app = Starlette(routes=[Route("/{path:path}", serve, methods=["GET", "HEAD"])])
+    app.state.stats = stats
+    return app
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--rate-mb", type=float, default=None, help="每个连接的速度（MB/s）")
+    args = parser.parse_args()
+    uvicorn.run(file_app(args.root, args.rate_mb * (1 << 20) if args.rate_mb else None),
+                host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
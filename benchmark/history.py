@@ -0,0 +1,77 @@
+"""
+会话历史压缩的基准测试：同一个会话连续对话 turns 轮（SQLiteSaver），
+比较不压缩与压缩（滑动窗口，可选摘要）时每轮 graph.ainvoke 的延迟和最后一个 checkpoint 的大小
+
+    python -m benchmark.history --turns 500 --window 20 --slack 10
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from langchain_core.messages import HumanMessage
+
+from service import DialogueProcessor
+from service.chat.history import HistoryCompactor
+from service.utils.checkpoint import SQLiteSaver
+from service.utils.lock import LocalThreadLock
+from benchmark.concurrency import SleepyChatModel
+
+
+async def run_session(checkpointer, turns, compactor = None):
+    chat = DialogueProcessor(SleepyChatModel(latency=0, reply="I am a knowledgeable AI agent"), checkpointer=checkpointer)
+    graph = chat.compile()
+    config = {"configurable": {"thread_id": "long-session"}}
+    lock = compactor.lock if compactor is not None else LocalThreadLock()
+
+    latencies = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        async with lock.hold("long-session"):
+            await graph.ainvoke({"messages": HumanMessage(content=f"message {turn}: " + "some words " * 20)}, config=config)
+        latencies.append(time.perf_counter() - start)
+        if compactor is not None:
+            compactor.schedule(graph, config)
+            # 两轮对话之间的用户思考时间，后台压缩在这段时间内完成
+            await asyncio.gather(*compactor.tasks.values())
+
+    snapshot = await graph.aget_state(config)
+    size = len(checkpointer.serde.dumps_typed(snapshot.values)[1])
+    return latencies, len(snapshot.values["messages"]), size
+
+
+def report(name, latencies, messages, size):
+    tenth = max(1, len(latencies) // 10)
+    first, last = latencies[:tenth], latencies[-tenth:]
+    print(f"{name:<20s} first 10%: {1000 * sum(first) / len(first):7.2f} ms, "
+          f"last 10%: {1000 * sum(last) / len(last):7.2f} ms, "
+          f"messages: {messages:5d}, state: {size / 1e3:8.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--slack", type=int, default=10)
+    parser.add_argument("--summarize", action="store_true", help="被移除的消息由假 LLM 生成摘要")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    print(f"turns: {args.turns}, window: {args.window}, slack: {args.slack}")
+
+    saver = SQLiteSaver(os.path.join(workdir, "full.sqlite"))
+    report("no compaction", *asyncio.run(run_session(saver, args.turns)))
+    saver.close()
+
+    compactor = HistoryCompactor(window=args.window, slack=args.slack, summarize=args.summarize,
+                                 llm=SleepyChatModel(latency=0, reply="summary of the earlier conversation"),
+                                 prompt="{summary}\n{args}\n{messages}", lock=LocalThreadLock())
+    saver = SQLiteSaver(os.path.join(workdir, "compacted.sqlite"))
+    report("sliding window", *asyncio.run(run_session(saver, args.turns, compactor)))
+    saver.close()
+    print(f"compactor: {compactor.stats()}")
+
+
+if __name__ == "__main__":
+    main()
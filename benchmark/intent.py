@@ -0,0 +1,87 @@
+"""
+本地意图分类器基准测试：按顺序回放一组带标签的对话，未命中的对话由“LLM”（这里直接使用真实标签并计入固定的延迟）标注后
+加入分类器的样本，统计命中率，命中部分的准确率，本地分类的延迟以及节省的 LLM 时间
+
+    python -m benchmark.intent --rounds 5 --llm-latency 0.8
+"""
+import time
+import random
+import argparse
+
+import yaml
+
+from service.chat.classifier import IntentClassifier
+
+TURNS = [
+    ("We received some data, could you help with processing it?", "pipeline"),
+    ("I need to process WES data for the project STING_UNLOCK", "pipeline"),
+    ("Please start a new analysis task with nfcore/sarek", "pipeline"),
+    ("Can you run the RNAseq pipeline on batch02?", "pipeline"),
+    ("Show me the status of my pipeline tasks", "pipeline"),
+    ("Delete the pipeline task for METAPRISM", "pipeline"),
+    ("I want to analyze WGS samples downloaded from iRODS", "pipeline"),
+    ("Launch the GeSA workflow for tumor vs normal samples", "pipeline"),
+    ("Could you list all running analysis tasks?", "pipeline"),
+    ("The data is on AWS, please download and process it", "pipeline"),
+    ("What are the symptoms of pneumonia in elderly patients?", "medical"),
+    ("What does a BRCA1 mutation mean for breast cancer risk?", "medical"),
+    ("Is this patient's tumor mutational burden high?", "medical"),
+    ("Explain the difference between tumor only and tumor vs normal in clinical terms", "medical"),
+    ("What treatments exist for EGFR mutated lung cancer?", "medical"),
+    ("How is microsatellite instability related to immunotherapy response?", "medical"),
+    ("What are the side effects of chemotherapy?", "medical"),
+    ("Can you recommend a good movie?", "other"),
+    ("Hello, how are you?", "other"),
+    ("Hi there", "other"),
+    ("What is the weather like today?", "other"),
+    ("Tell me a joke", "other"),
+]
+
+
+def perturb(text):
+    # 模拟用户的不同说法：随机去掉一个词，或者加上礼貌用语
+    words = text.split()
+    if len(words) > 4 and random.random() < 0.5:
+        words.pop(random.randrange(len(words)))
+    if random.random() < 0.3:
+        words = ["please,"] + words
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with open("config/prompts/DialogueProcessor.yaml", "r") as f:
+        examples = yaml.safe_load(f).get("examples")
+    classifier = IntentClassifier(examples)
+
+    correct = 0
+    for _ in range(args.rounds):
+        turns = TURNS[:]
+        random.shuffle(turns)
+        for text, label in turns:
+            text = perturb(text)
+            reply = classifier.predict(text)
+            if reply is None:
+                classifier.record(text, label, args.llm_latency)
+            elif classifier.label_of(reply) == label:
+                correct += 1
+            # 等待后台线程重建索引
+            while classifier.rebuilding:
+                time.sleep(0.001)
+
+    stats = classifier.stats()
+    print(f"turns: {stats['hits'] + stats['misses']}, examples: {stats['examples']}")
+    print(f"hit rate            : {stats['hit_rate'] * 100:8.1f} %")
+    print(f"accuracy on hits    : {correct / max(stats['hits'], 1) * 100:8.1f} %")
+    print(f"local latency       : {stats['local_latency_ms'] * 1000:8.1f} us")
+    print(f"llm time saved      : {stats['saved_seconds']:8.1f} s ({args.llm_latency}s per LLM classification)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+任务状态监控的 Redis 负载：--jobs 个任务在队列中等待时，统计监控 --ticks 个周期发送给 Redis 的命令数
+    polling: service/tasks/bundles/task.py 原来的方式，每个周期读取队列中的任务、每个任务的状态、StartedJobRegistry
+             和 FinishedJobRegistry
+    events:  JobStatusView 每个周期一个阻塞的 XREAD，另外每次状态变化一个 XADD（入队、开始、完成）
+使用 fakeredis，只统计命令数，不需要 Redis 服务
+
+    python -m benchmark.jobs --jobs 10 100 1000 --ticks 15
+"""
+import time
+import asyncio
+import argparse
+
+import fakeredis
+from rq import Queue
+from rq.registry import StartedJobRegistry, FinishedJobRegistry
+
+from service.tasks.events import JobEventPublisher, JobStatusView, STARTED, FINISHED
+
+
+class Counting:
+    """
+    统计 client 执行的 Redis 命令数，pipeline 中的命令分别计数
+    """
+    def __init__(self, client):
+        self.commands = 0
+        execute_command = client.execute_command
+
+        def counted(*args, **kwargs):
+            self.commands += 1
+            return execute_command(*args, **kwargs)
+        client.execute_command = counted
+
+        if hasattr(client, "pipeline"):
+            pipeline = client.pipeline
+
+            def counted_pipeline(*args, **kwargs):
+                pipe = pipeline(*args, **kwargs)
+                execute = pipe.execute
+
+                def counted_execute(*a, **kw):
+                    self.commands += len(pipe.command_stack)
+                    return execute(*a, **kw)
+                pipe.execute = counted_execute
+                return pipe
+            client.pipeline = counted_pipeline
+
+
+def polling(jobs: int, ticks: int) -> int:
+    client = fakeredis.FakeRedis()
+    queue = Queue("pipeline", connection=client)
+    for _ in range(jobs):
+        queue.enqueue(time.sleep, 5)
+
+    counter = Counting(client)
+    for _ in range(ticks):
+        for job in queue.get_jobs():
+            job.get_status()
+        StartedJobRegistry(queue.name, connection=client).get_job_ids()
+        FinishedJobRegistry(queue.name, connection=client).get_job_ids()
+    return counter.commands
+
+
+def events(jobs: int, ticks: int) -> int:
+    server = fakeredis.FakeServer()
+    client, aclient = fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+    queue = Queue("pipeline", connection=fakeredis.FakeRedis(server=server))
+    publisher = JobEventPublisher(client)
+    counter, acounter = Counting(client), Counting(aclient)
+    job_ids = [publisher.enqueue(queue, time.sleep, 5).id for _ in range(jobs)]
+
+    async def run():
+        view = JobStatusView(aclient, block_ms=1)
+        for tick in range(ticks):
+            # 第一个周期所有任务开始，最后一个周期所有任务完成
+            if tick in (0, ticks - 1):
+                for job_id in job_ids:
+                    publisher.publish(job_id, STARTED if tick == 0 else FINISHED)
+            await view.read()
+        assert len(view.snapshot()) == jobs
+    asyncio.run(run())
+    return counter.commands + acounter.commands
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--ticks", type=int, default=15)
+    args = parser.parse_args()
+
+    print(f"{'jobs':>6s} {'polling':>10s} {'per tick':>9s} {'events':>8s} {'per tick':>9s} {'xadd':>6s}")
+    for jobs in args.jobs:
+        polled, streamed = polling(jobs, args.ticks), events(jobs, args.ticks)
+        # events 中 3 * jobs 个 XADD 与状态变化的次数成正比，其余是每个周期一个 XREAD
+        reads = streamed - 3 * jobs
+        print(f"{jobs:6d} {polled:10d} {polled / args.ticks:9.1f} {reads:8d} {reads / args.ticks:9.1f} {3 * jobs:6d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+服务的负载测试：LLM 使用确定性的假模型（config/model.yaml 中 backend: fake，见 service/utils/fake_llm.py），
+用 uvicorn 启动 main:app，并发用户持续请求 /v1/chat/completions，每个场景使用一个新启动的服务
+    chat:      非流式的单轮对话，意图分类之后回复自我介绍
+    stream:    与 chat 相同的流式对话，记录首 token 时间（第一个内容数据块）
+    interrupt: 流式的三轮对话，pipeline -> medical 触发话题切换的 interrupt，第三轮回答 yes 恢复执行
+结果包括吞吐量、延迟和首 token 时间的 p50/p95/p99，以及负载前后服务进程的 RSS，
+--save 保存为 JSON 基线，--baseline 与之前保存的基线比较，任何指标变差超过 --tolerance 时返回非零的退出码
+
+    python -m benchmark.load --concurrency 16 --duration 20 --save benchmark/baselines/load.json
+    python -m benchmark.load --concurrency 16 --duration 20 --baseline benchmark/baselines/load.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+
+import yaml
+import httpx
+
+from benchmark.workers import ROOT, free_port, start_service
+
+SCENARIOS = ("chat", "stream", "interrupt")
+HELLO = "Hello, how are you?"
+PIPELINE = "We received some data, could you help with processing it ?"
+MEDICAL = "What are the symptoms of pneumonia in elderly patients?"
+
+
+def prepare_workdir(latency: float, tokens_per_second: float) -> str:
+    """
+    复制 config 目录，LLM 使用假模型；关闭本地意图分类器（分类结果随对话记录变化）和用户预算，
+    服务预热和其他配置与生产环境相同
+    """
+    workdir = tempfile.mkdtemp(prefix="pipeline-agent-")
+    shutil.copytree(os.path.join(ROOT, "config"), os.path.join(workdir, "config"))
+
+    model_file = os.path.join(workdir, "config", "model.yaml")
+    with open(model_file) as f:
+        model = yaml.safe_load(f)
+    model["backend"] = "fake"
+    model["fake"].update({"latency": latency, "tokens_per_second": tokens_per_second})
+    with open(model_file, "w") as f:
+        yaml.safe_dump(model, f)
+
+    service_file = os.path.join(workdir, "config", "service.yaml")
+    with open(service_file) as f:
+        service = yaml.safe_load(f)
+    service["intent_classifier"]["enabled"] = False
+    service["usage"].update({"max_requests": None, "max_tokens": None})
+    with open(service_file, "w") as f:
+        yaml.safe_dump(service, f, allow_unicode=True)
+    return workdir
+
+
+def rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {f"p{p}": 1000 * values[min(len(values) - 1, int(len(values) * p / 100))] for p in (50, 95, 99)}
+
+
+async def stream(client: httpx.AsyncClient, body: dict) -> tuple[float, str]:
+    """
+    返回 (首 token 时间, 完整的回复内容)
+    """
+    start = time.perf_counter()
+    first, content = None, []
+    async with client.stream("POST", "/v1/chat/completions", json={**body, "stream": True}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: {"):
+                continue
+            choices = json.loads(line[6:])["choices"]
+            text = choices[0]["delta"].get("content") if choices else None
+            if text:
+                if first is None:
+                    first = time.perf_counter() - start
+                content.append(text)
+    return first, "".join(content)
+
+
+async def turn(client, scenario: str, samples: dict):
+    chat_id = str(uuid.uuid4())
+
+    def body(text):
+        return {"messages": [{"role": "user", "content": text}], "metadata": {"chat_id": chat_id, "user_id": chat_id}}
+
+    if scenario == "chat":
+        start = time.perf_counter()
+        response = await client.post("/v1/chat/completions", json=body(HELLO))
+        response.raise_for_status()
+        samples["latency"].append(time.perf_counter() - start)
+        return
+
+    texts = [HELLO] if scenario == "stream" else [PIPELINE, MEDICAL, "yes"]
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        first, content = await stream(client, body(text))
+        samples["latency"].append(time.perf_counter() - start)
+        if first is not None:
+            samples["ttft"].append(first)
+        # 第二轮应当返回确认话题切换的问题（interrupt）
+        if scenario == "interrupt" and i == 1 and "'yes' or 'no'" not in content:
+            raise RuntimeError(f"expected an interrupt, got: {content!r}")
+
+
+async def load(port: int, scenario: str, concurrency: int, duration: float) -> dict:
+    samples = {"latency": [], "ttft": [], "errors": 0}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        async def user():
+            while time.perf_counter() < deadline:
+                try:
+                    await turn(client, scenario, samples)
+                except (httpx.HTTPError, RuntimeError):
+                    samples["errors"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(samples["latency"]),
+        "errors": samples["errors"],
+        "throughput": len(samples["latency"]) / elapsed,
+        "latency_ms": percentiles(samples["latency"]),
+        "ttft_ms": percentiles(samples["ttft"]),
+    }
+
+
+def run_scenario(workdir: str, scenario: str, args) -> dict:
+    port = free_port()
+    service = start_service(workdir, 1, port)
+    try:
+        deadline = time.time() + 60
+        while httpx.get(f"http://127.0.0.1:{port}/ready").status_code != 200 and time.time() < deadline:
+            time.sleep(0.1)
+        # 预热之后再记录 RSS，不计入导入和第一次请求时创建的对象
+        asyncio.run(load(port, scenario, 1, 1))
+        before = rss_mb(service.pid)
+        result = asyncio.run(load(port, scenario, args.concurrency, args.duration))
+        after = rss_mb(service.pid)
+    finally:
+        service.terminate()
+        service.wait()
+    if before is not None and after is not None:
+        result["rss_mb"] = {"before": before, "after": after, "growth": after - before}
+    return result
+
+
+def regressions(current: dict, baseline: dict, tolerance: float, rss_slack: float) -> list[str]:
+    """
+    延迟、首 token 时间和 RSS 增长越大越差，吞吐量越小越差；RSS 增长另外允许 rss_slack MB 的波动
+    """
+    found = []
+    for scenario, base in baseline["results"].items():
+        now = current["results"].get(scenario)
+        if now is None:
+            continue
+        if now["throughput"] < base["throughput"] * (1 - tolerance):
+            found.append(f"{scenario} throughput {base['throughput']:.1f} -> {now['throughput']:.1f} req/s")
+        for metric in ("latency_ms", "ttft_ms"):
+            for p, value in base.get(metric, {}).items():
+                if p in now.get(metric, {}) and now[metric][p] > value * (1 + tolerance):
+                    found.append(f"{scenario} {metric} {p} {value:.1f} -> {now[metric][p]:.1f} ms")
+        if "rss_mb" in base and "rss_mb" in now:
+            if now["rss_mb"]["growth"] > base["rss_mb"]["growth"] * (1 + tolerance) + rss_slack:
+                found.append(f"{scenario} rss growth {base['rss_mb']['growth']:.1f} -> {now['rss_mb']['growth']:.1f} MB")
+        if now["errors"] > base["errors"]:
+            found.append(f"{scenario} errors {base['errors']} -> {now['errors']}")
+    return found
+
+
+def report(scenario: str, result: dict):
+    latency, ttft = result["latency_ms"], result["ttft_ms"]
+    line = (f"{scenario:10s} {result['throughput']:7.1f} req/s, errors {result['errors']}, "
+            f"latency p50/p95/p99 {latency.get('p50', 0):7.1f} / {latency.get('p95', 0):7.1f} / {latency.get('p99', 0):7.1f} ms")
+    if ttft:
+        line += f", ttft p50/p95/p99 {ttft['p50']:6.1f} / {ttft['p95']:6.1f} / {ttft['p99']:6.1f} ms"
+    if "rss_mb" in result:
+        line += f", rss {result['rss_mb']['before']:.0f} -> {result['rss_mb']['after']:.0f} MB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="假 LLM 第一个 token 之前的延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="假 LLM 每秒生成的 token 数")
+    parser.add_argument("--save", default=None, help="把结果保存为 JSON 基线")
+    parser.add_argument("--baseline", default=None, help="与 JSON 基线比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对变化")
+    parser.add_argument("--rss-slack", type=float, default=20, help="RSS 增长额外允许的波动（MB）")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir(args.latency, args.tokens_per_second)
+    current = {
+        "config": {"concurrency": args.concurrency, "duration": args.duration,
+                   "latency": args.latency, "tokens_per_second": args.tokens_per_second},
+        "machine": {"cpus": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()},
+        "results": {},
+    }
+    print(f"cpus: {os.cpu_count()}, concurrency: {args.concurrency}, duration: {args.duration}s, "
+          f"fake LLM latency: {args.latency}s, {args.tokens_per_second} tokens/s")
+    try:
+        for scenario in args.scenarios:
+            current["results"][scenario] = run_scenario(workdir, scenario, args)
+            report(scenario, current["results"][scenario])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"saved baseline to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != current["config"]:
+            print(f"warning: baseline was measured with {baseline.get('config')}")
+        found = regressions(current, baseline, args.tolerance, args.rss_slack)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
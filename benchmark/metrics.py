@@ -0,0 +1,74 @@
+"""
+Prometheus 指标的开销：DialogueProcessor 在 tokens 模式下逐 token 流式输出（与服务相同的 stream_mode），
+比较不传 callbacks 与传入 MetricsCallbackHandler 时每轮对话的耗时
+
+LLM 没有延迟时得到指标的绝对开销（最坏情况），再按 --latency 估算它在一轮真实对话中所占的比例
+
+    python -m benchmark.metrics --turns 300 --latency 1.0
+"""
+import time
+import uuid
+import asyncio
+import argparse
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from service import DialogueProcessor
+from service.utils.metrics import ServiceMetrics
+from benchmark.concurrency import SleepyChatModel
+
+REPLY = "I am a knowledgeable AI agent, I can help you create and manage data processing pipelines for your projects"
+
+
+async def run_turns(turns: int, callbacks: list) -> float:
+    chat = DialogueProcessor(SleepyChatModel(latency=0, reply=REPLY), checkpointer=MemorySaver())
+    graph = chat.compile()
+    elapsed = 0.0
+    for turn in range(turns):
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}, "callbacks": callbacks}
+        start = time.perf_counter()
+        async for _ in graph.astream({"messages": HumanMessage(content=f"message {turn}")}, config=config,
+                                     stream_mode=["messages", "updates"]):
+            pass
+        elapsed += time.perf_counter() - start
+    return elapsed / turns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=1.0, help="真实对话中一轮 LLM 调用的耗时（秒），用于估算开销的比例")
+    args = parser.parse_args()
+
+    metrics = ServiceMetrics()
+    asyncio.run(run_turns(20, []))
+    # 交替运行，取最快的一次，减少其他进程和 GC 的干扰
+    plain, instrumented = [], []
+    for _ in range(args.repeat):
+        plain.append(asyncio.run(run_turns(args.turns, [])))
+        instrumented.append(asyncio.run(run_turns(args.turns, [metrics.callback])))
+    plain, instrumented = min(plain), min(instrumented)
+    overhead = instrumented - plain
+
+    print(f"turns: {args.turns}, tokens per reply: {len(REPLY.split(' '))}")
+    print(f"no metrics       : {1000 * plain:7.3f} ms/turn")
+    print(f"metrics callback : {1000 * instrumented:7.3f} ms/turn")
+    print(f"overhead         : {1e6 * overhead:7.1f} us/turn, "
+          f"{100 * overhead / plain:5.2f}% of a zero-latency turn, "
+          f"{100 * overhead / (plain + args.latency):6.3f}% of a turn with {args.latency:.1f}s LLM latency")
+    content, _ = metrics.render()
+    print(f"/metrics         : {len(content)} bytes, render "
+          f"{1e6 * min(timeit(metrics.render) for _ in range(5)):.0f} us")
+
+
+def timeit(func, n=100):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    main()
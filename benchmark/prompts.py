@@ -0,0 +1,39 @@
+"""
+prompt 组装基准测试：比较每轮对话重新构建 task_new 模板（load_prompts）与使用缓存模板（new_pipeline_task_prompt）的耗时
+
+    python -m benchmark.prompts --turns 200
+"""
+import time
+import argparse
+
+from service.chat.states import PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder, late_bound_dict, values_dict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    builder = pipeline_prompt_builder()
+    state = PipelineState(messages=[])
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        d = {**late_bound_dict, **{name: str(state.args.get(key)) for name, key in values_dict.items()}}
+        builder.load_prompts("task_new", "formatter", d)
+        builder.load_prompts("task_new", "question", d)
+    rebuild = (time.perf_counter() - start) / args.turns
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        builder.new_pipeline_task_prompt(state)
+    cached = (time.perf_counter() - start) / args.turns
+
+    print(f"rebuild templates per turn : {rebuild * 1000:8.3f} ms")
+    print(f"cached templates per turn  : {cached * 1000:8.3f} ms")
+    print(f"speedup                    : {rebuild / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+checkpoint 序列化的基准测试：会话中已有 10/100/1000 条消息时，每个图步骤追加一条消息并写入 messages 和 args，
+比较每步写入的字节数、序列化耗时以及读取最新值的耗时
+    jsonplus:            langgraph 默认的序列化，每步写入完整的消息列表（当前的行为）
+    typed-msgpack:       按固定的 schema 序列化，每步写入完整的消息列表
+    typed-msgpack+delta: 按固定的 schema 序列化，messages 只写入新增的消息，每 snapshot_every 步写入一次完整的列表
+
+    python -m benchmark.serde --sizes 10 100 1000 --steps 200
+"""
+import time
+import argparse
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from service.chat.states import PipelineState
+from service.utils.checkpoint import ChannelDeltas
+from service.utils.serde import TypedMsgpackSerializer
+
+
+def message(i: int):
+    if i % 2:
+        return AIMessage(content=f"Which sequencing species does batch {i} use? Please also confirm the analysis mode.",
+                         response_metadata={"model": "qwen2.5", "done": True})
+    return HumanMessage(content=f"The batch {i} is human whole genome sequencing data from our cloud storage.")
+
+
+def run(serde, size: int, steps: int, snapshot_every = None):
+    deltas = ChannelDeltas(serde, snapshot_every=snapshot_every)
+    messages = [message(i) for i in range(size)]
+    args = PipelineState(messages=[]).args
+    store = {}
+
+    written, elapsed = 0, 0.0
+    for step in range(steps):
+        messages = messages + [message(size + step)]
+        start = time.perf_counter()
+        version = f"{step:08}"
+        type_, blob = deltas.dumps("thread", "", "messages", version, messages)
+        args_type, args_blob = serde.dumps_typed(args)
+        elapsed += time.perf_counter() - start
+        store[version] = (type_, blob)
+        written += len(blob) + len(args_blob)
+
+    start = time.perf_counter()
+    loaded = deltas.loads("thread", "", "messages", version, *store[version], fetch=store.__getitem__)
+    load_time = time.perf_counter() - start
+    assert loaded == messages
+    return written / steps, elapsed / steps, load_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--snapshot-every", type=int, default=20)
+    args = parser.parse_args()
+
+    serializers = [
+        ("jsonplus", JsonPlusSerializer(), None),
+        ("typed-msgpack", TypedMsgpackSerializer(), None),
+        ("typed-msgpack+delta", TypedMsgpackSerializer(), args.snapshot_every),
+    ]
+    print(f"{'messages':>8s}  {'serializer':<20s} {'bytes/step':>12s} {'dump ms/step':>13s} {'load ms':>9s}")
+    for size in args.sizes:
+        for name, serde, snapshot_every in serializers:
+            written, dump_time, load_time = run(serde, size, args.steps, snapshot_every)
+            print(f"{size:8d}  {name:<20s} {written:12.0f} {dump_time * 1000:13.3f} {load_time * 1000:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+SSE 编码的基准测试：streams 个并发的流式响应，每个响应以 rate token/s 的速度输出 tokens 个 token，
+通过 StreamingResponse 写入 socket（另一端由线程读取，每次写入一次 send 系统调用），
+比较每个 CPU 核心每秒能处理的 token 数（包括假 LLM 和读取端的开销）和写入次数
+    json.dumps:  每个 token 构造完整的 dict 并用 json.dumps 编码（之前的 build_stream_response）
+    encoder:     SSEEncoder，公共部分只编码一次，每个 token 一个数据帧
+    coalesce:    SSEEncoder + coalesce，flush_interval 秒内的 token 合并为一个数据帧
+
+    python -m benchmark.sse --streams 200 --tokens 200 --rate 50 --flush-interval 0.05
+"""
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+from starlette.responses import StreamingResponse
+
+from service.chat.stream import SSEEncoder, coalesce
+
+
+def build_stream_response(input_text, thread_id, delta, finish_reason = None):
+    return "data: " + json.dumps({
+        "id": f"chatcmpl-{hash(input_text) % 10000}",
+        "object": "chat.completion.chunk",
+        "created": int(__import__("time").time()),
+        "model": "pipeline-agent",
+        "thread_id": thread_id,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
+        }]
+    }) + "\n\n"
+
+
+async def tokens(n, rate):
+    for i in range(n):
+        await asyncio.sleep(1 / rate)
+        yield f" token{i}"
+
+
+async def stream(mode, n, rate, flush_interval, i, sock):
+    input_text, thread_id = "Hello, how are you?", f"thread-{i}"
+    if mode == "json.dumps":
+        async def body():
+            yield build_stream_response(input_text, thread_id, {"role": "assistant"})
+            async for token in tokens(n, rate):
+                yield build_stream_response(input_text, thread_id, {"content": token})
+            yield build_stream_response(input_text, thread_id, {}, "stop")
+            yield "data: [DONE]\n\n"
+        iterator = body()
+    else:
+        encoder = SSEEncoder(thread_id, input_text)
+
+        async def events():
+            yield encoder.frame({"role": "assistant"})
+            async for token in tokens(n, rate):
+                yield token
+            yield encoder.frame({}, "stop")
+            yield encoder.DONE
+        iterator = coalesce(events(), encoder, flush_interval if mode == "coalesce" else 0.0)
+
+    writes = 0
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal writes
+        if message["type"] == "http.response.body" and message["body"]:
+            sock.send(message["body"])
+            writes += 1
+
+    await StreamingResponse(iterator, media_type="text/event-stream")({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    return writes
+
+
+async def run(mode, streams, n, rate, flush_interval):
+    sender, reader = socket.socketpair()
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+
+    def drain():
+        while reader.recv(1 << 16):
+            pass
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    start, cpu = time.perf_counter(), time.process_time()
+    writes = await asyncio.gather(*[stream(mode, n, rate, flush_interval, i, sender) for i in range(streams)])
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    sender.close()
+    thread.join()
+    return elapsed, cpu, sum(writes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="每个响应每秒输出的 token 数")
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    total = args.streams * args.tokens
+    print(f"streams: {args.streams}, tokens per stream: {args.tokens}, rate: {args.rate:.0f} token/s, "
+          f"flush_interval: {args.flush_interval}")
+    for mode in ("json.dumps", "encoder", "coalesce"):
+        elapsed, cpu, writes = asyncio.run(run(mode, args.streams, args.tokens, args.rate, args.flush_interval))
+        print(f"{mode:<10s}: {total / cpu:10.0f} tokens/s per core, {writes:7d} writes, "
+              f"cpu {cpu:6.2f} s, wall {elapsed:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
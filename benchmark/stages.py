@@ -0,0 +1,120 @@
+"""
+工作流程阶段调度的基准测试，比较以下调度方式的端到端耗时：
+    linear:  按 LINEAR_STAGE_DEPENDENCIES 九个阶段依次执行，每个阶段整体处理所有样本
+    dag:     按 STAGE_DEPENDENCIES 调度（备份和通知并发执行），每个阶段整体处理所有样本
+    samples: 按 STAGE_DEPENDENCIES 调度，SAMPLE_STAGES 按样本拆分，最多同时处理 --max-concurrency 个样本
+每个阶段的 running 节点等待模拟的执行时间（--scale 倍）并且总是成功，不经过 failed / auto-resume；
+SAMPLE_STAGES 中的阶段每个样本需要 STAGE_SECONDS 的时间，整体处理时为样本数倍，第一个样本慢 --slow 倍
+
+    python -m benchmark.stages --runs 5 --scale 1.0
+    python -m benchmark.stages --samples 24 --max-concurrency 8 --scale 0.2
+"""
+import io
+import time
+import contextlib
+import argparse
+import statistics
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from service.chat.pipeline.stage.pipeline import (PipelineWorkflow, PipelineStatus, AnalysisWorkflowStages,
+                                                  STAGE_DEPENDENCIES, LINEAR_STAGE_DEPENDENCIES, SAMPLE_STAGES)
+
+# 模拟的各阶段执行时间（秒）
+STAGE_SECONDS = {
+    AnalysisWorkflowStages.INIT:          0.05,
+    AnalysisWorkflowStages.DOWNLOADING:   0.30,
+    AnalysisWorkflowStages.MD5CHECKING:   0.20,
+    AnalysisWorkflowStages.DATAPREPARING: 0.10,
+    AnalysisWorkflowStages.ANALYZING:     0.50,
+    AnalysisWorkflowStages.BACKINGUP:     0.30,
+    AnalysisWorkflowStages.CLEANINGUP:    0.10,
+    AnalysisWorkflowStages.NOTIFY:        0.20,
+    AnalysisWorkflowStages.COMPLETED:     0.01,
+}
+
+
+class SimulatedWorkflow(PipelineWorkflow):
+    """
+    running 节点等待阶段的模拟执行时间
+    """
+    def __init__(self, dependencies, scale: float = 1.0, samples: int = 1, slow: float = 1.0, **kwargs):
+        self.scale = scale
+        self.samples = samples
+        self.slow = slow
+        super().__init__(checkpointer=MemorySaver(), dependencies=dependencies, **kwargs)
+
+    def pipeline_init(self, state):
+        return state
+
+    def seconds(self, stage: AnalysisWorkflowStages, sample) -> float:
+        seconds = STAGE_SECONDS[stage] * self.scale
+        if stage not in SAMPLE_STAGES:
+            return seconds
+        if sample is None:
+            return seconds * (self.samples - 1 + self.slow)
+        return seconds * (self.slow if sample == "s0" else 1)
+
+    def pipeline_running(self, state):
+        time.sleep(self.seconds(AnalysisWorkflowStages(state.stage), state.sample))
+        state.messages += [f"{state.label}: done"]
+        return state
+
+    def pipeline_completed(self, state):
+        return state
+
+    def route_state_running(self, state):
+        return PipelineStatus.COMPLETED.value
+
+
+def critical_path(workflow: SimulatedWorkflow) -> float:
+    """
+    不限制并发时的理论耗时；按样本拆分的阶段取决于最慢的样本
+    """
+    finish = {}
+    for stage, deps in workflow.dependencies.items():
+        seconds = workflow.seconds(stage, "s0" if stage in workflow.sample_stages else None)
+        finish[stage] = max((finish[d] for d in deps), default=0) + seconds
+    return max(finish.values())
+
+
+def measure(dependencies, args, sample_stages=()) -> dict:
+    start = time.perf_counter()
+    workflow = SimulatedWorkflow(dependencies, args.scale, args.samples, args.slow,
+                                 sample_stages=sample_stages, max_concurrency=args.max_concurrency)
+    graph = workflow.compile()
+    build = time.perf_counter() - start
+
+    samples = [f"s{i}" for i in range(args.samples)]
+    wall = []
+    for i in range(args.runs):
+        start = time.perf_counter()
+        # 不输出阶段节点打印的日志
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = graph.invoke({"messages": ["start"], "samples": samples}, {"configurable": {"thread_id": str(i)}})
+        wall.append(time.perf_counter() - start)
+        assert all(r["status"] == "completed" for stage in result["results"].values() for r in stage.values())
+    return {"build": build, "wall": statistics.median(wall), "critical_path": critical_path(workflow)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="模拟执行时间的倍数")
+    parser.add_argument("--samples", type=int, default=1, help="项目中的样本数")
+    parser.add_argument("--slow", type=float, default=1.0, help="第一个样本的执行时间是其他样本的倍数")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="同时处理的样本数")
+    args = parser.parse_args()
+
+    results = {"linear": measure(LINEAR_STAGE_DEPENDENCIES, args), "dag": measure(STAGE_DEPENDENCIES, args)}
+    if args.samples > 1:
+        results["samples"] = measure(STAGE_DEPENDENCIES, args, SAMPLE_STAGES)
+    print(f"samples: {args.samples}, max concurrency: {args.max_concurrency}, scale: {args.scale}")
+    for name, result in results.items():
+        print(f"{name:7s} build + compile {1000 * result['build']:6.1f} ms, "
+              f"wall (median of {args.runs}) {result['wall']:.3f} s, critical path {result['critical_path']:.3f} s, "
+              f"speed-up {results['linear']['wall'] / result['wall']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
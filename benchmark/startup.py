@@ -0,0 +1,121 @@
+"""
+启动时间基准测试：在新进程中启动 uvicorn main:app，测量从启动进程到第一个请求完成的时间（冷启动），
+并输出 python -X importtime 中累计耗时最多的模块，以及服务记录的各启动阶段耗时（/v1/startup/stats）
+
+LLM 使用 OpenAI 兼容的假服务（benchmark.workers.serve_llm），第一个请求为非流式的 /v1/chat/completions
+--root 可以指定另一个代码目录（例如 git worktree），比较修改前后的启动时间
+
+    python -m benchmark.startup --runs 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import yaml
+import httpx
+
+from benchmark.workers import ROOT, free_port, serve_llm
+
+
+def prepare_workdir(root: str, llm_port: int, backend: str) -> str:
+    workdir = tempfile.mkdtemp(prefix="pipeline-agent-")
+    shutil.copytree(os.path.join(root, "config"), os.path.join(workdir, "config"))
+    model_file = os.path.join(workdir, "config", "model.yaml")
+    with open(model_file) as f:
+        model = yaml.safe_load(f)
+    if backend == "vllm":
+        model["backend"] = "vllm"
+        model["vllm"]["base_url"] = f"http://127.0.0.1:{llm_port}/v1"
+    with open(model_file, "w") as f:
+        yaml.safe_dump(model, f)
+    return workdir
+
+
+def cold_start(root: str, workdir: str, port: int) -> tuple[float, float, float, dict]:
+    """
+    返回 (/v1/models 可用的时间, 模型预热完成（/ready 返回 200）的时间, 第一个对话请求完成的时间, /v1/startup/stats)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env={**os.environ, "PYTHONPATH": root}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while True:
+                try:
+                    client.get("/v1/models").raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None:
+                        raise RuntimeError("service exited during startup")
+                    time.sleep(0.01)
+            listening = time.perf_counter() - start
+            # 没有 /ready 的版本（404）在服务启动后即视为就绪
+            while client.get("/ready").status_code == 503:
+                time.sleep(0.01)
+            ready = time.perf_counter() - start
+            body = {"messages": [{"role": "user", "content": "Hello, who are you?"}], "metadata": {"chat_id": "startup"}}
+            client.post("/v1/chat/completions", json=body).raise_for_status()
+            served = time.perf_counter() - start
+            response = client.get("/v1/startup/stats")
+            stats = response.json() if response.status_code == 200 else {}
+        return listening, ready, served, stats
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_profile(root: str, workdir: str, top: int) -> list[tuple[int, str]]:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=workdir, env={**os.environ, "PYTHONPATH": root}, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                modules.append((int(cumulative), name.rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--root", default=ROOT, help="启动该目录中的 main.py")
+    parser.add_argument("--backend", choices=["vllm", "ollama"], default="vllm",
+                        help="ollama 不连接模型服务，只测量导入和创建客户端的开销，对话请求会失败")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    llm_port = free_port()
+    llm = multiprocessing.Process(target=serve_llm, args=(llm_port, 0.0), daemon=True)
+    llm.start()
+    workdir = prepare_workdir(args.root, llm_port, args.backend)
+    try:
+        listening, ready, served, stats = [], [], [], {}
+        for _ in range(args.runs):
+            l, r, s, stats = cold_start(args.root, workdir, free_port())
+            listening.append(l)
+            ready.append(r)
+            served.append(s)
+        print(f"root: {args.root}, backend: {args.backend}, runs: {args.runs}")
+        print(f"process start -> /v1/models   : {1000 * sorted(listening)[len(listening) // 2]:8.0f} ms (median)")
+        print(f"process start -> /ready       : {1000 * sorted(ready)[len(ready) // 2]:8.0f} ms (median)")
+        print(f"process start -> first answer : {1000 * sorted(served)[len(served) // 2]:8.0f} ms (median)")
+        if stats:
+            print("startup stages (last run)     : " +
+                  ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in stats["stages_ms"].items()))
+        print("slowest imports (cumulative):")
+        for us, name in import_profile(args.root, workdir, args.top):
+            print(f"  {us / 1000:8.1f} ms  {name}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        llm.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+新建任务对话基准测试：比较 formatter + question 两次 LLM 调用与一次结构化输出调用的每轮耗时
+
+    python -m benchmark.structured --latency 0.5
+"""
+import json
+import time
+import argparse
+
+from service.chat.states import PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder
+
+from benchmark.concurrency import SleepyChatModel
+
+# (用户输入, 结构化输出)
+TURNS = [
+    ("I have a batch of WES data from the project METAPRISM, please start the first batch processing.",
+     {"project_name": "METAPRISM", "batch_id": "batch01", "sequencing_type": "WES",
+      "message": "What is the name of the pipeline it needs to run, GeSA or nfcore/Sarek ?"}),
+    ("Please use GeSA.", {"pipeline_name": "GeSA", "message": "Which species is the data from, human or mouse ?"}),
+    ("It is human.", {"sequencing_species": "human", "message": "Please provide the mode of analysis, TvN or Tonly."}),
+    ("It is TvN.", {"analysis_mode": "TvN", "message": "Which data source is the data from, iRODS, AWS, Storage, or Scratch ?"}),
+    ("It is from iRODS.", {"data_source_type": "iRODS", "message": "All the information is collected. Please confirm the information."}),
+]
+
+
+def run(structured, latency):
+    builder = pipeline_prompt_builder(structured_output=structured)
+    state = PipelineState(messages=[])
+    start = time.perf_counter()
+    for user_input, output in TURNS:
+        # 多行 JSON 同时可以被两次调用路径中的 formatter_update_state 解析
+        llm = SleepyChatModel(latency=latency, reply=json.dumps(output, indent=1))
+        builder.new_pipeline_task_chain(llm, state).invoke({"user_input": user_input})
+    elapsed = (time.perf_counter() - start) / len(TURNS)
+    return elapsed, {k: state.args.get(k) for k in ("project_name", "pipeline_name", "data_source_type")}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5, help="每次 LLM 调用的延迟（秒）")
+    args = parser.parse_args()
+
+    two_calls, two_calls_args = run(False, args.latency)
+    one_call, one_call_args = run(True, args.latency)
+    assert two_calls_args == one_call_args, (two_calls_args, one_call_args)
+
+    print(f"formatter + question per turn : {two_calls * 1000:8.1f} ms")
+    print(f"structured output per turn    : {one_call * 1000:8.1f} ms")
+    print(f"speedup                       : {two_calls / one_call:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+首 token 时间（time-to-first-token）基准测试：比较 config/service.yaml 中 stream.mode 为 nodes 和 tokens 时，
+客户端收到第一个内容数据块的时间以及完整响应的时间
+
+    python -m benchmark.ttft --words 64 --token-latency 0.02
+"""
+import json
+import time
+import asyncio
+import argparse
+
+from starlette.requests import Request
+
+import main
+from service import DialogueProcessor
+from benchmark.concurrency import SleepyChatModel
+
+
+async def post(body):
+    # 直接调用端点并迭代 StreamingResponse，避免 ASGI 测试客户端缓存整个响应体
+    payload = json.dumps(body).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+    return await main.chat_completions(request)
+
+
+async def measure(stream_tokens, n):
+    main.stream_tokens = stream_tokens
+    ttft, total = [], []
+    for i in range(n):
+        body = {"messages": [{"role": "user", "content": "Hello, how are you?"}],
+                "stream": True,
+                "metadata": {"chat_id": f"ttft-{stream_tokens}-{i}"}}
+        start = time.perf_counter()
+        first = None
+        response = await post(body)
+        async for chunk in response.body_iterator:
+            # 合并输出时一次写入可能包含多个数据帧
+            for frame in chunk.split(b"\n\n"):
+                if first is None and frame.startswith(b"data: {"):
+                    if json.loads(frame[6:])["choices"][0]["delta"].get("content"):
+                        first = time.perf_counter() - start
+        ttft.append(first)
+        total.append(time.perf_counter() - start)
+    return sum(ttft) / n, sum(total) / n
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--words", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    reply = " ".join(["token"] * args.words)
+    main.chat = DialogueProcessor(SleepyChatModel(latency=args.latency, token_latency=args.token_latency, reply=reply))
+    main.chat.compile()
+
+    for mode, stream_tokens in (("nodes", False), ("tokens", True)):
+        ttft, total = asyncio.run(measure(stream_tokens, args.requests))
+        print(f"{mode:6s}: time-to-first-token {ttft * 1000:8.1f} ms, full response {total * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main_()
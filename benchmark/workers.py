@@ -0,0 +1,172 @@
+"""
+多 worker 负载测试：会话和中断保存在 Redis 中时，使用 uvicorn --workers N 启动 main:app，
+比较不同 worker 数量下 /v1/chat/completions 的吞吐量
+
+LLM 使用 OpenAI 兼容的假服务（固定延迟），Redis 默认使用 fakeredis 的 TCP 服务，也可以通过 --redis-url 使用真实的 Redis
+
+    python -m benchmark.workers --workers 1 2 4 --concurrency 64 --duration 10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_llm(port: int, latency: float):
+    """
+    OpenAI 兼容的假 LLM 服务：等待 latency 秒后回复 "pipeline"
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            content = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "pipeline"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def serve_redis(port: int):
+    from fakeredis import TcpFakeServer
+    TcpFakeServer(("127.0.0.1", port)).serve_forever()
+
+
+def prepare_workdir(redis_url: str, llm_port: int) -> str:
+    """
+    复制 config 目录，LLM 使用假服务，会话、中断和会话锁使用 Redis，关闭准入控制
+    """
+    workdir = tempfile.mkdtemp(prefix="pipeline-agent-")
+    shutil.copytree(os.path.join(ROOT, "config"), os.path.join(workdir, "config"))
+
+    model_file = os.path.join(workdir, "config", "model.yaml")
+    with open(model_file) as f:
+        model = yaml.safe_load(f)
+    model["backend"] = "vllm"
+    model["vllm"].update({"base_url": f"http://127.0.0.1:{llm_port}/v1", "max_in_flight": 256})
+    with open(model_file, "w") as f:
+        yaml.safe_dump(model, f)
+
+    service_file = os.path.join(workdir, "config", "service.yaml")
+    with open(service_file) as f:
+        service = yaml.safe_load(f)
+    service["checkpointer"]["type"] = "redis"
+    service["session"]["store"] = "redis"
+    service["redis"]["url"] = redis_url
+    service["admission"] = {}
+    with open(service_file, "w") as f:
+        yaml.safe_dump(service, f, allow_unicode=True)
+    return workdir
+
+
+def start_service(workdir: str, workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/v1/models").status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("service did not start")
+
+
+async def load(port: int, concurrency: int, duration: float, chats: int) -> float:
+    done = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        async def user(i):
+            nonlocal done
+            n = 0
+            while time.perf_counter() < deadline:
+                body = {"messages": [{"role": "user", "content": "We received some data, could you help with processing it ?"}],
+                        "metadata": {"chat_id": f"chat-{(i + n * concurrency) % chats}", "user_id": f"user-{i}"}}
+                response = await client.post("/v1/chat/completions", json=body)
+                response.raise_for_status()
+                done += 1
+                n += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[user(i) for i in range(concurrency)])
+        return done / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--chats", type=int, default=256, help="会话数量，同一会话的多轮对话由会话锁依次执行")
+    parser.add_argument("--latency", type=float, default=0.05, help="假 LLM 每次调用的延迟（秒）")
+    parser.add_argument("--redis-url", default=None, help="默认启动 fakeredis 的 TCP 服务")
+    args = parser.parse_args()
+
+    helpers = []
+    llm_port = free_port()
+    helpers.append(multiprocessing.Process(target=serve_llm, args=(llm_port, args.latency), daemon=True))
+    redis_url = args.redis_url
+    if redis_url is None:
+        redis_port = free_port()
+        redis_url = f"redis://127.0.0.1:{redis_port}/0"
+        helpers.append(multiprocessing.Process(target=serve_redis, args=(redis_port,), daemon=True))
+    for helper in helpers:
+        helper.start()
+
+    workdir = prepare_workdir(redis_url, llm_port)
+    print(f"cpus: {os.cpu_count()}, concurrency: {args.concurrency}, chats: {args.chats}")
+    try:
+        for workers in args.workers:
+            port = free_port()
+            service = start_service(workdir, workers, port)
+            try:
+                throughput = asyncio.run(load(port, args.concurrency, args.duration, args.chats))
+            finally:
+                service.terminate()
+                service.wait()
+            print(f"workers {workers:2d}: {throughput:8.1f} req/s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        for helper in helpers:
+            helper.terminate()
+
+
+if __name__ == "__main__":
+    main()
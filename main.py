@@ -1,21 +1,34 @@
-import uuid, json
+import time
+# 启动耗时从导入 main 开始计算，包括导入依赖的时间
+started = time.perf_counter()
+
+import uuid
+from contextlib import asynccontextmanager, nullcontext
 # import logging
 from loguru import logger
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
-from langserve import add_routes
-from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage
 from langchain_core.runnables import RunnableLambda
-from langchain.prompts import ChatPromptTemplate
-from langgraph.errors import GraphInterrupt
+from langgraph.types import Command
 
-from langgraph.types import interrupt, Command
+from service import (DialogueProcessor, load_model, load_service_config, 
+                     load_checkpointer, load_session_store, load_intent_classifier,
+                     load_admission_controller, load_thread_lock,
+                     load_history_compactor, load_model_warmer,
+                     load_metrics, load_token_budget, load_job_status_view)
+from service.utils.admission import AdmissionRejected
+from service.utils.lock import ThreadBusy
+from service.utils.usage import UsageCallbackHandler, empty_usage
+from service.chat.stream import SSEEncoder, coalesce
+from service.utils.startup import StartupProfile, LazyASGIApp
 
-from service import DialogueProcessor, load_model
+startup = StartupProfile(started)
+startup.mark("imports")
 
 # 配置日志
 # logging.basicConfig(level=logging.INFO)
@@ -35,19 +48,75 @@ from service import DialogueProcessor, load_model
 #         )
 #     return api_key
 
+# 启动后在后台预热模型，预热完成前 /ready 返回 503
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if warmer is not None:
+        warmer.start()
+    if job_status is not None:
+        job_status.start()
+    yield
+    if warmer is not None:
+        await warmer.stop()
+    if job_status is not None:
+        await job_status.stop()
+
 # 创建应用
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 加载模型
 llm = load_model()
+startup.mark("model")
+
+# 加载服务配置
+service_config = load_service_config()
+stream_tokens = service_config.get("stream", {}).get("mode", "nodes") == "tokens"
+# 逐 token 输出时合并 flush_interval 秒内的 token，减少数据帧和写入次数
+flush_interval = service_config.get("stream", {}).get("flush_interval", 0.0)
+flush_size = service_config.get("stream", {}).get("flush_size")
 
-# 存储中断的会话
-interrupted_threads = {}
+# 存储中断的会话，被淘汰的中断在下一次请求时从 checkpoint 中恢复
+interrupted_threads = load_session_store()
 
-# 创建对话处理器
-chat = DialogueProcessor(llm)
+# 创建对话处理器，会话状态由 config/service.yaml 中配置的 checkpointer 保存
+checkpointer = load_checkpointer()
+chat = DialogueProcessor(llm, checkpointer=checkpointer, intent_classifier=load_intent_classifier())
 graph = chat.compile()
 # chat.graph = graph
+startup.mark("graph")
+
+# 图执行的准入控制，LLM 饱和时快速返回 429/503，而不是让所有请求一起超时
+admission = load_admission_controller()
+
+# 会话锁，同一会话的多轮对话依次执行；会话保存在 Redis 中时为分布式锁，可以运行多个 worker 和节点
+thread_locks = load_thread_lock()
+
+# 会话历史压缩，每轮对话结束后在后台执行，长会话每轮的延迟不随历史增长
+history = load_history_compactor(llm=llm, lock=thread_locks)
+
+# 模型预热和空闲时的 keep-alive，没有启用时为 None
+warmer = load_model_warmer(llm=llm, processor=chat)
+
+# Prometheus 指标，图节点和 LLM 调用的耗时通过 config["callbacks"] 记录，没有启用时为 None
+metrics = load_metrics()
+callbacks = [metrics.callback] if metrics is not None else []
+
+# 任务和阶段状态的事件流，在 lifespan 中开始读取，没有启用时为 None
+job_status = load_job_status_view()
+jobs_heartbeat = service_config.get("jobs", {}).get("heartbeat", 15)
+# LLM 回复缓存的命中率，config/model.yaml 中 cache.enabled 为 false 时 llm.cache 为 None
+if metrics is not None and llm.cache is not None:
+    metrics.register_cache(llm.cache)
+# 准入控制的执行数、队列长度、等待时间和拒绝次数，/v1/admission/stats 返回同样的数据
+if metrics is not None:
+    metrics.register_admission(admission)
+
+def track_session():
+    return metrics.session() if metrics is not None else nullcontext()
+
+# 按用户和会话统计 token 用量，限制每个用户在时间窗口内的请求数和 token 数
+budget = load_token_budget()
+startup.mark("services")
 
 # 添加CORS中间件
 app.add_middleware(
@@ -80,12 +149,12 @@ async def list_models(response: Response):
     }
 
 # 构造invoke响应
-def build_response(result):
+def build_response(result, usage = None):
     # 构造响应，包括会话ID以便客户端在后续请求中使用
     response = {
         "id": f"chatcmpl-{hash(str(result)) % 10000}",
         "object": "chat.completion",
-        "created": int(__import__("time").time()),
+        "created": int(time.time()),
         "model": "pipeline-agent",
         "thread_id": result.get("thread_id"),  # 返回会话ID
         "choices": [
@@ -99,35 +168,90 @@ def build_response(result):
                 "finish_reason": "stop"
             }
         ],
-        "usage": {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0
-        }
+        "usage": usage or empty_usage()
     }
     return response
 
-# 构造流式响应
-def build_stream_response(input_text, thread_id, delta, finish_reason = None):
-    return "data: " + json.dumps({
-        "id": f"chatcmpl-{hash(input_text) % 10000}",
-        "object": "chat.completion.chunk",
-        "created": int(__import__("time").time()),
-        "model": "pipeline-agent",
-        "thread_id": thread_id,
-        "choices": [{
-            "index": 0,
-            "delta": delta,
-            "finish_reason": finish_reason
-        }]
-    }) + "\n\n"
-
-# 添加路由
-add_routes(
-    app,
-    llm | RunnableLambda(lambda x: build_response(x)),
-    path="/v1/chat",
-)
+# langserve 的 /v1/chat 路由很少使用，第一次请求时才导入 langserve 并创建，见文件末尾的 mount
+def build_chat_routes():
+    from langserve import add_routes
+    routes = FastAPI()
+    add_routes(
+        routes,
+        llm | RunnableLambda(lambda x: build_response(x)),
+        path="",
+    )
+    return routes
+
+# 会话存储的状态：会话数量，占用的字节数和被淘汰的会话数量
+@app.get("/v1/sessions/stats")
+async def session_stats():
+    return {
+        "interrupted_threads": interrupted_threads.stats(),
+        "checkpointer": checkpointer.stats(),
+        "locks": thread_locks.stats(),
+        "history": history.stats(),
+    }
+
+# 就绪检查：模型预热完成后才返回 200，负载均衡不会把请求发给还没有加载模型的实例
+@app.get("/ready")
+async def ready():
+    if warmer is None:
+        return {"status": "ready"}
+    status_code = 200 if warmer.ready.is_set() else 503
+    return JSONResponse(status_code=status_code,
+                        content={"status": "ready" if status_code == 200 else "warming_up", **warmer.stats()})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if metrics is None:
+        return JSONResponse(status_code=404, content={"error": "metrics are disabled"})
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+# token 用量：/v1/usage?user=...&chat_id=... 返回用户（包括当前窗口内的用量和上限）和会话的累计用量
+@app.get("/v1/usage")
+async def usage_of(user: str = None, chat_id: str = None):
+    return await budget.usage(user, chat_id)
+
+@app.get("/v1/usage/stats")
+async def usage_stats():
+    return budget.stats()
+
+# 启动各阶段的耗时
+@app.get("/v1/startup/stats")
+async def startup_stats():
+    return startup.stats()
+
+# 本地意图分类器的命中率和节省的时间
+@app.get("/v1/intent/stats")
+async def intent_stats():
+    return chat.intent_classifier.stats() if chat.intent_classifier is not None else {}
+
+# LLM 回复缓存的条目数、大小和各个节点的命中次数
+@app.get("/v1/llm_cache/stats")
+async def llm_cache_stats():
+    return llm.cache.stats() if llm.cache is not None else {}
+
+# 任务状态：/v1/jobs 返回当前状态，/v1/jobs/events 通过 SSE 推送状态变化，job_id 可以重复指定只订阅部分任务
+@app.get("/v1/jobs")
+async def jobs(job_id: list[str] = Query(None)):
+    if job_status is None:
+        return JSONResponse(status_code=404, content={"error": "job events are disabled"})
+    return {"jobs": job_status.snapshot(job_id), "stats": job_status.stats()}
+
+@app.get("/v1/jobs/events")
+async def job_events(job_id: list[str] = Query(None)):
+    if job_status is None:
+        return JSONResponse(status_code=404, content={"error": "job events are disabled"})
+    return StreamingResponse(job_status.stream(job_id, heartbeat=jobs_heartbeat),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# 准入控制的状态：正在执行和排队的请求数，等待时间和被拒绝的请求数
+@app.get("/v1/admission/stats")
+async def admission_stats():
+    return admission.stats()
 
 @app.post("/v1/files")
 async def list_files(request: Request):
@@ -138,34 +262,64 @@ async def list_files(request: Request):
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request):
+    received = time.perf_counter()
     data = await request.json()
     messages = data.get("messages", [])
     input_text = messages[-1].get("content", "") if messages else ""
     interrupt_id = None
 
     logger.info(f"Received request: {input_text}")
+    if warmer is not None:
+        warmer.touch()
 
     # 安全获取 thread_id
     metadata = data.get("metadata", {})
     thread_id = metadata.get("chat_id") if isinstance(metadata, dict) else str(uuid.uuid4())
     
+    # 本轮对话中所有 LLM 调用的 token 用量
+    usage = UsageCallbackHandler()
     config = {
         "configurable": {
             "thread_id": thread_id,
         },
+        "callbacks": [*callbacks, usage],
     }
 
+    # 准入控制：按用户限制同时执行的图，没有用户信息时按会话限制
+    user = data.get("user") or (metadata.get("user_id") if isinstance(metadata, dict) else None) or thread_id
+    try:
+        # 超过用户的请求数或 token 预算时返回 429，不占用准入控制的名额
+        await budget.acquire(user)
+        try:
+            ticket = await admission.acquire(user)
+        except AdmissionRejected:
+            # 被准入控制拒绝（503/429）的请求不计入用户的请求数
+            await budget.release(user)
+            raise
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": f"pipeline-agent service is busy ({e.reason}), please retry after {e.retry_after} seconds."},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
     # 非流式处理方式
     if not data.get("stream", False):
         try:
-            result = chat.graph.invoke(
-                {'messages': HumanMessage(content=input_text)},
-                config=config
-            )
-            return build_response(result)
+            async with thread_locks.hold(thread_id):
+                with track_session():
+                    result = await chat.graph.ainvoke(
+                        {'messages': HumanMessage(content=input_text)},
+                        config=config
+                    )
+            history.schedule(chat.graph, config)
+            return build_response(result, usage.usage())
         except Exception as e:
             logger.error(f"处理请求时出错: {str(e)}")
             return {"error": str(e)}
+        finally:
+            await ticket.release()
+            await budget.record(user, thread_id, usage.usage())
     
     def get_interrupt_content(chunk):    
         interrupts = chunk["__interrupt__"]
@@ -189,60 +343,150 @@ async def chat_completions(request: Request):
         
         return str(chunk)
 
-    # 流式处理方式
-    def generate_stream():
+    def get_node_content(chunk):
+        content = None
+        # 提取内容
+        if isinstance(chunk, dict):
+            if "__interrupt__" in chunk:
+                # 处理中断
+                content, interrupt_id = get_interrupt_content(chunk)
+                interrupted_threads[thread_id] = interrupt_id
+                logger.info(f"thread_id: {thread_id}, interrupt: {interrupt_id}")
+            else:
+                content = chat.stream_nodes_handler(chunk)
+
+        if content is None:
+            content = get_content(chunk)
+        return content
+
+    async def get_pending_interrupt():
+        # 服务重启后 interrupted_threads 为空，从 checkpoint 中恢复未完成的中断
+        snapshot = await chat.graph.aget_state(config)
+        for task in snapshot.tasks:
+            if task.interrupts:
+                return task.interrupts[0].ns[0]
+        return None
+
+    # 数据帧的公共部分每个响应只编码一次
+    encoder = SSEEncoder(thread_id, input_text)
+    # 与 OpenAI 相同，请求 stream_options.include_usage 时在 [DONE] 之前单独发送 usage；结束帧总是带有 usage
+    include_usage = bool((data.get("stream_options") or {}).get("include_usage"))
+
+    first_chunk = False
+
+    def mark_first_chunk():
+        # 从收到请求到输出第一个内容块的时间
+        nonlocal first_chunk
+        if not first_chunk and metrics is not None:
+            metrics.stream_first_chunk_seconds.observe(time.perf_counter() - received)
+        first_chunk = True
+
+    # 流式处理方式，内容 token 以 str 输出，由 coalesce 合并编码
+    async def generate_frames():
         try:
-            if thread_id in interrupted_threads: 
-                interrupt_id = interrupted_threads[thread_id] 
+            interrupt_id = interrupted_threads.pop(thread_id, None) or await get_pending_interrupt()
+            if interrupt_id: 
                 config["configurable"]["interrupt"] = interrupt_id 
                 config["configurable"]["interrupt_response"] = True 
                 messages = Command(resume = input_text)
-                del interrupted_threads[thread_id]
                 logger.info(f"thread_id: {thread_id}, interrupt: {interrupt_id}")
             else:
                 messages = {'messages': HumanMessage(content=input_text)}
 
-            stream = chat.graph.stream(
-                messages,
-                config=config,
-            )
-            
             # 发送初始响应
-            yield build_stream_response(input_text, thread_id, {"role": "assistant"})
-            
-            # 流式输出响应块
-            for chunk in stream:
-                # 提取内容
-                if isinstance(chunk, dict):
-                    if "__interrupt__" in chunk:
-                        # 处理中断
-                        content, interrupt_id = get_interrupt_content(chunk)
-                        interrupted_threads[thread_id] = interrupt_id
-                        logger.info(f"thread_id: {thread_id}, interrupt: {interrupt_id}")
+            yield encoder.frame({"role": "assistant"})
+
+            if stream_tokens:
+                # 逐 token 输出面向用户的内容
+                token_filter = chat.token_stream_filter()
+                stream = chat.graph.astream(
+                    messages,
+                    config=config,
+                    stream_mode=["messages", "updates"],
+                )
+
+                async for mode, chunk in stream:
+                    if mode == "messages":
+                        content = token_filter(*chunk)
+                    elif "__interrupt__" in chunk:
+                        content = get_node_content(chunk)
                     else:
-                        content = chat.stream_nodes_handler(chunk)
-                
-                if content is None:
-                    content = get_content(chunk)
+                        # 节点结束时输出缓存的内容，没有调用 LLM 或者模型不支持流式输出时回退到按节点输出
+                        content = token_filter.flush()
+                        if not any(node in token_filter.seen_nodes for node in chunk):
+                            content = get_node_content(chunk)
+                            if token_filter.is_label(content):
+                                content = None
+
+                    if content:
+                        mark_first_chunk()
+                        yield content
+            else:
+                stream = chat.graph.astream(
+                    messages,
+                    config=config,
+                )
+
+                # 流式输出响应块
+                async for chunk in stream:
+                    content = get_node_content(chunk)
 
-                # 发送文本块
-                yield build_stream_response(input_text, thread_id, {"content": content})
+                    # 发送文本块
+                    mark_first_chunk()
+                    yield content if isinstance(content, str) else encoder.frame({"content": content})
             
-            # 发送结束标记
-            yield build_stream_response(input_text, thread_id, {}, {"finish_reason": "stop"})           
-            yield "data: [DONE]\n\n"
+            # 发送结束标记和本轮对话的 token 用量
+            yield encoder.frame({}, "stop", usage.usage())
+            if include_usage:
+                yield encoder.usage(usage.usage())
+            yield encoder.DONE
         
         except Exception as e:
             logger.error(f"Stream handling error: {str(e)}")
-            yield build_stream_response(input_text, thread_id, {"content": f"pipeline-agent service failed to response."}, {"finish_reason": "error"})
-            yield "data: [DONE]\n\n"
+            yield encoder.frame({"content": f"pipeline-agent service failed to response."}, "error")
+            yield encoder.DONE
             raise e
 
+    async def generate_stream():
+        status = "stop"
+        try:
+            # 持有会话锁之后再读取中断，同一个中断只会被恢复一次
+            async with thread_locks.hold(thread_id):
+                with track_session():
+                    async for frame in coalesce(generate_frames(), encoder, flush_interval, flush_size):
+                        yield frame
+            history.schedule(chat.graph, config)
+        except ThreadBusy as e:
+            # 只处理获取会话锁的超时，流开始之后的 TimeoutError 已经由 generate_frames 发送了错误和 [DONE]
+            status = "busy"
+            logger.error(f"Stream handling error: {str(e)}")
+            yield encoder.frame({"content": f"pipeline-agent service is busy with the previous message of this chat."}, "error")
+            yield encoder.DONE
+        except GeneratorExit:
+            # 客户端断开连接
+            status = "disconnected"
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            if metrics is not None:
+                metrics.stream_seconds.labels(status).observe(time.perf_counter() - received)
+            await ticket.release()
+            await budget.record(user, thread_id, usage.usage())
+
+    # 客户端在流开始之前断开时 generate_stream 不会执行，由 background 释放
     return StreamingResponse(
         generate_stream(),
-        media_type="text/event-stream"
+        media_type="text/event-stream",
+        background=BackgroundTask(ticket.release),
     )
 
+# 放在所有路由之后，/v1/chat/completions 优先匹配
+app.mount("/v1/chat", LazyASGIApp(build_chat_routes))
+startup.mark("routes")
+startup.done()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=18888)
@@ -5,30 +5,16 @@ from langchain_core.runnables import RunnableLambda, RunnablePassthrough, Runnab
 from langchain_core.output_parsers import StrOutputParser
 
 
-from service import DialoguePipeline, pipeline_prompt_builder
-from service.states import PipelineState
+from service import DialoguePipeline, load_prompt_builder
+from service.chat.states import PipelineState
 
 def test_prompt(llm):
     # 实例化一个Ollama对象。
     task_name = "task_new"
     state = PipelineState(messages=[])
-    prompts_builder = pipeline_prompt_builder()
-    formatter_prompt, question_prompt = prompts_builder.new_pipeline_task_prompt(state, task_name)
-
-    def build_tip(response, task_name, state):
-        state, changed = prompts_builder.formatter_update_state(response, state)
-        return prompts_builder.build_tip(task_name, state, changed)
-
-    chain = (
-        RunnableParallel(
-            user_input = RunnablePassthrough(),
-            formatter_output = formatter_prompt | llm )
-        | RunnableParallel(
-            user_input = lambda x: x["user_input"],
-            tip = lambda x: build_tip(x["formatter_output"], task_name, state))
-        | question_prompt
-        | llm        
-    )
+    prompts_builder = load_prompt_builder()
+    # structured_output 为 true 时每轮只调用一次 LLM，校验失败时退回 formatter + question 两次调用
+    chain = prompts_builder.new_pipeline_task_chain(llm, state, task_name)
 
     msg1 = "I need to process WES data for the project STING_UNLOCK"
     msg2 = "I prefer to use nfcore/Sarek for the analysis"
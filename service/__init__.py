@@ -6,13 +6,35 @@ from service.chat import states
 
 # from service.chat.pipeline.prompt import pipeline_prompt_builder
 
-from service.utils.config import load_model
+from service.utils.config import (load_model, load_service_config, load_checkpointer, 
+                                  load_session_store, load_intent_classifier,
+                                  load_prompt_builder, load_admission_controller, load_thread_lock,
+                                  load_history_compactor, load_model_warmer,
+                                  load_metrics, load_token_budget,
+                                  load_downloader, load_download_source, load_transfer_budget,
+                                  load_job_publisher, load_job_status_view)
 
 __all__ = [
     "DialogueProcessor",
     "DialoguePipeline",
     "DialogueMedical",
     "load_model",
+    "load_service_config",
+    "load_checkpointer",
+    "load_session_store",
+    "load_intent_classifier",
+    "load_prompt_builder",
+    "load_admission_controller",
+    "load_thread_lock",
+    "load_history_compactor",
+    "load_model_warmer",
+    "load_metrics",
+    "load_token_budget",
+    "load_downloader",
+    "load_download_source",
+    "load_transfer_budget",
+    "load_job_publisher",
+    "load_job_status_view",
     "states",
     # "pipeline_prompt_builder"
 ]
\ No newline at end of file
@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from typing import Optional
+
+from loguru import logger
+
+PIPELINE_LABEL = "pipeline"
+MEDICAL_LABEL = "medical"
+OTHER_LABEL = "other"
+
+
+class IntentClassifier:
+    """
+    DialogueProcessor 前置的本地意图分类器，只使用 CPU
+        1. 使用 TF-IDF 加权的字符 n-gram 和词特征表示用户输入，用 kNN 在样本中查找最相似的对话
+        2. 训练样本来自 config/prompts/DialogueProcessor.yaml 中的 examples 以及 LLM 标注的对话；
+           log_file 记录的是用户的原始输入，默认不写入，启用后按文本去重，最多保留 max_examples 条
+        3. 置信度足够高时直接返回 "pipeline"，"medical" 或者固定的自我介绍，否则返回 None，由 LLM 分类
+    """
+    def __init__(self,
+                 examples: list[dict],
+                 k: int = 5,
+                 threshold: float = 0.8,
+                 min_similarity: float = 0.5,
+                 log_file: Optional[str] = None,
+                 max_examples: int = 5000):
+        self.k = k
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.log_file = log_file
+        self.max_examples = max_examples
+        self.lock = threading.Lock()
+
+        # 非 pipeline/medical 的回复统一视为自我介绍，使用样本中的第一个自我介绍作为固定回复
+        self.replies = {PIPELINE_LABEL: PIPELINE_LABEL, MEDICAL_LABEL: MEDICAL_LABEL}
+        self.examples = [(item.get("user"), self.label_of(item.get("assistant"))) for item in examples]
+        for item, (_, label) in zip(examples, self.examples):
+            self.replies.setdefault(label, item.get("assistant"))
+
+        # LLM 标注的对话按文本去重，按记录的先后排序，最多保留 max_examples 条
+        self.logged: dict[str, str] = {}
+        self.log_lines = 0
+        if log_file and os.path.exists(log_file):
+            with open(log_file, "r") as f:
+                for line in f:
+                    turn = json.loads(line)
+                    self.logged.pop(turn["user"], None)
+                    self.logged[turn["user"]] = turn["label"]
+                    self.log_lines += 1
+            self.trim()
+            if self.log_lines > len(self.logged):
+                self.rewrite_log()
+        self.texts, self.labels = self.merge()
+        self.rebuilding = False
+        self.pending = False
+        self.build_index()
+
+        self.hits = 0
+        self.misses = 0
+        self.local_time = 0.0
+        self.llm_time = 0.0
+
+    def trim(self):
+        while len(self.logged) > self.max_examples:
+            self.logged.pop(next(iter(self.logged)))
+
+    def merge(self) -> tuple[list[str], list[str]]:
+        """
+        配置中的样本在前，记录的对话在后，合计超过 max_examples 时丢弃最早的样本
+        """
+        merged = (self.examples + list(self.logged.items()))[-self.max_examples:]
+        return [text for text, _ in merged], [label for _, label in merged]
+
+    def rewrite_log(self):
+        # 写入临时文件后替换，重写过程中退出不会丢失原来的记录
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+        tmp = f"{self.log_file}.tmp"
+        with open(tmp, "w") as f:
+            for text, label in self.logged.items():
+                f.write(json.dumps({"user": text, "label": label}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.log_file)
+        self.log_lines = len(self.logged)
+
+    @staticmethod
+    def label_of(reply: str) -> str:
+        reply = reply.strip().strip("'\"").lower()
+        return reply if reply in (PIPELINE_LABEL, MEDICAL_LABEL) else OTHER_LABEL
+
+    @staticmethod
+    def features(text: str) -> Counter:
+        words = re.findall(r"\w+", text.lower())
+        grams = Counter(words)
+        for word in words:
+            padded = f" {word} "
+            for n in (3, 4):
+                grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return grams
+
+    @staticmethod
+    def vectorize(grams: Counter, idf: dict[str, float]) -> dict[str, float]:
+        vector = {g: (1 + math.log(tf)) * idf[g] for g, tf in grams.items() if g in idf}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {g: w / norm for g, w in vector.items()}
+
+    def build_index(self):
+        with self.lock:
+            texts, labels = list(self.texts), list(self.labels)
+        docs = [self.features(text) for text in texts]
+        df = Counter(g for doc in docs for g in doc)
+        idf = {g: math.log((1 + len(docs)) / (1 + n)) + 1 for g, n in df.items()}
+        # 倒排索引 gram -> [(样本序号, 权重)]
+        index = defaultdict(list)
+        for i, doc in enumerate(docs):
+            for g, w in self.vectorize(doc, idf).items():
+                index[g].append((i, w))
+        self.model = (idf, index, labels)
+
+    def rebuild_in_background(self):
+        # 新样本在后台线程中重建索引，不阻塞对话
+        with self.lock:
+            if self.rebuilding:
+                self.pending = True
+                return
+            self.rebuilding = True
+
+        def run():
+            while True:
+                self.build_index()
+                with self.lock:
+                    if not self.pending:
+                        self.rebuilding = False
+                        break
+                    self.pending = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def scores(self, text: str) -> tuple[Optional[str], float, float]:
+        """
+        返回 (最可能的标签, 投票置信度, 最近邻的余弦相似度)
+        """
+        idf, index, labels = self.model
+        similarities = defaultdict(float)
+        for g, w in self.vectorize(self.features(text), idf).items():
+            for i, dw in index.get(g, ()):
+                similarities[i] += w * dw
+        neighbors = sorted(similarities.items(), key=lambda x: x[1], reverse=True)[:self.k]
+        if not neighbors:
+            return None, 0.0, 0.0
+
+        votes = defaultdict(float)
+        for i, similarity in neighbors:
+            votes[labels[i]] += similarity
+        label, vote = max(votes.items(), key=lambda x: x[1])
+        return label, vote / sum(votes.values()), neighbors[0][1]
+
+    def predict(self, text: str) -> Optional[str]:
+        """
+        置信度足够高时返回分类结果（"pipeline"，"medical" 或固定的自我介绍），否则返回 None
+        """
+        start = time.perf_counter()
+        label, confidence, similarity = self.scores(text)
+        self.local_time += time.perf_counter() - start
+
+        if label in self.replies and confidence >= self.threshold and similarity >= self.min_similarity:
+            self.hits += 1
+            logger.debug(f"intent classifier: {label} (confidence {confidence:.2f}, similarity {similarity:.2f})")
+            return self.replies[label]
+
+        self.misses += 1
+        return None
+
+    def record(self, text: str, reply: str, elapsed: float):
+        """
+        记录 LLM 对未命中的对话的分类结果，作为新的样本加入索引，log_file 不为 None 时写入 log_file
+        """
+        self.llm_time += elapsed
+        label = self.label_of(reply)
+        with self.lock:
+            # 中断恢复时 chat 节点会重新执行，同一条用户输入只记录一次
+            if self.logged.get(text) == label:
+                return
+            self.logged.pop(text, None)
+            self.logged[text] = label
+            self.trim()
+            self.texts, self.labels = self.merge()
+        self.rebuild_in_background()
+
+        if self.log_file:
+            with self.lock:
+                # 只追加写入，重复和被淘汰的记录超过 max_examples 条时重写文件
+                if self.log_lines >= 2 * self.max_examples:
+                    self.rewrite_log()
+                else:
+                    os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+                    with open(self.log_file, "a") as f:
+                        f.write(json.dumps({"user": text, "label": label}, ensure_ascii=False) + "\n")
+                    self.log_lines += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        llm_latency = self.llm_time / self.misses if self.misses else 0.0
+        return {
+            "examples": len(self.texts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "local_latency_ms": 1000 * self.local_time / total if total else 0.0,
+            "llm_latency_ms": 1000 * llm_latency,
+            # 命中的请求按 LLM 分类的平均耗时估算节省的时间
+            "saved_seconds": self.hits * llm_latency - self.local_time,
+        }
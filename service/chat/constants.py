@@ -17,6 +17,9 @@ CREATE_DATE_KEY = "create_date"
 
 KEYWORD_TOPICS_KEY = "keyword_topics"
 
+# 参数提取链的 tag，LLM 回复缓存（config/model.yaml 中 cache.tags）按 tag 选择缓存的调用
+EXTRACTION_TAG = "extraction"
+
 class PipelineType(Enum):
     """
     工作流的每个阶段都有一个类型，包括command, scripts, nextflow 或者 snakemake
@@ -1,10 +1,12 @@
-import yaml
 from abc import ABC, abstractmethod
 
 from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.config import run_in_executor
 from service.chat.states import ProcessorState, PipelineState
+from service.utils.config import load_yaml
 from langgraph.graph import StateGraph, START, END
-from langchain.prompts import (SystemMessagePromptTemplate,
+from langchain_core.prompts import (SystemMessagePromptTemplate,
                                FewShotPromptTemplate,
                                FewShotChatMessagePromptTemplate,
                                HumanMessagePromptTemplate,
@@ -92,25 +94,26 @@ class DialogueProcessorABC(StateGraph, ABC):
     chat_node = "chat"
     pipeline_node = "pipeline"
     medical_node = "medical"
+    classifier_tag = "classifier"
 
     def __init__(self, 
                  llm, 
-                 checkpoint = MemorySaver(), 
+                 checkpoint = None, 
                  prompt_file= "config/prompts/DialogueProcessor.yaml"):
         
         super().__init__(ProcessorState)
-        self.checkpointer = checkpoint
+        self.checkpointer = checkpoint if checkpoint is not None else MemorySaver()
         self.prompt_file = prompt_file
         
         self.graph = None
 
-        with open(prompt_file, "r") as f:
-            self.prompt_data = yaml.safe_load(f)
+        self.prompt_data = load_yaml(prompt_file)
 
         self.prompts = self.load_prompts()
         self.llm = llm
-        self.chain = self.prompts | self.llm
-        self.add_node(self.chat_node, self.chat)
+        self.chain = (self.prompts | self.llm).with_config(tags=[self.classifier_tag])
+        # chat 节点同时注册同步和异步实现，graph.invoke/stream 调用 chat，graph.ainvoke/astream 调用 achat
+        self.add_node(self.chat_node, RunnableLambda(self.chat, afunc=self.achat, name=self.chat_node))
         self.add_node(self.pipeline_node, self.pipeline)
         self.add_node(self.medical_node, self.medical)
         
@@ -164,8 +167,6 @@ class DialogueProcessorABC(StateGraph, ABC):
             message_prompt
         ])
 
-        print(prompt)
-
         return prompt
 
     def compile(self, checkpointer = None, *, store = None, interrupt_before = None, interrupt_after = None, debug = False, name = None):
@@ -178,6 +179,12 @@ class DialogueProcessorABC(StateGraph, ABC):
     def chat(self, state):
         pass
 
+    async def achat(self, state):
+        """
+        chat 节点的异步版本，默认在线程池中执行同步的 chat，子类应尽量提供原生的异步实现
+        """
+        return await run_in_executor(None, self.chat, state)
+
     @abstractmethod
     def pipeline(self, state):
         pass
@@ -1,19 +1,12 @@
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_ollama import ChatOllama
 
-from langchain_core.tools import InjectedToolCallId, tool
 from langchain_core.messages import AnyMessage, BaseMessage, ToolMessage, AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
-
-from langchain.memory import ConversationBufferMemory
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableParallel
 
 from service.chat.states import PipelineState
-from service.chat.constants import PipelineTaskAction
-from service.chat.pipeline.prompts import pipeline_prompt_builder
-
-from service.utils.config import load_model
+from service.chat.constants import PipelineTaskAction, EXTRACTION_TAG
 
 class DialoguePipeline(StateGraph):
     """
@@ -31,7 +24,9 @@ class DialoguePipeline(StateGraph):
     def __init__(self, checkpointer = None, llm = None):
         super().__init__(PipelineState)
 
+        # 由 DialogueProcessor 创建时使用主图的 llm，不会重复加载模型
         if llm is None: 
+            from service.utils.config import load_model
             llm = load_model()
 
         if checkpointer is None:
@@ -41,7 +36,9 @@ class DialoguePipeline(StateGraph):
         self.checkpointer = checkpointer
 
         self.add_node("chat_with_state", self.chat_with_state)
-        self.add_node("update_chat_state", self.update_chat_state)
+        self.add_node("update_chat_state", RunnableLambda(self.update_chat_state, 
+                                                          afunc=self.aupdate_chat_state, 
+                                                          name="update_chat_state"))
         self.add_node(PipelineTaskAction.NEW.value,    self.pipeline_new_task)
         self.add_node(PipelineTaskAction.DEL.value,    self.pipeline_del_task)
         self.add_node(PipelineTaskAction.UPDATE.value, self.pipeline_update_task)
@@ -81,28 +78,43 @@ class DialoguePipeline(StateGraph):
         """
         print("更新对话状态")
 
-        # Instantiation using from_template (recommended)
-        prompt = PromptTemplate.from_template("You are an powerful content extractor, {foo}")
-        # prompt.format(foo="bar")
-
-        # Instantiation using initializer
-        # prompt = PromptTemplate(template="Say {foo}")
-
-        for msg in reversed(state.messages):
-            if isinstance(msg, HumanMessage):
-                # print(msg)
-                chain = prompt | self.llm
-                print(msg.content)
-                response = chain.invoke([{"foo": msg.content}])
-                # print the content of the response message from the local language model
-                # print(response.content)
-                print(response)
-                break
+        msg = self.last_human_message(state)
+        if msg is not None:
+            print(msg.content)
+            response = self.extract_chain.invoke([{"foo": msg.content}])
+            # print the content of the response message from the local language model
+            print(response)
+
+        if state.args is None:
+            state.messages.append(AIMessage(content=msg.content))
+
+        return state
+
+    async def aupdate_chat_state(self, state: PipelineState) -> PipelineState:
+        """
+        update_chat_state 的异步版本，在 graph.ainvoke/astream 中使用
+        """
+        print("更新对话状态")
+
+        msg = self.last_human_message(state)
+        if msg is not None:
+            print(msg.content)
+            response = await self.extract_chain.ainvoke([{"foo": msg.content}])
+            print(response)
 
         if state.args is None:
             state.messages.append(AIMessage(content=msg.content))
 
         return state
+
+    @property
+    def extract_chain(self):
+        # Instantiation using from_template (recommended)
+        prompt = PromptTemplate.from_template("You are an powerful content extractor, {foo}")
+        return (prompt | self.llm).with_config(tags=[EXTRACTION_TAG])
+
+    def last_human_message(self, state: PipelineState):
+        return next((msg for msg in reversed(state.messages) if isinstance(msg, HumanMessage)), None)
     
     def pipeline_new_task(self, state: PipelineState) -> PipelineState:
         """
@@ -1,16 +1,20 @@
 # import logging
+import time
 from loguru import logger
 from typing import Union
 
-from langchain_core.messages import HumanMessage
-from langchain.prompts import HumanMessagePromptTemplate
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.prompts import HumanMessagePromptTemplate
 from langgraph.types import interrupt, Command
 from langgraph.graph import StateGraph, START, END
+from langgraph.constants import TAG_NOSTREAM
 from pydantic import BaseModel, Field
 
 from service.chat.conversational.ConversationABC import DialogueProcessorABC
 from service.chat.conversational.DialoguePipeline import DialoguePipeline
 from service.chat.conversational.DialogueMedical import DialogueMedical
+from service.chat.stream import TokenStreamFilter
+from service.chat.history import summary_messages
 # TODO:
 # 1. 在对话中接受用户上传的配置文件
 # 2. 临时存储用户上传的配置文件
@@ -19,14 +23,27 @@ from service.chat.conversational.DialogueMedical import DialogueMedical
 # logger = logging.getLogger(__name__)
 
 class DialogueProcessor(DialogueProcessorABC):
-    def __init__(self, llm):
-        super().__init__(llm=llm)
-        self.chat_pipeline = DialoguePipeline(llm=llm)
-        self.chat_medical = DialogueMedical()
+    def __init__(self, llm, checkpointer = None, intent_classifier = None):
+        super().__init__(llm=llm, checkpoint=checkpointer)
+        # 本地意图分类器，置信度足够高时不再调用 LLM 进行分类
+        self.intent_classifier = intent_classifier
+        # 确认话题切换的问题通过 interrupt 返回给用户，不需要逐 token 输出
+        self.topic_llm = self.llm.with_config(tags=[TAG_NOSTREAM])
+        self._chat_pipeline_graph = None
+        self._chat_medical = None
 
-        self.chat_pipeline_graph = self.chat_pipeline.compile()
-        # self.chat_medical_graph = self.chat_medical.compile()
-        
+    @property
+    def chat_pipeline_graph(self):
+        # pipeline 子图在第一次使用时才创建和编译，与主图共用同一个 checkpointer 和 llm
+        if self._chat_pipeline_graph is None:
+            self._chat_pipeline_graph = DialoguePipeline(checkpointer=self.checkpointer, llm=self.llm).compile()
+        return self._chat_pipeline_graph
+
+    @property
+    def chat_medical(self):
+        if self._chat_medical is None:
+            self._chat_medical = DialogueMedical()
+        return self._chat_medical
 
     def topic_change(self, state):
         # 如何用户之前没有定义过action，那么就不需要确认
@@ -42,55 +59,100 @@ class DialogueProcessor(DialogueProcessorABC):
             return True
         
 
-    def chat(self, state: BaseModel) -> BaseModel:
-        
-        def check_invoke(user_msg):
-            prompt = self.prompt_data.get("topic_change")
-            template = HumanMessagePromptTemplate.from_template(prompt)
-            formatted_message = template.format(
-                user_message=user_msg,
-                previous_action=state.action,
-                current_action=state.messages[-1].content
-            )
-            
-            logger.debug(f"formatted_message: {formatted_message}")
-            response = self.llm.invoke([formatted_message]) 
-            state.messages.append(response)
-            return response
-        
-        def check_interrupt(response):
-            answer = interrupt(value=response.content)
-            state.messages.append(HumanMessage(content=answer))
-            logger.debug(f"answer: {answer}")
-            return answer
-        
-        def check_answer(answer):
-            if "yes" in answer.lower().split():
-                pass
-            elif "no" in answer.lower().split():
-                if state.action == "pipeline":
-                    state.action = "medical"
-                elif state.action == "medical":
-                    state.action = "pipeline"
-            else:
-                check_invoke(answer)
+    def topic_change_messages(self, state, user_msg):
+        # 历史被压缩后，被移除的对话只保留在 state.summary 中
+        return summary_messages(state.summary, [self.topic_change_message(state, user_msg)])
 
+    def topic_change_message(self, state, user_msg):
+        prompt = self.prompt_data.get("topic_change")
+        template = HumanMessagePromptTemplate.from_template(prompt)
+        formatted_message = template.format(
+            user_message=user_msg,
+            previous_action=state.action,
+            current_action=state.messages[-1].content
+        )
+        logger.debug(f"formatted_message: {formatted_message}")
+        return formatted_message
 
-        logger.info(" ---- chat node ---- ")
-        response = self.chain.invoke({'user_message':state.messages[-1].content})
-        state.messages.append(response)
+    def check_interrupt(self, state, response):
+        answer = interrupt(value=response.content)
+        state.messages.append(HumanMessage(content=answer))
+        logger.debug(f"answer: {answer}")
+        return answer
 
-        if self.topic_change(state):       
-            user_msg = next((msg.content for msg in state.messages[::-1] if isinstance(msg, HumanMessage)), None)
-            response = check_invoke(user_msg)
-            answer = check_interrupt(response)
-            check_answer(answer)
-        
+    def check_answer(self, state, answer) -> bool:
+        """
+        根据用户对话题切换的回答更新 action，如果用户的回答既不是 yes 也不是 no，返回 False
+        """
+        if "yes" in answer.lower().split():
+            return True
+        elif "no" in answer.lower().split():
+            if state.action == "pipeline":
+                state.action = "medical"
+            elif state.action == "medical":
+                state.action = "pipeline"
+            return True
+        return False
+
+    def update_action(self, state, response):
         if response.content == "pipeline":
             state.action = "pipeline"
         elif response.content == "medical":
             state.action = "medical"
 
+    def last_user_message(self, state):
+        return next((msg.content for msg in state.messages[::-1] if isinstance(msg, HumanMessage)), None)
+
+    def classify(self, user_msg):
+        if self.intent_classifier is not None and (reply := self.intent_classifier.predict(user_msg)) is not None:
+            return AIMessage(content=reply)
+
+        start = time.perf_counter()
+        response = self.chain.invoke({'user_message':user_msg})
+        if self.intent_classifier is not None:
+            self.intent_classifier.record(user_msg, response.content, time.perf_counter() - start)
+        return response
+
+    async def aclassify(self, user_msg):
+        if self.intent_classifier is not None and (reply := self.intent_classifier.predict(user_msg)) is not None:
+            return AIMessage(content=reply)
+
+        start = time.perf_counter()
+        response = await self.chain.ainvoke({'user_message':user_msg})
+        if self.intent_classifier is not None:
+            self.intent_classifier.record(user_msg, response.content, time.perf_counter() - start)
+        return response
+
+    def chat(self, state: BaseModel) -> BaseModel:
+        logger.info(" ---- chat node ---- ")
+        response = self.classify(state.messages[-1].content)
+        state.messages.append(response)
+
+        if self.topic_change(state):       
+            user_msg = self.last_user_message(state)
+            response = self.topic_llm.invoke(self.topic_change_messages(state, user_msg))
+            state.messages.append(response)
+            answer = self.check_interrupt(state, response)
+            if not self.check_answer(state, answer):
+                state.messages.append(self.llm.invoke(self.topic_change_messages(state, answer)))
+        
+        self.update_action(state, response)
+        return state
+
+    async def achat(self, state: BaseModel) -> BaseModel:
+        logger.info(" ---- chat node (async) ---- ")
+        response = await self.aclassify(state.messages[-1].content)
+        state.messages.append(response)
+
+        if self.topic_change(state):
+            user_msg = self.last_user_message(state)
+            response = await self.topic_llm.ainvoke(self.topic_change_messages(state, user_msg))
+            state.messages.append(response)
+            answer = self.check_interrupt(state, response)
+            if not self.check_answer(state, answer):
+                state.messages.append(await self.llm.ainvoke(self.topic_change_messages(state, answer)))
+
+        self.update_action(state, response)
         return state
     
     def pipeline(self, state: BaseModel) -> BaseModel:
@@ -121,6 +183,12 @@ class DialogueProcessor(DialogueProcessorABC):
         # don't show the medical messages to stream chat
         return ""
     
+    def token_stream_filter(self) -> TokenStreamFilter:
+        # 只输出 chat 节点中面向用户的 token，隐藏意图分类的标签
+        return TokenStreamFilter(nodes=[self.chat_node], 
+                                 labels=["pipeline", "medical"], 
+                                 classifier_tag=self.classifier_tag)
+
     def stream_nodes_handler(self, chunk: dict) -> str:
         if "chat" in chunk:
             return chunk["chat"]["messages"][-1].content
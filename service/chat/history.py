@@ -0,0 +1,155 @@
+import time
+import asyncio
+from typing import Optional
+
+from loguru import logger
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.prompts import HumanMessagePromptTemplate
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableLambda
+from langgraph.constants import TAG_NOSTREAM
+
+
+def summary_messages(summary: Optional[str], messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    压缩后的历史摘要作为 SystemMessage 放在 prompt 之前，没有摘要时原样返回
+    """
+    if not summary:
+        return messages
+    return [SystemMessage(content=f"Summary of the earlier conversation with the user:\n{summary}"), *messages]
+
+
+def summary_context(summary: Optional[str]) -> RunnableLambda:
+    """
+    用在 prompt | summary_context(state.summary) | llm 中，把摘要加到 prompt 的消息之前
+    """
+    def add(value):
+        messages = value.to_messages() if isinstance(value, PromptValue) else list(value)
+        return summary_messages(summary, messages)
+    return RunnableLambda(add, name="summary_context")
+
+
+class HistoryCompactor:
+    """
+    对话历史的压缩策略，每轮对话结束后在后台执行，当前请求不等待压缩完成
+        window:    保留最近的 window 条消息，窗口总是从一条用户消息开始
+        slack:     消息数量超过 window + slack 时才压缩，避免每轮对话都重写 messages
+        summarize: 被移除的消息由 LLM 合并到 state.summary 中，需要提供 llm 和 prompt；
+                   话题切换和新建任务的 prompt 通过 summary_messages/summary_context 带上这个摘要
+        lock:      会话锁（LocalThreadLock/RedisThreadLock），写入压缩结果时与该会话的下一轮对话互斥
+    SystemMessage 和 additional_kwargs 中带有 pinned 的消息不会被移除，PipelineState.args 不在 messages 中，始终保留；
+    会话有未完成的 interrupt 时不压缩
+    """
+    def __init__(self,
+                 window: Optional[int] = 20,
+                 slack: int = 10,
+                 summarize: bool = False,
+                 llm = None,
+                 prompt: Optional[str] = None,
+                 lock = None):
+        self.window = window
+        self.slack = slack
+        self.summarize = summarize and llm is not None and prompt is not None
+        self.llm = llm.with_config(tags=[TAG_NOSTREAM]) if llm is not None else None
+        self.prompt = HumanMessagePromptTemplate.from_template(prompt) if prompt else None
+        self.lock = lock
+        self.tasks: dict[str, asyncio.Task] = {}
+
+        self.compactions = 0
+        self.removed = 0
+        self.failures = 0
+        self.compact_time = 0.0
+
+    @staticmethod
+    def pinned(message: BaseMessage) -> bool:
+        return isinstance(message, SystemMessage) or bool(message.additional_kwargs.get("pinned"))
+
+    def select(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        返回需要移除的消息
+        """
+        if self.window is None or len(messages) <= self.window + self.slack:
+            return []
+        start = len(messages) - self.window
+        # 窗口从用户消息开始，不保留没有对应问题的回复
+        while start < len(messages) and not isinstance(messages[start], HumanMessage):
+            start += 1
+        return [message for message in messages[:start] if not self.pinned(message)]
+
+    async def asummarize(self, values: dict, messages: list[BaseMessage]) -> str:
+        history = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        prompt = self.prompt.format(summary=values.get("summary") or "",
+                                    args={k: v for k, v in (values.get("args") or {}).items()
+                                              if isinstance(k, str) and v is not None},
+                                    messages=history)
+        response = await self.llm.ainvoke([prompt])
+        return response.content
+
+    async def acompact(self, graph, config: dict) -> int:
+        """
+        压缩一个会话的历史，返回移除的消息数量
+        """
+        snapshot = await graph.aget_state(config)
+        if not snapshot.values or snapshot.next:
+            return 0
+        removed = self.select(snapshot.values.get("messages", []))
+        if not removed:
+            return 0
+
+        start = time.perf_counter()
+        update = {"messages": [RemoveMessage(id=message.id) for message in removed]}
+        if self.summarize:
+            # LLM 调用在会话锁之外执行，不阻塞该会话的下一轮对话
+            update["summary"] = await self.asummarize(snapshot.values, removed)
+
+        async def write():
+            current = await graph.aget_state(config)
+            if current.next:
+                return 0
+            # 后台压缩期间会话可能已经进入下一轮，只移除仍然存在的消息
+            ids = {message.id for message in current.values.get("messages", [])}
+            update["messages"] = [message for message in update["messages"] if message.id in ids]
+            await graph.aupdate_state(config, update)
+            return len(update["messages"])
+
+        if self.lock is not None:
+            async with self.lock.hold(config["configurable"]["thread_id"]):
+                count = await write()
+        else:
+            count = await write()
+
+        self.compactions += 1
+        self.removed += count
+        self.compact_time += time.perf_counter() - start
+        logger.debug(f"compacted thread {config['configurable']['thread_id']}: removed {count} messages")
+        return count
+
+    def schedule(self, graph, config: dict):
+        """
+        在后台压缩会话历史，同一个会话同时只有一个压缩任务
+        """
+        if self.window is None:
+            return
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id in self.tasks:
+            return
+
+        async def run():
+            try:
+                await self.acompact(graph, {"configurable": {"thread_id": thread_id}})
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"failed to compact thread {thread_id}: {e}")
+            finally:
+                self.tasks.pop(thread_id, None)
+
+        self.tasks[thread_id] = asyncio.get_running_loop().create_task(run())
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.tasks),
+            "compactions": self.compactions,
+            "removed": self.removed,
+            "failures": self.failures,
+            "avg_compact_ms": 1000 * self.compact_time / self.compactions if self.compactions else 0.0,
+        }
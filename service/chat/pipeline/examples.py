@@ -0,0 +1,101 @@
+import re
+import math
+import threading
+from collections import Counter
+from typing import Callable, Optional
+
+from loguru import logger
+from langchain_core.example_selectors import BaseExampleSelector
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数量：每个单词按 4 个字符一个 token 计算，标点符号各算一个 token
+    """
+    words = re.findall(r"\w+", text)
+    return sum(math.ceil(len(word) / 4) for word in words) + len(re.findall(r"[^\w\s]", text))
+
+
+class TokenBudgetExampleSelector(BaseExampleSelector):
+    """
+    在 token 预算内选择与当前对话最相关的 few-shot 示例
+        1. 查询文本由当前轮的 query_keys（user_input, tip 以及 get_missing_key 返回的 missing_key）组成
+        2. 使用 TF-IDF 加权的词特征计算查询与每个示例的余弦相似度，所有示例都包含的模板文字权重很低
+        3. 按相似度从高到低选择最多 k 个示例，总 token 数不超过 token_budget，然后按示例原来的顺序输出，
+           保证多轮对话示例的先后顺序不变
+    k 和 token_budget 为 None 时不做限制
+    """
+    def __init__(self,
+                 examples: list[dict],
+                 k: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 query_keys: tuple = ("user_input", "tip", "missing_key"),
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.k = k
+        self.token_budget = token_budget
+        self.query_keys = query_keys
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()
+
+        self.examples: list[dict] = []
+        self.tokens: list[int] = []
+        for example in examples:
+            self.add_example(example)
+
+        self.calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @staticmethod
+    def features(text: str) -> Counter:
+        # 按下划线拆分，使 missing_key（例如 sequencing_species）可以和用户输入中的单词匹配
+        return Counter(re.findall(r"[^\W_]+", text.lower()))
+
+    def add_example(self, example: dict[str, str]):
+        self.examples.append(example)
+        self.tokens.append(self.count_tokens(" ".join(map(str, example.values()))))
+        self.build_index()
+
+    def build_index(self):
+        docs = [self.features(" ".join(map(str, example.values()))) for example in self.examples]
+        df = Counter(g for doc in docs for g in doc)
+        self.idf = {g: math.log((1 + len(docs)) / (1 + n)) + 1 for g, n in df.items()}
+        self.vectors = [self.vectorize(doc) for doc in docs]
+
+    def vectorize(self, grams: Counter) -> dict[str, float]:
+        vector = {g: (1 + math.log(tf)) * self.idf[g] for g, tf in grams.items() if g in self.idf}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {g: w / norm for g, w in vector.items()}
+
+    def select_examples(self, input_variables: dict[str, str]) -> list[dict]:
+        query = " ".join(str(input_variables.get(key) or "") for key in self.query_keys)
+        vector = self.vectorize(self.features(query))
+        scores = [sum(w * doc.get(g, 0.0) for g, w in vector.items()) for doc in self.vectors]
+
+        selected, used = [], 0
+        for i in sorted(range(len(self.examples)), key=lambda i: scores[i], reverse=True):
+            if self.k is not None and len(selected) >= self.k:
+                break
+            if self.token_budget is not None and used + self.tokens[i] > self.token_budget:
+                continue
+            selected.append(i)
+            used += self.tokens[i]
+        selected.sort()
+
+        with self.lock:
+            self.calls += 1
+            self.tokens_before += sum(self.tokens)
+            self.tokens_after += used
+        logger.debug(f"few-shot examples: {len(selected)}/{len(self.examples)}, "
+                     f"tokens: {used}/{sum(self.tokens)}")
+        return [self.examples[i] for i in selected]
+
+    def stats(self) -> dict:
+        with self.lock:
+            calls = self.calls or 1
+            return {
+                "examples": len(self.examples),
+                "calls": self.calls,
+                "tokens_before": self.tokens_before / calls,
+                "tokens_after": self.tokens_after / calls,
+            }
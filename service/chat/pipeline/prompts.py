@@ -1,21 +1,29 @@
+import os
 import yaml
-from typing import Literal
-from langchain.prompts import (PromptTemplate, 
+from operator import itemgetter
+from typing import Literal, Optional
+from langchain_core.prompts import (PromptTemplate, 
                                ChatPromptTemplate, 
                                HumanMessagePromptTemplate, 
                                AIMessagePromptTemplate, 
                                SystemMessagePromptTemplate, 
                                FewShotPromptTemplate, 
                                FewShotChatMessagePromptTemplate)
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from loguru import logger
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.runnables import RunnableLambda, RunnableMap, RunnablePassthrough
 
 
 from service.chat.states import PipelineState
+from service.chat.history import summary_context
+from service.chat.pipeline.examples import TokenBudgetExampleSelector
 from service.chat.constants import (PipelineTaskAction,
                                             PROJECT_NAME_KEY, BATCH_ID_KEY, 
                                             Sequencing_Type_KEY, Pipeline_Type_KEY,
                                             Pipeline_Name_KEY, Sequencing_Species_KEY,
-                                            Analysis_Mode_KEY, DataSource_Type_KEY, KEYWORD_TOPICS_KEY)
+                                            Analysis_Mode_KEY, DataSource_Type_KEY, KEYWORD_TOPICS_KEY, EXTRACTION_TAG)
 
 constants_dict = {"ProjectNameKey": PROJECT_NAME_KEY,
                   "BatchIDKey": BATCH_ID_KEY,
@@ -26,11 +34,83 @@ constants_dict = {"ProjectNameKey": PROJECT_NAME_KEY,
                   "AnalysisModeKey": Analysis_Mode_KEY,
                   "DataSourceTypeKey": DataSource_Type_KEY}
 
+# 每轮对话变化的值，模板中的 {ProjectNameValue} 等占位符保留为模板变量，在每轮对话中通过 partial 填入
+values_dict = {"ProjectNameValue": PROJECT_NAME_KEY,
+               "BatchIDValue": BATCH_ID_KEY,
+               "SequencingTypeValue": Sequencing_Type_KEY,
+               "PipelineTypeValue": Pipeline_Type_KEY,
+               "PipelineNameValue": Pipeline_Name_KEY,
+               "SequencingSpeciesValue": Sequencing_Species_KEY,
+               "AnalysisModeValue": Analysis_Mode_KEY,
+               "DataSourceTypeValue": DataSource_Type_KEY}
+
+late_bound_dict = {**constants_dict, **{name: "{" + name + "}" for name in values_dict}}
+
+class NewTaskTurn(BaseModel):
+    """
+    新建任务时一次 LLM 调用的结构化输出：提取到的参数和下一个问题，取值范围与 task_new.yaml 中的 Keyword Specifications 一致
+    """
+    project_name: Optional[str] = Field(None, description="The abbreviation of the research project")
+    batch_id: Optional[str] = Field(None, description="The batch ID, e.g. batch01")
+    sequencing_type: Optional[Literal["WES", "WGS", "RNAseq"]] = None
+    pipeline_name: Optional[Literal["nfcore/Sarek", "GeSA", "nfcore/rnafusion", "nfcore/rnaseq"]] = None
+    sequencing_species: Optional[Literal["human", "mouse"]] = None
+    analysis_mode: Optional[Literal["TvN", "Tonly", "rnafusion", "rnaseq"]] = None
+    data_source_type: Optional[Literal["iRODS", "AWS", "Storage", "Scratch"]] = None
+    message: str = Field(..., description="The question to ask the user next")
+
+def structured_llm(llm, schema=NewTaskTurn):
+    """
+    返回 {"raw", "parsed", "parsing_error"}，支持结构化输出的模型（Ollama, OpenAI 兼容接口）在解码时就受 JSON schema 约束，
+    其他模型只按 schema 校验回复的内容
+    """
+    try:
+        return llm.with_structured_output(schema, include_raw=True)
+    except NotImplementedError:
+        parser = PydanticOutputParser(pydantic_object=schema)
+        parser_assign = RunnablePassthrough.assign(parsed=itemgetter("raw") | parser, parsing_error=lambda _: None)
+        parser_none = RunnablePassthrough.assign(parsed=lambda _: None)
+        return RunnableMap(raw=llm) | parser_assign.with_fallbacks([parser_none], exception_key="parsing_error")
+
 class pipeline_prompt_builder:
-    def __init__(self, prompt_file="config/prompts/pipeline/pipeline_task_new.yaml"):
+    def __init__(self, prompt_file="config/prompts/pipeline/task_new.yaml", few_shot_k=None, few_shot_token_budget=None, structured_output=False):
         self.prompt_file = prompt_file
-        with open(prompt_file, "r") as f : 
-            self.prompt_data = yaml.safe_load(f)
+        # 新建任务时一次调用同时完成提取和提问，校验失败时退回 formatter + question 两次调用
+        self.structured_output = structured_output
+        self.structured_turns = 0
+        self.fallback_turns = 0
+        self.prompt_mtime = None
+        # few-shot 示例的数量和 token 预算，都为 None 时每次调用都发送全部示例
+        self.few_shot_k = few_shot_k
+        self.few_shot_token_budget = few_shot_token_budget
+        # (task_name, prompt_type) -> 只包含静态部分的 ChatPromptTemplate
+        self.templates = {}
+        # (task_name, prompt_type) -> TokenBudgetExampleSelector
+        self.selectors = {}
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        """
+        只有在 prompt 文件被修改后才重新读取，并清空模板缓存
+        """
+        mtime = os.path.getmtime(self.prompt_file)
+        if mtime != self.prompt_mtime:
+            with open(self.prompt_file, "r") as f : 
+                self.prompt_data = yaml.safe_load(f)
+            self.prompt_mtime = mtime
+            self.templates.clear()
+            self.selectors.clear()
+
+    def get_prompts(self, task_name, prompt_type: str = Literal["formatter", "question", None]):
+        """
+        返回缓存的模板，系统提示和 few-shot 示例只在第一次使用或者 prompt 文件修改后构建一次，
+        每轮对话变化的值保留为模板变量
+        """
+        self.reload_if_changed()
+        key = (task_name, prompt_type)
+        if key not in self.templates:
+            self.templates[key] = self.load_prompts(task_name, prompt_type, late_bound_dict)
+        return self.templates[key]
 
     def load_system_prompts(self, task_name, constants_dict = constants_dict):
         system_template = self.prompt_data.get(task_name).get("system").format(**constants_dict)
@@ -69,12 +149,36 @@ class pipeline_prompt_builder:
 
         return prompts
 
+    def load_selected_few_shot_prompts(self, task_name, prompt_type: str = Literal["formatter", "question", None], constants_dict = constants_dict):
+        """
+        把单轮和多轮对话的示例合并后交给 TokenBudgetExampleSelector，每次格式化时按当前对话选择示例
+        """
+        examples = [example
+                        for few_shot_type in ("single-turn", "multi-turn")
+                            for prompt in self.load_few_shot_prompts(task_name, prompt_type, few_shot_type, constants_dict)
+                                for example in prompt.examples]
+        selector = TokenBudgetExampleSelector(examples, k = self.few_shot_k, token_budget = self.few_shot_token_budget)
+        self.selectors[(task_name, prompt_type)] = selector
+
+        prompt = FewShotChatMessagePromptTemplate(
+            example_prompt = (
+                HumanMessagePromptTemplate.from_template("{user}") + AIMessagePromptTemplate.from_template("{assistant}")
+            ),
+            example_selector = selector,
+            input_variables = ["user_input"],
+        )
+        return [prompt]
+
     def load_prompts(self, task_name, prompt_type: str = Literal["formatter", "question", None], constants_dict = constants_dict):
         system_prompt = self.load_system_prompts(task_name, constants_dict)
         output_prompt = self.load_output_prompts(task_name, prompt_type)
         ai_msg_format_prompt = self.load_msg_format_prompts(task_name, prompt_type,   constants_dict)
-        single_turn_prompts  = self.load_few_shot_prompts(task_name, prompt_type, "single-turn", constants_dict)
-        multi_turn_prompts   = self.load_few_shot_prompts(task_name, prompt_type, "multi-turn",  constants_dict)
+        if self.few_shot_k is None and self.few_shot_token_budget is None:
+            single_turn_prompts  = self.load_few_shot_prompts(task_name, prompt_type, "single-turn", constants_dict)
+            multi_turn_prompts   = self.load_few_shot_prompts(task_name, prompt_type, "multi-turn",  constants_dict)
+        else:
+            single_turn_prompts  = self.load_selected_few_shot_prompts(task_name, prompt_type, constants_dict)
+            multi_turn_prompts   = []
         # end_prompt = self.load_end_prompts(task_name)
 
         # 定义主要提示模板，包含系统提示、few-shot示例和人类信息提示
@@ -106,20 +210,59 @@ class pipeline_prompt_builder:
             return BATCH_ID_KEY
 
     def new_pipeline_task_prompt(self, state: PipelineState, task_name = "task_new"):
-        d = constants_dict.copy()
-        d["ProjectNameValue"] = state.args.get(PROJECT_NAME_KEY)
-        d["BatchIDValue"] = state.args.get(BATCH_ID_KEY)
-        d["SequencingTypeValue"] = state.args.get(Sequencing_Type_KEY)
-        d["PipelineTypeValue"] = state.args.get(Pipeline_Type_KEY)
-        d["PipelineNameValue"] = state.args.get(Pipeline_Name_KEY)
-        d["SequencingSpeciesValue"] = state.args.get(Sequencing_Species_KEY)
-        d["AnalysisModeValue"] = state.args.get(Analysis_Mode_KEY)
-        d["DataSourceTypeValue"] = state.args.get(DataSource_Type_KEY)
-        # d["missing_key"] = self.get_missing_key(state)
-        formatter_prompt= self.load_prompts(task_name = task_name, prompt_type = "formatter", constants_dict = d)
-        question_prompt = self.load_prompts(task_name = task_name, prompt_type = "question",  constants_dict = d)
+        values = {name: str(state.args.get(key)) for name, key in values_dict.items()}
+        # missing_key 不出现在模板中，只用于选择与当前缺失信息相关的 few-shot 示例
+        values["missing_key"] = self.get_missing_key(state) or ""
+        formatter_prompt= self.get_prompts(task_name = task_name, prompt_type = "formatter").partial(**values)
+        question_prompt = self.get_prompts(task_name = task_name, prompt_type = "question").partial(**values)
         return formatter_prompt, question_prompt
 
+    def structured_pipeline_task_prompt(self, state: PipelineState, task_name = "task_new"):
+        values = {name: str(state.args.get(key)) for name, key in values_dict.items()}
+        values["missing_key"] = self.get_missing_key(state) or ""
+        return self.get_prompts(task_name = task_name, prompt_type = "structured").partial(**values)
+
+    def new_pipeline_task_chain(self, llm, state: PipelineState, task_name = "task_new", structured = None):
+        """
+        新建任务的一轮对话，输入 {"user_input": ...}，更新 state.args 并返回向用户提出的下一个问题
+            structured: 一次调用输出 NewTaskTurn，校验失败（JSON 无效或者取值不在范围内）时退回两次调用，默认使用 self.structured_output
+            两次调用:   formatter 提取参数，formatter_update_state 解析后生成 tip，再由 question 生成下一个问题
+        """
+        structured = self.structured_output if structured is None else structured
+        structured_chain = structured_llm(llm)
+        # 压缩后的历史摘要放在每个 prompt 之前
+        context = summary_context(state.summary)
+
+        def two_call_turn(inputs, formatter_output):
+            _, changed = self.formatter_update_state(formatter_output, state)
+            tip = self.build_tip(task_name, state, changed)
+            _, question_prompt = self.new_pipeline_task_prompt(state, task_name)
+            return question_prompt, {**inputs, "tip": tip}
+
+        def run(inputs):
+            if structured:
+                result = (self.structured_pipeline_task_prompt(state, task_name) | context | structured_chain).invoke(inputs)
+                response = self.structured_update_state(result, state)
+                if response is not None:
+                    return response
+            formatter_prompt, _ = self.new_pipeline_task_prompt(state, task_name)
+            formatter = (formatter_prompt | context | llm).with_config(tags=[EXTRACTION_TAG])
+            question_prompt, inputs = two_call_turn(inputs, formatter.invoke(inputs))
+            return (question_prompt | context | llm).invoke(inputs)
+
+        async def arun(inputs):
+            if structured:
+                result = await (self.structured_pipeline_task_prompt(state, task_name) | context | structured_chain).ainvoke(inputs)
+                response = self.structured_update_state(result, state)
+                if response is not None:
+                    return response
+            formatter_prompt, _ = self.new_pipeline_task_prompt(state, task_name)
+            formatter = (formatter_prompt | context | llm).with_config(tags=[EXTRACTION_TAG])
+            question_prompt, inputs = two_call_turn(inputs, await formatter.ainvoke(inputs))
+            return await (question_prompt | context | llm).ainvoke(inputs)
+
+        return RunnableLambda(run, afunc=arun, name="new_pipeline_task")
+
     def del_pipeline_task_prompt(self, state: PipelineState):
         return
 
@@ -168,7 +311,28 @@ class pipeline_prompt_builder:
                 changed = True
         return state, changed
     
+    def structured_update_state(self, result: dict, state: PipelineState) -> Optional[AIMessage]:
+        """
+        使用校验通过的 NewTaskTurn 更新 state.args（规则与 formatter_update_state 相同，只填写还没有值的参数），
+        返回下一个问题；校验失败时返回 None
+        """
+        turn = result.get("parsed")
+        if result.get("parsing_error") is not None or turn is None or not turn.message.strip():
+            self.fallback_turns += 1
+            logger.warning(f"structured output is invalid, falling back to formatter + question: {result.get('parsing_error')}")
+            return None
+
+        self.structured_turns += 1
+        for k, v in turn.model_dump(exclude={"message"}).items():
+            if v is None or v.strip() in ("", "None"):
+                continue
+            if state.args.get(k) is None:
+                state.args.update({k: v})
+        state.args.update({KEYWORD_TOPICS_KEY: self.get_missing_key(state)})
+        return AIMessage(content=turn.message)
+
     def build_tip(self, task_name, state: BaseModel, changed):
+        self.reload_if_changed()
 
         if None not in state.args.values():
             return None
@@ -1,6 +1,12 @@
 import os
+import time
+import asyncio
+import threading
+import weakref
 from enum import Enum
 from datetime import datetime 
+from functools import partial
+from graphlib import CycleError, TopologicalSorter
 from typing import Annotated, Optional, TypedDict
 
 from dotenv import load_dotenv
@@ -8,6 +14,7 @@ from pydantic import BaseModel, Field
 
 from langchain_core.messages import AnyMessage, BaseMessage, ToolMessage, AIMessage
 from langchain_core.tools import InjectedToolCallId, tool
+from langchain_core.runnables import RunnableLambda
 from langchain_ollama import ChatOllama
 
 from langgraph.graph import StateGraph, START, END
@@ -15,10 +22,14 @@ from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
 from langgraph.checkpoint.memory import MemorySaver
-from langgraph.types import Command, interrupt
+from langgraph.config import get_config
+from langgraph.errors import GraphBubbleUp
+from langgraph.types import Command, Send, interrupt
 
 from random import randint
 
+from loguru import logger
+
 # TODO:
 # 1. 为每个阶段添加具体的执行逻辑
 # 2. 添加工作流程的状态转换逻辑
@@ -74,89 +85,219 @@ class AnalysisWorkflowStages(Enum):
     NOTIFY        = "notify"
     COMPLETED     = "completed"
 
+# 各阶段依赖的阶段，依赖全部完成后才开始执行；没有依赖关系的阶段在同一步中并发执行：
+# 分析完成后备份和通知同时进行，备份完成后才清理临时文件，清理和通知都完成后工作流程结束
+STAGE_DEPENDENCIES = {
+    AnalysisWorkflowStages.INIT:          (),
+    AnalysisWorkflowStages.DOWNLOADING:   (AnalysisWorkflowStages.INIT,),
+    AnalysisWorkflowStages.MD5CHECKING:   (AnalysisWorkflowStages.DOWNLOADING,),
+    AnalysisWorkflowStages.DATAPREPARING: (AnalysisWorkflowStages.MD5CHECKING,),
+    AnalysisWorkflowStages.ANALYZING:     (AnalysisWorkflowStages.DATAPREPARING,),
+    AnalysisWorkflowStages.BACKINGUP:     (AnalysisWorkflowStages.ANALYZING,),
+    AnalysisWorkflowStages.NOTIFY:        (AnalysisWorkflowStages.ANALYZING,),
+    AnalysisWorkflowStages.CLEANINGUP:    (AnalysisWorkflowStages.BACKINGUP,),
+    AnalysisWorkflowStages.COMPLETED:     (AnalysisWorkflowStages.CLEANINGUP, AnalysisWorkflowStages.NOTIFY),
+}
+
+# 原来的线性顺序：按 AnalysisWorkflowStages 的定义顺序依次执行
+LINEAR_STAGE_DEPENDENCIES = {
+    stage: (previous,) if previous is not None else ()
+    for previous, stage in zip([None, *AnalysisWorkflowStages], AnalysisWorkflowStages)
+}
+
+# 按样本拆分执行的阶段，每个样本单独执行阶段子图，失败的样本单独重试
+SAMPLE_STAGES = (
+    AnalysisWorkflowStages.DOWNLOADING,
+    AnalysisWorkflowStages.MD5CHECKING,
+    AnalysisWorkflowStages.DATAPREPARING,
+)
+
+def merge_results(left: dict, right: dict) -> dict:
+    """
+    合并 {阶段: {样本: 结果}}，同一步中并发执行的样本分别写入自己的结果
+    """
+    merged = {stage: dict(samples) for stage, samples in (left or {}).items()}
+    for stage, samples in (right or {}).items():
+        merged.setdefault(stage, {}).update(samples)
+    return merged
+
+class SampleTask(TypedDict):
+    stage: str
+    sample: str
+
 class StageState(BaseModel):
     messages: Annotated[list[AnyMessage], add_messages]
+    stage: str = Field(AnalysisWorkflowStages.INIT.value, description = "The workflow stage executed by the stage graph")
+    sample: Optional[str] = Field(None, description = "The sample processed by the stage graph, None for the whole batch")
     execute: bool = Field(True, description = "Whether the stage is to be executed")
     resume_count: int = Field(0, description = "The number of times the stage has been resumed")
 
+    @property
+    def label(self) -> str:
+        return f"{self.stage}[{self.sample}]" if self.sample is not None else self.stage
+
 class PipelineState(BaseModel):
     messages: Annotated[list[AnyMessage], add_messages]
+    samples: list[str] = Field(default_factory = list, description = "The samples of the project batch")
+    results: Annotated[dict[str, dict[str, dict]], merge_results] = Field(
+        default_factory = dict, description = "The result of each sample in each per-sample stage")
     # action:   Annotated[str, Field(description="The action to be taken regarding to the tasks of pipeline")]
 
 class PipelineWorkflow(StateGraph):
-    def __init__(self, checkpointer = MemorySaver()):
+    """
+    数据分析工作流程，每个 AnalysisWorkflowStages 阶段是主图的一个节点
+        1. 阶段之间的依赖关系由 dependencies 声明（有向无环图），默认为 STAGE_DEPENDENCIES；
+           依赖相同阶段的多个阶段在同一步中并发执行，依赖多个阶段的阶段等待所有依赖完成
+        2. 所有阶段共用一个编译好的阶段子图（init -> running -> completed / failed -> auto-resume / human-intervention），
+           执行的阶段由 StageState.stage 指定
+        3. sample_stages 中的阶段按 PipelineState.samples 拆分（map-reduce）：上一个阶段完成后为每个样本发送一个 Send，
+           样本节点（{阶段}-sample）各自执行阶段子图，同时执行的样本不超过 max_concurrency 个；
+           出错的样本最多执行 max_attempts 次，不影响其他样本，每个样本的状态、执行次数和错误保存在 PipelineState.results，
+           所有样本结束后由阶段节点汇总；失败的样本不再进入后面的按样本执行的阶段。没有样本时整个阶段执行一次
+           按样本执行的阶段只能依赖一个阶段
+        4. events（service.tasks.events.JobEventPublisher）不为 None 时，阶段和样本的状态变化写入任务事件流，
+           job_id 为图执行的 thread_id
+    """
+    def __init__(self, checkpointer = MemorySaver(), dependencies = None, sample_stages = SAMPLE_STAGES,
+                 max_concurrency = 8, max_attempts = 3, retry_interval = 1.0, events = None):
         super().__init__(PipelineState)
         self.checkpointer = checkpointer
-        self.stage_dict = {}
-        for stage in AnalysisWorkflowStages:
-            stage_builder = StateGraph(StageState)
-            stage_builder.add_node(PipelineStatus.INIT.value, self.pipeline_init)
-            stage_builder.add_node(PipelineStatus.RUNNING.value, self.pipeline_running)
-            stage_builder.add_node(PipelineStatus.COMPLETED.value, self.pipeline_completed)
-            stage_builder.add_node(PipelineStatus.FAILED.value, self.pipeline_failed)
-            stage_builder.add_node(PipelineStatus.AUTO_RESUME.value, self.pipeline_auto_resume)
-            stage_builder.add_node(PipelineStatus.HUMAN_INTERVENTION.value, self.pipeline_human_intervention)            
-            stage_builder.add_edge(START, PipelineStatus.INIT.value)
-            stage_builder.add_edge(PipelineStatus.INIT.value, PipelineStatus.RUNNING.value)
-            stage_builder.add_conditional_edges(PipelineStatus.RUNNING.value, 
-                                                self.route_state_running, 
-                                                [PipelineStatus.COMPLETED.value, 
-                                                 PipelineStatus.FAILED.value, 
-                                                 PipelineStatus.HUMAN_INTERVENTION.value])
-            stage_builder.add_conditional_edges(PipelineStatus.FAILED.value,
-                                                self.route_state_failed,
-                                                [PipelineStatus.AUTO_RESUME.value,
-                                                 PipelineStatus.HUMAN_INTERVENTION.value])
-            stage_builder.add_edge(PipelineStatus.AUTO_RESUME.value, PipelineStatus.RUNNING.value)
-            stage_builder.add_edge(PipelineStatus.HUMAN_INTERVENTION.value, PipelineStatus.RUNNING.value)
-            stage_builder.add_edge(PipelineStatus.COMPLETED.value, END)
-            self.stage_dict[stage] = stage_builder.compile(checkpointer = self.checkpointer)
-
-        self.add_node(AnalysisWorkflowStages.INIT.value, self.call_stage_init)
-        self.add_node(AnalysisWorkflowStages.DOWNLOADING.value, self.call_stage_download)
-        self.add_node(AnalysisWorkflowStages.MD5CHECKING.value, self.call_stage_md5check)
-        self.add_node(AnalysisWorkflowStages.DATAPREPARING.value, self.call_stage_dataprepare)
-        self.add_node(AnalysisWorkflowStages.ANALYZING.value, self.call_stage_analyze)
-        self.add_node(AnalysisWorkflowStages.BACKINGUP.value, self.call_stage_backup)
-        self.add_node(AnalysisWorkflowStages.CLEANINGUP.value, self.call_stage_cleanup)
-        self.add_node(AnalysisWorkflowStages.NOTIFY.value, self.call_stage_notify)
-        self.add_node(AnalysisWorkflowStages.COMPLETED.value, self.call_stage_completed)
-
-        self.add_edge(START, AnalysisWorkflowStages.INIT.value)
-        self.add_edge(AnalysisWorkflowStages.INIT.value, AnalysisWorkflowStages.DOWNLOADING.value)
-        self.add_edge(AnalysisWorkflowStages.DOWNLOADING.value, AnalysisWorkflowStages.MD5CHECKING.value)
-        self.add_edge(AnalysisWorkflowStages.MD5CHECKING.value, AnalysisWorkflowStages.DATAPREPARING.value)
-        self.add_edge(AnalysisWorkflowStages.DATAPREPARING.value, AnalysisWorkflowStages.ANALYZING.value)
-        self.add_edge(AnalysisWorkflowStages.ANALYZING.value, AnalysisWorkflowStages.BACKINGUP.value)
-        self.add_edge(AnalysisWorkflowStages.BACKINGUP.value, AnalysisWorkflowStages.CLEANINGUP.value)
-        self.add_edge(AnalysisWorkflowStages.CLEANINGUP.value, AnalysisWorkflowStages.NOTIFY.value)
-        self.add_edge(AnalysisWorkflowStages.NOTIFY.value, AnalysisWorkflowStages.COMPLETED.value)
-        self.add_edge(AnalysisWorkflowStages.COMPLETED.value, END)
-    
+        self.dependencies = self.validate_dependencies(dependencies or STAGE_DEPENDENCIES)
+        self.sample_stages = {AnalysisWorkflowStages(stage) for stage in sample_stages} & set(self.dependencies)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.events = events
+        # 同时执行的样本数，同步执行时在线程池中，异步执行时每个事件循环一个信号量
+        self.sample_slots = threading.BoundedSemaphore(max_concurrency)
+        self.async_sample_slots = weakref.WeakKeyDictionary()
+
+        stage_builder = StateGraph(StageState)
+        stage_builder.add_node(PipelineStatus.INIT.value, self.pipeline_init)
+        stage_builder.add_node(PipelineStatus.RUNNING.value, self.pipeline_running)
+        stage_builder.add_node(PipelineStatus.COMPLETED.value, self.pipeline_completed)
+        stage_builder.add_node(PipelineStatus.FAILED.value, self.pipeline_failed)
+        stage_builder.add_node(PipelineStatus.AUTO_RESUME.value, self.pipeline_auto_resume)
+        stage_builder.add_node(PipelineStatus.HUMAN_INTERVENTION.value, self.pipeline_human_intervention)
+        stage_builder.add_edge(START, PipelineStatus.INIT.value)
+        stage_builder.add_edge(PipelineStatus.INIT.value, PipelineStatus.RUNNING.value)
+        stage_builder.add_conditional_edges(PipelineStatus.RUNNING.value, 
+                                            self.route_state_running, 
+                                            [PipelineStatus.COMPLETED.value, 
+                                             PipelineStatus.FAILED.value, 
+                                             PipelineStatus.HUMAN_INTERVENTION.value])
+        stage_builder.add_conditional_edges(PipelineStatus.FAILED.value,
+                                            self.route_state_failed,
+                                            [PipelineStatus.AUTO_RESUME.value,
+                                             PipelineStatus.HUMAN_INTERVENTION.value])
+        stage_builder.add_edge(PipelineStatus.AUTO_RESUME.value, PipelineStatus.RUNNING.value)
+        stage_builder.add_edge(PipelineStatus.HUMAN_INTERVENTION.value, PipelineStatus.RUNNING.value)
+        stage_builder.add_edge(PipelineStatus.COMPLETED.value, END)
+        self.stage_graph = stage_builder.compile(checkpointer = self.checkpointer)
+        # 兼容按阶段取子图的代码，所有阶段都是同一个子图
+        self.stage_dict = dict.fromkeys(AnalysisWorkflowStages, self.stage_graph)
+
+        for stage in self.dependencies:
+            self.add_node(stage.value, RunnableLambda(partial(self.call_stage, stage=stage),
+                                                      afunc = partial(self.acall_stage, stage=stage),
+                                                      name  = stage.value))
+
+        for stage in self.sample_stages:
+            if len(self.dependencies[stage]) > 1:
+                raise ValueError(f"Per-sample stage {stage.value} must depend on a single stage")
+            self.add_node(self.sample_node(stage), RunnableLambda(partial(self.call_sample, stage=stage),
+                                                                  afunc = partial(self.acall_sample, stage=stage),
+                                                                  name  = self.sample_node(stage)))
+            self.add_edge(self.sample_node(stage), stage.value)
+
+        downstream = {dependency for dependencies in self.dependencies.values() for dependency in dependencies}
+        for stage, dependencies in self.dependencies.items():
+            if stage in self.sample_stages:
+                # 上一个阶段完成后按样本拆分，没有样本时直接执行整个阶段
+                self.add_conditional_edges(dependencies[0].value if dependencies else START,
+                                           partial(self.fan_out, stage=stage),
+                                           [self.sample_node(stage), stage.value])
+            elif not dependencies:
+                self.add_edge(START, stage.value)
+            elif len(dependencies) == 1:
+                self.add_edge(dependencies[0].value, stage.value)
+            else:
+                # 多个依赖时等待所有依赖阶段完成
+                self.add_edge([dependency.value for dependency in dependencies], stage.value)
+            if stage not in downstream:
+                self.add_edge(stage.value, END)
+
+    def report(self, stage: str, status: str, sample: Optional[str] = None, **fields):
+        if self.events is None:
+            return
+        job_id = get_config().get("configurable", {}).get("thread_id")
+        if job_id is not None:
+            self.events.publish(str(job_id), status, stage = stage, sample = sample, **fields)
+
+    @staticmethod
+    def sample_node(stage: AnalysisWorkflowStages) -> str:
+        return f"{stage.value}-sample"
+
+    @staticmethod
+    def failed_samples(state: BaseModel) -> set:
+        return {sample for results in state.results.values()
+                       for sample, result in results.items() if result["status"] == PipelineStatus.FAILED.value}
+
+    def fan_out(self, state: BaseModel, stage: AnalysisWorkflowStages):
+        if not state.samples:
+            return stage.value
+        failed = self.failed_samples(state)
+        samples = [sample for sample in state.samples if sample not in failed]
+        if not samples:
+            return stage.value
+        return [Send(self.sample_node(stage), SampleTask(stage=stage.value, sample=sample)) for sample in samples]
+
+    @staticmethod
+    def validate_dependencies(dependencies):
+        """
+        检查依赖关系是有向无环图，并且依赖的阶段都在图中，返回按拓扑顺序排列的 {阶段: (依赖的阶段, ...)}
+        """
+        dependencies = {AnalysisWorkflowStages(stage): tuple(AnalysisWorkflowStages(d) for d in deps)
+                        for stage, deps in dependencies.items()}
+        for stage, deps in dependencies.items():
+            missing = [d.value for d in deps if d not in dependencies]
+            if missing:
+                raise ValueError(f"Stage {stage.value} depends on stages not in the workflow: {missing}")
+        try:
+            order = list(TopologicalSorter(dependencies).static_order())
+        except CycleError as e:
+            raise ValueError(f"Stage dependencies contain a cycle: {[s.value for s in e.args[1]]}") from e
+        return {stage: dependencies[stage] for stage in order}
+
     def pipeline_init(self, state: BaseModel) -> BaseModel:
-        print("pipeline init")
-        state.messages += ["pipeline init"]
+        print(f"pipeline init: {state.label}")
+        state.messages += [f"{state.label}: pipeline init"]
+        self.report(state.stage, PipelineStatus.INIT.value, state.sample)
         return state
 
     def pipeline_running(self, state: BaseModel) -> BaseModel:
-        print("pipeline running")
-        state.messages += ["pipeline running"]
+        print(f"pipeline running: {state.label}")
+        state.messages += [f"{state.label}: pipeline running"]
+        self.report(state.stage, PipelineStatus.RUNNING.value, state.sample)
         return state
 
     def pipeline_completed(self, state: BaseModel) -> BaseModel:
-        print("pipeline completed")
-        state.messages += ["pipeline completed"]
+        print(f"pipeline completed: {state.label}")
+        state.messages += [f"{state.label}: pipeline completed"]
+        self.report(state.stage, PipelineStatus.COMPLETED.value, state.sample)
         return state
     
     def pipeline_failed(self, state: BaseModel) -> BaseModel:
-        print("pipeline failed")
-        state.messages += ["pipeline failed"]
+        print(f"pipeline failed: {state.label}")
+        state.messages += [f"{state.label}: pipeline failed"]
+        self.report(state.stage, PipelineStatus.FAILED.value, state.sample)
         return state
     
     def pipeline_auto_resume(self, state: BaseModel) -> BaseModel:
-        print("pipeline auto resume")
+        print(f"pipeline auto resume: {state.label}")
         state.resume_count += 1
-        state.messages += ["pipeline auto resume"]
+        state.messages += [f"{state.label}: pipeline auto resume"]
+        self.report(state.stage, PipelineStatus.AUTO_RESUME.value, state.sample)
         return state
     
     def pipeline_human_intervention(self, state: BaseModel) -> BaseModel:
@@ -165,7 +306,7 @@ class PipelineWorkflow(StateGraph):
         Therefore, it is necessary to contact the bioinformatic team to resume the pipeline manually.
         TODO: send email to bioinformatic team to inform them to check the pipeline and resume it manually
         """
-        print("pipeline human intervention")
+        print(f"pipeline human intervention: {state.label}")
 
         # human_response = interrupt({
         #     "question": "The pipeline failed. Unfortunately, the agent was unable to automatically resume the pipeline. Could you contact bioinformatic team to resume the pipeline manually, please? ",
@@ -174,7 +315,8 @@ class PipelineWorkflow(StateGraph):
 
         # while not human_response.get("correct", "").lower().startswith("y"):
 
-        state.messages += ["pipeline human intervention"]
+        state.messages += [f"{state.label}: pipeline human intervention"]
+        self.report(state.stage, PipelineStatus.HUMAN_INTERVENTION.value, state.sample)
         state.resume_count = 0
         return state 
     
@@ -194,51 +336,73 @@ class PipelineWorkflow(StateGraph):
     def compile(self):
         return super().compile(checkpointer=self.checkpointer)
 
-    def call_stage_init(self, state: BaseModel) -> BaseModel:
-        print("========== call stage init ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.INIT].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_download(self, state: BaseModel) -> BaseModel:
-        print("========== call stage download ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.DOWNLOADING].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_md5check(self, state: BaseModel) -> BaseModel:
-        print("========== call stage md5 check ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.MD5CHECKING].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_dataprepare(self, state: BaseModel) -> BaseModel:
-        print("========== call stage data prepare ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.DATAPREPARING].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_analyze(self, state: BaseModel) -> BaseModel:
-        print("========== call stage analyze ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.ANALYZING].invoke(state)
+    def call_stage(self, state: BaseModel, stage: AnalysisWorkflowStages) -> dict:
+        if stage in self.sample_stages and state.samples:
+            return self.summarize_samples(state, stage)
+        print(f"========== call stage {stage.value} ==========")
+        stage_output = self.stage_graph.invoke({"messages": state.messages, "stage": stage.value})
         return {"messages": stage_output['messages']}
-    
-    def call_stage_backup(self, state: BaseModel) -> BaseModel:
-        print("========== call stage backup ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.BACKINGUP].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_cleanup(self, state: BaseModel) -> BaseModel:
-        print("========== call stage cleanup ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.CLEANINGUP].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_notify(self, state: BaseModel) -> BaseModel:
-        print("========== call stage notify ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.NOTIFY].invoke(state)
-        return {"messages": stage_output['messages']}
-    
-    def call_stage_completed(self, state: BaseModel) -> BaseModel:
-        print("========== call stage completed ==========")
-        stage_output = self.stage_dict[AnalysisWorkflowStages.COMPLETED].invoke(state)
+
+    async def acall_stage(self, state: BaseModel, stage: AnalysisWorkflowStages) -> dict:
+        if stage in self.sample_stages and state.samples:
+            return self.summarize_samples(state, stage)
+        print(f"========== call stage {stage.value} ==========")
+        stage_output = await self.stage_graph.ainvoke({"messages": state.messages, "stage": stage.value})
         return {"messages": stage_output['messages']}
 
+    def summarize_samples(self, state: BaseModel, stage: AnalysisWorkflowStages) -> dict:
+        """
+        所有样本结束后汇总阶段的结果，样本的阶段子图消息不合并到主图中，只添加一条汇总消息
+        """
+        results = state.results.get(stage.value, {})
+        failed = sorted(sample for sample, result in results.items() if result["status"] == PipelineStatus.FAILED.value)
+        retried = sum(result["attempts"] - 1 for result in results.values())
+        summary = (f"{stage.value}: {len(results) - len(failed)}/{len(state.samples)} samples completed, "
+                   f"{retried} retries" + (f", failed: {', '.join(failed)}" if failed else ""))
+        print(f"========== {summary} ==========")
+        self.report(stage.value, (PipelineStatus.FAILED if failed else PipelineStatus.COMPLETED).value,
+                    completed = len(results) - len(failed), failed = len(failed))
+        return {"messages": [AIMessage(content = summary)]}
+
+    def sample_result(self, task: SampleTask, attempts: int, output: dict = None, error: Exception = None) -> dict:
+        result = {"status":   PipelineStatus.COMPLETED.value if error is None else PipelineStatus.FAILED.value,
+                  "attempts": attempts,
+                  "resumes":  output["resume_count"] if output is not None else 0}
+        if error is not None:
+            logger.warning(f"{task['stage']}[{task['sample']}] failed after {attempts} attempts: {error!r}")
+            result["error"] = repr(error)
+            # final: 重试次数用完，子图中自动恢复前的 failed 事件不带 final
+            self.report(task["stage"], PipelineStatus.FAILED.value, task["sample"], error = repr(error), final = 1)
+        return {"results": {task["stage"]: {task["sample"]: result}}}
+
+    def call_sample(self, task: SampleTask, stage: AnalysisWorkflowStages) -> dict:
+        with self.sample_slots:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    output = self.stage_graph.invoke({"messages": [], "stage": task["stage"], "sample": task["sample"]})
+                    return self.sample_result(task, attempt, output)
+                except GraphBubbleUp:
+                    raise
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        return self.sample_result(task, attempt, error = e)
+                    time.sleep(self.retry_interval * 2 ** (attempt - 1))
+
+    async def acall_sample(self, task: SampleTask, stage: AnalysisWorkflowStages) -> dict:
+        loop = asyncio.get_running_loop()
+        slots = self.async_sample_slots.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        async with slots:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    output = await self.stage_graph.ainvoke({"messages": [], "stage": task["stage"], "sample": task["sample"]})
+                    return self.sample_result(task, attempt, output)
+                except GraphBubbleUp:
+                    raise
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        return self.sample_result(task, attempt, error = e)
+                    await asyncio.sleep(self.retry_interval * 2 ** (attempt - 1))
+
 
 
 # # https://langchain-ai.github.io/langgraph/concepts/functional_api/
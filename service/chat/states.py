@@ -15,6 +15,7 @@ class ProcessorState(BaseModel):
     action: Optional[str] = Field(None, description = "The action to be taken regarding to the tasks of the pipeline")
     # response: Optional[str] = Field(None, description="The response to the user's input")
     interrupted: Optional[bool] = Field(False, description="Whether the conversation has been interrupted")
+    summary: Optional[str] = Field(None, description="The summary of the messages removed from the history")
 
 class PipelineStateArgsDict(TypedDict):
     DO_KEY: Optional[bool]
@@ -77,6 +78,7 @@ class PipelineState(BaseModel):
 
     username: Optional[str] = Field(None, description="The username of the user who initiated the pipeline task")
     email: Optional[str]    = Field(None, description="The email of the user who initiated the pipeline task")
+    summary: Optional[str]  = Field(None, description="The summary of the messages removed from the history")
     args: Optional[dict]    = Field({
         RQ_JOB_ID_KEY: None,
         PROJECT_NAME_KEY: None,
@@ -0,0 +1,176 @@
+import time
+import asyncio
+from typing import AsyncIterator, Iterable, Optional, Union
+
+import orjson
+from langchain_core.messages import AIMessageChunk
+
+
+class TokenStreamFilter:
+    """
+    过滤 graph.astream(stream_mode="messages") 输出的 LLM token，只把面向用户的内容转发给客户端
+        nodes:  允许输出 token 的图节点，其它节点（例如 pipeline 子图内部的信息抽取）的 token 全部隐藏
+        labels: 意图分类器的内部标签，例如 "pipeline"/"medical"，带有 classifier_tag 的 LLM 调用
+                在输出可能是标签的前缀时先缓存，确认不是标签后再一次性输出
+    每个流式响应使用一个新的实例
+    """
+    def __init__(self, nodes: Iterable[str], labels: Iterable[str] = (), classifier_tag: str = "classifier"):
+        self.nodes = set(nodes)
+        self.labels = [label.lower() for label in labels]
+        self.classifier_tag = classifier_tag
+        self.buffers: dict[str, str] = {}   # message id -> 还未确认的分类器输出
+        self.released: set[str] = set()     # 已确认不是标签的分类器输出
+        self.seen_nodes: set[str] = set()   # 产生过 token 的节点（包括被隐藏的）
+
+    def is_label(self, text: Optional[str]) -> bool:
+        return text is not None and text.strip().strip("'\"").lower() in self.labels
+
+    def maybe_label(self, text: str) -> bool:
+        text = text.strip().strip("'\"").lower()
+        return any(label.startswith(text) for label in self.labels)
+
+    def __call__(self, chunk, metadata: dict) -> Optional[str]:
+        if not isinstance(chunk, AIMessageChunk) or not isinstance(chunk.content, str):
+            return None
+
+        node = metadata.get("langgraph_node")
+        self.seen_nodes.add(node)
+        if node not in self.nodes:
+            return None
+
+        if self.classifier_tag not in metadata.get("tags", []) or chunk.id in self.released:
+            return chunk.content or None
+
+        text = self.buffers.get(chunk.id, "") + chunk.content
+        if self.maybe_label(text):
+            self.buffers[chunk.id] = text
+            return None
+
+        self.buffers.pop(chunk.id, None)
+        self.released.add(chunk.id)
+        return text
+
+    def flush(self) -> Optional[str]:
+        """
+        节点结束时调用，输出缓存中不是完整标签的分类器输出，例如模型只回复了 "pip"
+        """
+        pending = [text for text in self.buffers.values() if not self.is_label(text)]
+        self.buffers.clear()
+        return "".join(pending) or None
+
+
+class SSEEncoder:
+    """
+    OpenAI 兼容的 chat.completion.chunk 数据帧编码器，每个流式响应使用一个新的实例
+    id, created, model 和 thread_id 在创建时编码一次，之后每个帧只编码 delta 和 finish_reason
+    """
+    DONE = b"data: [DONE]\n\n"
+
+    def __init__(self, thread_id: Optional[str], input_text: str, model: str = "pipeline-agent"):
+        envelope = orjson.dumps({
+            "id": f"chatcmpl-{hash(input_text) % 10000}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "thread_id": thread_id,
+        })
+        self.prefix = b"data: " + envelope[:-1] + b',"choices":[{"index":0,"delta":'
+        self.content_prefix = self.prefix + b'{"content":'
+        self.content_suffix = b'},"finish_reason":null}]}\n\n'
+
+    def frame(self, delta: dict, finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> bytes:
+        end = b"}]}\n\n" if usage is None else b'}],"usage":' + orjson.dumps(usage) + b"}\n\n"
+        return self.prefix + orjson.dumps(delta) + b',"finish_reason":' + orjson.dumps(finish_reason) + end
+
+    def usage(self, usage: dict) -> bytes:
+        """
+        stream_options.include_usage 为 true 时 OpenAI 在 [DONE] 之前发送的 choices 为空、只包含 usage 的数据帧
+        """
+        return self.prefix[:-len(b'{"index":0,"delta":')] + b'],"usage":' + orjson.dumps(usage) + b"}\n\n"
+
+    def content(self, text: str) -> bytes:
+        return self.content_prefix + orjson.dumps(text) + self.content_suffix
+
+
+async def coalesce(events: AsyncIterator[Union[str, bytes]],
+                   encoder: SSEEncoder,
+                   flush_interval: float = 0.0,
+                   flush_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    把逐 token 的内容合并成较少的数据帧和写入
+        events:         str 为内容 token，bytes 为已经编码的帧（角色、结束标记、错误等），输出 bytes 之前先输出缓存的内容
+        flush_interval: 第一个 token 之后 flush_interval 秒内到达的 token 合并为一个帧，0 表示每个 token 一个帧
+        flush_size:     缓存的内容达到 flush_size 个字符时立即输出，None 表示不限制
+    响应的第一个内容 token 立即输出，不增加首 token 时间；events 在单独的任务中迭代，LLM 暂停输出时缓存的内容按时输出
+    """
+    if not flush_interval:
+        async for event in events:
+            yield encoder.content(event) if isinstance(event, str) else event
+        return
+
+    loop = asyncio.get_running_loop()
+    out: list[bytes] = []               # 等待写入的数据帧
+    buffer: list[str] = []              # 等待合并的 token
+    size, first, finished, error = 0, True, False, None
+    timer: Optional[asyncio.TimerHandle] = None
+    waiter: Optional[asyncio.Future] = None
+
+    def wake():
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def flush():
+        nonlocal size, timer
+        if buffer:
+            out.append(encoder.content("".join(buffer)))
+            buffer.clear()
+            size = 0
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        wake()
+
+    def on_timer():
+        nonlocal timer
+        timer = None
+        flush()
+
+    async def pump():
+        nonlocal size, first, finished, error, timer
+        try:
+            async for event in events:
+                if isinstance(event, str):
+                    buffer.append(event)
+                    size += len(event)
+                    if first or (flush_size is not None and size >= flush_size):
+                        first = False
+                        flush()
+                    elif timer is None:
+                        timer = loop.call_at(loop.time() + flush_interval, on_timer)
+                else:
+                    flush()
+                    out.append(event)
+        except Exception as e:
+            error = e
+        finished = True
+        flush()
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            if out:
+                # 消费者落后时，多个数据帧在一次写入中输出
+                chunk = b"".join(out)
+                out.clear()
+                yield chunk
+            elif finished:
+                if error is not None:
+                    raise error
+                return
+            else:
+                waiter = loop.create_future()
+                await waiter
+    finally:
+        if timer is not None:
+            timer.cancel()
+        task.cancel()
@@ -3,7 +3,14 @@ from rq import Queue, Worker
 from redis import Redis
 import multiprocessing
 from time import sleep
-from rq.registry import StartedJobRegistry, FinishedJobRegistry
+
+from service.tasks.events import FAILED, FINISHED, tracked_job
+from service.utils.config import load_job_publisher
+
+
+@tracked_job
+def sleep_job(seconds):
+    sleep(seconds)
 
 
 def start_worker(queue_name):
@@ -37,28 +44,24 @@ if __name__ == '__main__':
         processes.append(process)
         process.start() # 启动进程
 
-    # Delay execution of count_words_at_url('http://nvie.com')
-    print("Enqueue jobs")
-    jobs = [ q.enqueue(sleep, 5) for i in range(3) ] 
-
-    for i in range(15):
-        for job in q.get_jobs():
-            print(f"Job {job.id} is in status {job.get_status()}")
+    # 任务的状态通过事件流获取（config/service.yaml 中 jobs.enabled 为 true），不再每 2 秒轮询队列和 registry
+    publisher = load_job_publisher()
+    if publisher is None:
+        raise SystemExit("jobs.enabled is false in config/service.yaml")
 
-        # 查看正在运行中的任务
-        started_registry = StartedJobRegistry(q.name, connection=q.connection)
-        started_job_ids = started_registry.get_job_ids()
-        print("Started jobs:", started_job_ids)
-
-        # 查看已经完成的任务
-        finished_registry = FinishedJobRegistry(q.name, connection=q.connection)
-        finished_job_ids = finished_registry.get_job_ids()
-        print("Finished jobs:", finished_job_ids)
-
-        # for job in jobs:
-        #     print(f"Job {job.id} is in status {job.get_status()}")
+    print("Enqueue jobs")
+    jobs = [ publisher.enqueue(q, sleep_job, 5) for i in range(3) ]
+    job_ids = {job.id for job in jobs}
 
-        sleep(2)
+    done = set()
+    for event in publisher.follow(last_id="0"):
+        if event["job_id"] not in job_ids:
+            continue
+        print(f"Job {event['job_id']} is in status {event['status']}")
+        if event["status"] in (FINISHED, FAILED) and event.get("stage") is None:
+            done.add(event["job_id"])
+        if done == job_ids:
+            break
 
     print("==============================")
-    print(q.get_jobs()) # 打印队列中的任务
\ No newline at end of file
+    print(q.get_jobs()) # 打印队列中的任务
@@ -0,0 +1,536 @@
+"""
+DOWNLOADING 阶段的数据下载：从 iRODS、AWS（S3）、Storage、Scratch 或 HTTP 数据源并行下载文件，支持断点续传
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from uuid import uuid4
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterable, Optional
+
+from loguru import logger
+
+MiB = 1 << 20
+
+
+async def run_in_thread(func, *args):
+    """
+    与 asyncio.to_thread 相同，但被取消时等待线程中的调用结束再抛出 CancelledError，
+    保证调用方关闭文件描述符时没有正在使用它的 pread/pwrite
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+
+def pwrite_all(fd: int, buffer: bytes, offset: int):
+    """
+    os.pwrite 可能只写入一部分（例如 NFS 挂载的 Storage 和 Scratch），循环直到整个 buffer 写入
+    """
+    view = memoryview(buffer)
+    while view:
+        size = os.pwrite(fd, view, offset)
+        if size == 0:
+            raise IOError(f"pwrite wrote 0 bytes at offset {offset}")
+        view = view[size:]
+        offset += size
+
+
+class TransferBudget:
+    """
+    同一进程中所有下载任务共享的并发连接数和带宽上限
+        max_concurrency:    同时传输的分段数（连接数），None 表示不限制
+        max_bytes_per_second: 总带宽（字节/秒），令牌桶，允许 burst 字节的突发，None 表示不限制
+    计数由线程锁保护，多个线程中的事件循环共用同一个预算；RQ worker 为每个任务 fork 一个进程，
+    多个任务和 worker 共享预算时使用 RedisTransferBudget
+        slot = await acquire()；传输中 await consume(字节数, slot)；结束后 await release(slot)
+    """
+    def __init__(self, max_concurrency: Optional[int] = 16, max_bytes_per_second: Optional[float] = None,
+                 burst: Optional[int] = None, poll_interval: float = 0.01):
+        self.max_concurrency = max_concurrency
+        self.max_bytes_per_second = max_bytes_per_second
+        self.burst = burst if burst is not None else int(max_bytes_per_second or 0)
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        # 令牌桶：下一个字节可以发送的时间
+        self.ready_at = time.monotonic()
+        self.transferred = 0
+        self.throttled_seconds = 0.0
+
+    async def acquire(self) -> Optional[str]:
+        while True:
+            with self.lock:
+                if self.max_concurrency is None or self.active < self.max_concurrency:
+                    self.active += 1
+                    self.peak = max(self.peak, self.active)
+                    return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def release(self, slot: Optional[str] = None):
+        with self.lock:
+            self.active -= 1
+
+    async def consume(self, size: int, slot: Optional[str] = None):
+        """
+        传输 size 字节之后调用，超过带宽时等待
+        """
+        with self.lock:
+            self.transferred += size
+            if not self.max_bytes_per_second:
+                return
+            now = time.monotonic()
+            # 空闲时最多积累 burst 字节的令牌
+            self.ready_at = max(self.ready_at, now - self.burst / self.max_bytes_per_second) + size / self.max_bytes_per_second
+            wait = self.ready_at - now
+            self.throttled_seconds += max(0.0, wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "peak": self.peak,
+            "transferred": self.transferred,
+            "throttled_seconds": self.throttled_seconds,
+            "max_concurrency": self.max_concurrency,
+            "max_bytes_per_second": self.max_bytes_per_second,
+        }
+
+
+class RedisTransferBudget(TransferBudget):
+    """
+    保存在 Redis 中的预算，所有 RQ worker（每个任务一个 work-horse 进程）和节点上的下载任务共享
+        {prefix}:download:slots     ZSET，正在传输的分段，score 为过期时间，传输期间每 ttl / 3 秒刷新，
+                                    进程异常退出后 ttl 秒自动释放
+        {prefix}:download:ready_at  令牌桶：下一个字节可以发送的时间，WATCH/MULTI 更新
+    client 为同步的 redis.Redis，调用在线程池中执行；时间使用各节点的本地时钟，节点之间应同步时钟（NTP）
+    active, peak, transferred 和 throttled_seconds 只统计当前进程
+    """
+    def __init__(self, client, prefix: str = "pipeline-agent", ttl: float = 60, poll_interval: float = 0.1,
+                 **kwargs):
+        super().__init__(poll_interval = poll_interval, **kwargs)
+        self.client = client
+        self.slots_key = f"{prefix}:download:slots"
+        self.rate_key = f"{prefix}:download:ready_at"
+        self.ttl = ttl
+        # slot -> 上次刷新过期时间的时间
+        self.refreshed: dict[str, float] = {}
+
+    def try_acquire(self, slot: str) -> bool:
+        now = time.time()
+        with self.client.pipeline(transaction = True) as pipe:
+            pipe.zremrangebyscore(self.slots_key, "-inf", now)
+            pipe.zadd(self.slots_key, {slot: now + self.ttl})
+            pipe.zcard(self.slots_key)
+            pipe.expire(self.slots_key, int(self.ttl) + 1)
+            _, _, count, _ = pipe.execute()
+        if count <= self.max_concurrency:
+            return True
+        # 同时加入的请求可能都超过上限并退出，在下一次轮询时重试，不会超过上限
+        self.client.zrem(self.slots_key, slot)
+        return False
+
+    async def acquire(self) -> Optional[str]:
+        slot = uuid4().hex
+        if self.max_concurrency is not None:
+            while not await asyncio.to_thread(self.try_acquire, slot):
+                await asyncio.sleep(self.poll_interval)
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.refreshed[slot] = time.monotonic()
+        return slot
+
+    async def release(self, slot: Optional[str] = None):
+        with self.lock:
+            self.active -= 1
+            self.refreshed.pop(slot, None)
+        if self.max_concurrency is not None and slot is not None:
+            await asyncio.to_thread(self.client.zrem, self.slots_key, slot)
+
+    def reserve(self, size: int) -> float:
+        """
+        在共享的令牌桶中预留 size 字节，返回需要等待的秒数
+        """
+        from redis.exceptions import WatchError
+        with self.client.pipeline(transaction = True) as pipe:
+            while True:
+                try:
+                    pipe.watch(self.rate_key)
+                    now = time.time()
+                    ready_at = float(pipe.get(self.rate_key) or now)
+                    ready_at = max(ready_at, now - self.burst / self.max_bytes_per_second) + size / self.max_bytes_per_second
+                    pipe.multi()
+                    pipe.set(self.rate_key, repr(ready_at), px = int(max(ready_at - now, 0) * 1000) + 60000)
+                    pipe.execute()
+                    return ready_at - now
+                except WatchError:
+                    continue
+
+    async def consume(self, size: int, slot: Optional[str] = None):
+        with self.lock:
+            self.transferred += size
+            refresh = slot in self.refreshed and time.monotonic() - self.refreshed[slot] > self.ttl / 3
+            if refresh:
+                self.refreshed[slot] = time.monotonic()
+        if refresh and self.max_concurrency is not None:
+            await asyncio.to_thread(self.client.zadd, self.slots_key, {slot: time.time() + self.ttl}, xx = True)
+        if not self.max_bytes_per_second:
+            return
+        wait = await asyncio.to_thread(self.reserve, size)
+        if wait > 0:
+            with self.lock:
+                self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        # 所有进程正在传输的分段数
+        stats["active_total"] = self.client.zcount(self.slots_key, time.time(), "+inf")
+        return stats
+
+
+class DownloadSource(ABC):
+    """
+    数据源适配器
+        stat(remote):                    返回 {"size": 字节数, "ranges": 是否支持按字节范围读取}
+        read(remote, start, end):        异步迭代 [start, end) 范围内的数据，不支持范围读取时 start 为 0、end 为 None
+    """
+    @abstractmethod
+    async def stat(self, remote: str) -> dict:
+        pass
+
+    @abstractmethod
+    def read(self, remote: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class HttpSource(DownloadSource):
+    """
+    HTTP(S) 数据源，同一个数据源的所有请求共用一个 httpx 连接池，使用 Range 请求读取文件的一部分；
+    也用于预签名的 S3 URL 和测试用的本地文件服务
+    """
+    def __init__(self, base_url: str = "", client=None, max_connections: int = 16, timeout: float = 60,
+                 headers: Optional[dict] = None):
+        import httpx
+        self.client = client or httpx.AsyncClient(
+            base_url = base_url,
+            headers  = headers,
+            timeout  = httpx.Timeout(timeout, connect = 10),
+            limits   = httpx.Limits(max_connections = max_connections, max_keepalive_connections = max_connections),
+            follow_redirects = True,
+        )
+
+    async def stat(self, remote: str) -> dict:
+        response = await self.client.head(remote)
+        response.raise_for_status()
+        return {"size": int(response.headers["content-length"]),
+                "ranges": response.headers.get("accept-ranges", "").lower() == "bytes"}
+
+    async def read(self, remote: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        headers = {"Range": f"bytes={start}-{end - 1}"} if end is not None else {}
+        async with self.client.stream("GET", remote, headers = headers) as response:
+            response.raise_for_status()
+            if end is not None and response.status_code != 206:
+                raise IOError(f"{remote}: server ignored the range request ({response.status_code})")
+            async for chunk in response.aiter_bytes():
+                yield chunk
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class FileSource(DownloadSource):
+    """
+    挂载在本地的文件系统（集群的 Storage 冷存储和 Scratch 工作目录），remote 为相对于 root 的路径，
+    在线程池中用 pread 读取
+    """
+    def __init__(self, root: str = "/", block_size: int = 4 * MiB):
+        self.root = root
+        self.block_size = block_size
+
+    def path(self, remote: str) -> str:
+        """
+        remote 来自对话中提取的任务参数，不允许通过 ../ 或符号链接读取 root 以外的文件
+        """
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, remote.lstrip("/")))
+        if os.path.commonpath([root, path]) != root:
+            raise PermissionError(f"{remote}: outside of {self.root}")
+        return path
+
+    async def stat(self, remote: str) -> dict:
+        return {"size": (await asyncio.to_thread(os.stat, self.path(remote))).st_size, "ranges": True}
+
+    async def read(self, remote: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        fd = await asyncio.to_thread(os.open, self.path(remote), os.O_RDONLY)
+        try:
+            offset = start
+            while end is None or offset < end:
+                size = self.block_size if end is None else min(self.block_size, end - offset)
+                chunk = await run_in_thread(os.pread, fd, size, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+
+class S3Source(DownloadSource):
+    """
+    AWS S3（或兼容 S3 的对象存储，endpoint_url），remote 为对象的 key，按字节范围调用 get_object；
+    boto3 的客户端是同步的，在线程池中调用，max_connections 为客户端的连接池大小
+    """
+    def __init__(self, bucket: str, region: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 max_connections: int = 16, block_size: int = MiB):
+        import boto3
+        from botocore.config import Config
+        self.bucket = bucket
+        self.block_size = block_size
+        self.client = boto3.client("s3", region_name = region, endpoint_url = endpoint_url,
+                                   config = Config(max_pool_connections = max_connections))
+
+    async def stat(self, remote: str) -> dict:
+        head = await asyncio.to_thread(self.client.head_object, Bucket = self.bucket, Key = remote)
+        return {"size": head["ContentLength"], "ranges": True}
+
+    async def read(self, remote: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        kwargs = {"Range": f"bytes={start}-{end - 1}"} if end is not None else {}
+        response = await asyncio.to_thread(self.client.get_object, Bucket = self.bucket, Key = remote, **kwargs)
+        body = response["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, self.block_size):
+                yield chunk
+        finally:
+            body.close()
+
+
+class IRODSSource(DownloadSource):
+    """
+    iRODS，remote 为数据对象的逻辑路径（/zone/home/...），使用 python-irodsclient，每次读取在线程池中打开数据对象
+    """
+    def __init__(self, host: str, port: int = 1247, user: Optional[str] = None, password: Optional[str] = None,
+                 zone: Optional[str] = None, block_size: int = 4 * MiB):
+        from irods.session import iRODSSession
+        self.session = iRODSSession(host = host, port = port, user = user, password = password, zone = zone)
+        self.block_size = block_size
+
+    async def stat(self, remote: str) -> dict:
+        obj = await asyncio.to_thread(self.session.data_objects.get, remote)
+        return {"size": obj.size, "ranges": True}
+
+    async def read(self, remote: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(self.session.data_objects.open, remote, "r")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            offset = start
+            while end is None or offset < end:
+                size = self.block_size if end is None else min(self.block_size, end - offset)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def aclose(self):
+        await asyncio.to_thread(self.session.cleanup)
+
+
+# DataSource_Type_KEY 的取值对应的数据源
+SOURCES = {
+    "iRODS":   IRODSSource,
+    "AWS":     S3Source,
+    "Storage": FileSource,
+    "Scratch": FileSource,
+    "HTTP":    HttpSource,
+}
+
+
+class Downloader:
+    """
+    并行下载一批文件
+        1. 每个文件按 part_size 分段，所有文件的分段一起调度，同时传输的分段数和总带宽由共享的 TransferBudget 限制；
+           数据源不支持范围读取时整个文件为一段
+        2. 数据写入 <目标文件>.part，进度（每个分段已经写入的字节数）保存在 <目标文件>.part.json，
+           每个分段写入 checkpoint_interval 字节保存一次；中断后再次下载从保存的位置继续，全部完成后重命名为目标文件
+        3. 分段出错时从已经写入的位置重试，最多 max_attempts 次，每次等待 retry_interval * 2^n 秒
+        4. 目标文件已经存在并且大小相同时跳过
+    """
+    def __init__(self,
+                 budget: Optional[TransferBudget] = None,
+                 part_size: int = 64 * MiB,
+                 max_attempts: int = 5,
+                 retry_interval: float = 1.0,
+                 write_size: int = 4 * MiB,
+                 checkpoint_interval: int = 32 * MiB):
+        self.budget = budget or TransferBudget()
+        self.part_size = part_size
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.write_size = write_size
+        self.checkpoint_interval = checkpoint_interval
+
+    def parts(self, size: int, ranges: bool) -> list[list[int]]:
+        """
+        [起始位置, 结束位置]，不支持范围读取时只有一段
+        """
+        if not ranges or size == 0:
+            return [[0, size]]
+        return [[start, min(start + self.part_size, size)] for start in range(0, size, self.part_size)]
+
+    @staticmethod
+    def load_progress(local: str, size: int, parts: list) -> list[int]:
+        """
+        每个分段已经写入的字节数，远程文件的大小或分段方式变化后重新下载
+        """
+        try:
+            with open(local + ".part.json") as f:
+                progress = json.load(f)
+            if progress["size"] == size and progress["parts"] == parts and os.path.getsize(local + ".part") == size:
+                return progress["written"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return [0] * len(parts)
+
+    @staticmethod
+    def save_progress(local: str, size: int, parts: list, written: list[int]):
+        with open(local + ".part.json.tmp", "w") as f:
+            json.dump({"size": size, "parts": parts, "written": written}, f)
+        os.replace(local + ".part.json.tmp", local + ".part.json")
+
+    async def download(self, source: DownloadSource, files: Iterable[tuple[str, str]]) -> dict:
+        """
+        files 为 [(远程路径, 本地路径)]，返回 {"files": [每个文件的结果], "ok": 是否全部成功,
+        "bytes": 本次传输的字节数, "seconds": 耗时, "mb_per_s": 总吞吐量}
+        """
+        start = time.perf_counter()
+        results = await asyncio.gather(*[self.download_file(source, remote, local) for remote, local in files])
+        seconds = time.perf_counter() - start
+        total = sum(result["bytes"] for result in results)
+        return {"files": list(results),
+                "ok": all(result["status"] in ("ok", "exists") for result in results),
+                "bytes": total,
+                "seconds": seconds,
+                "mb_per_s": total / MiB / seconds if seconds > 0 else None}
+
+    async def download_file(self, source: DownloadSource, remote: str, local: str) -> dict:
+        result = {"remote": remote, "path": local, "status": None, "size": None, "resumed_from": 0,
+                  "bytes": 0, "seconds": 0.0, "mb_per_s": None}
+        start = time.perf_counter()
+        state = None
+        try:
+            info = await source.stat(remote)
+            size = result["size"] = info["size"]
+            if os.path.exists(local) and os.path.getsize(local) == size:
+                result["status"] = "exists"
+                return result
+
+            parts = self.parts(size, info["ranges"])
+            # 不支持范围读取的数据源只能从头开始
+            written = self.load_progress(local, size, parts) if info["ranges"] else [0]
+            result["resumed_from"] = sum(written)
+            os.makedirs(os.path.dirname(os.path.abspath(local)), exist_ok = True)
+            fd = os.open(local + ".part", os.O_RDWR | os.O_CREAT)
+            state = {"local": local, "fd": fd, "size": size, "parts": parts, "ranges": info["ranges"],
+                     "written": written, "saved": sum(written), "bytes": 0}
+            try:
+                os.ftruncate(fd, size)
+                tasks = [asyncio.create_task(self.download_part(source, remote, i, state))
+                         for i in range(len(parts)) if written[i] < parts[i][1] - parts[i][0]]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    # 一个分段失败时取消其他分段，所有分段结束后才能关闭文件和保存进度
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions = True)
+                await asyncio.to_thread(os.fsync, fd)
+            except Exception:
+                if state["ranges"]:
+                    await self.checkpoint(state)
+                raise
+            finally:
+                os.close(fd)
+            os.replace(local + ".part", local)
+            if os.path.exists(local + ".part.json"):
+                os.remove(local + ".part.json")
+            result["status"] = "ok"
+        except Exception as e:
+            result.update(status = "error", error = repr(e))
+            logger.warning(f"download failed: {remote} -> {local}: {e!r}")
+        finally:
+            result["bytes"] = state["bytes"] if state is not None else 0
+            result["seconds"] = time.perf_counter() - start
+            if result["bytes"] and result["seconds"] > 0:
+                result["mb_per_s"] = result["bytes"] / MiB / result["seconds"]
+        if result["status"] == "ok":
+            logger.info(f"downloaded {remote} -> {local}: {result['bytes'] / MiB:.0f} MiB in {result['seconds']:.1f}s"
+                        + (f", {result['mb_per_s']:.0f} MB/s" if result["mb_per_s"] else "")
+                        + (f", resumed from {result['resumed_from'] / MiB:.0f} MiB" if result["resumed_from"] else ""))
+        return result
+
+    async def download_part(self, source: DownloadSource, remote: str, index: int, state: dict):
+        """
+        下载一个分段，出错时从已经写入的位置重试；传输期间占用预算中的一个连接，等待重试时释放
+        """
+        begin, end = state["parts"][index]
+        for attempt in range(1, self.max_attempts + 1):
+            if not state["ranges"]:
+                state["written"][index] = 0
+            offset = begin + state["written"][index]
+            slot = await self.budget.acquire()
+            try:
+                buffer = bytearray()
+                async for chunk in source.read(remote, offset, end if state["ranges"] else None):
+                    buffer += chunk
+                    state["bytes"] += len(chunk)
+                    await self.budget.consume(len(chunk), slot)
+                    if len(buffer) >= self.write_size:
+                        offset = await self.write(buffer, offset, index, state)
+                        buffer = bytearray()
+                if buffer:
+                    offset = await self.write(buffer, offset, index, state)
+                if offset < end:
+                    raise IOError(f"{remote}: part {begin}-{end} ended at {offset}")
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                error = e
+            finally:
+                await self.budget.release(slot)
+            delay = self.retry_interval * 2 ** (attempt - 1) * (0.5 + random.random())
+            logger.info(f"retry {remote} part {begin}-{end} from {begin + state['written'][index]} "
+                        f"in {delay:.1f}s (attempt {attempt}): {error!r}")
+            await asyncio.sleep(delay)
+
+    async def write(self, buffer: bytearray, offset: int, index: int, state: dict) -> int:
+        await run_in_thread(pwrite_all, state["fd"], buffer, offset)
+        state["written"][index] += len(buffer)
+        if state["ranges"] and sum(state["written"]) - state["saved"] >= self.checkpoint_interval:
+            await self.checkpoint(state)
+        return offset + len(buffer)
+
+    async def checkpoint(self, state: dict):
+        """
+        先 fsync 再保存进度，.part.json 中只记录已经写入磁盘的字节；
+        fsync 期间其他分段写入的数据不计入这一次的进度
+        """
+        written = list(state["written"])
+        state["saved"] = sum(written)
+        await run_in_thread(os.fsync, state["fd"])
+        self.save_progress(state["local"], state["size"], state["parts"], written)
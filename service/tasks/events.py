@@ -0,0 +1,236 @@
+"""
+任务和阶段状态的事件流：RQ worker 和 PipelineWorkflow 在状态变化时向 Redis Stream 写入事件，
+服务进程中的 JobStatusView 读取事件，在内存中维护所有任务的状态，并推送给 /v1/jobs/events 的 SSE 订阅者
+    {prefix}:jobs:events  Redis Stream，每个事件包括 job_id, status, time，阶段的事件另外包括 stage 和 sample，
+                          最多保留约 maxlen 个事件
+与轮询 RQ 的队列和 registry 相比，Redis 的负载只与状态变化的次数有关：每次变化一个 XADD，
+每个服务进程一个阻塞的 XREAD，与任务数量和订阅者数量无关
+"""
+import json
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from loguru import logger
+
+# 任务（RQ job）的状态
+QUEUED, STARTED, FINISHED, FAILED = "queued", "started", "finished", "failed"
+COMPLETED = "completed"
+# 任务状态的先后顺序：queued 可能在 worker 的 started/finished 之后才写入，较早的状态不覆盖较晚的状态
+JOB_STATUS_ORDER = {QUEUED: 0, STARTED: 1, FINISHED: 2, FAILED: 2}
+
+
+def events_key(prefix: str) -> str:
+    return f"{prefix}:jobs:events"
+
+
+def decode(fields: dict) -> dict:
+    event = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+             for k, v in fields.items()}
+    if "time" in event:
+        event["time"] = float(event["time"])
+    return event
+
+
+class JobEventPublisher:
+    """
+    向事件流写入状态变化，client 为同步的 redis.Redis，在 RQ worker 和入队的进程中使用
+    """
+    def __init__(self, client, prefix: str = "pipeline-agent", maxlen: int = 100000):
+        self.client = client
+        self.key = events_key(prefix)
+        self.maxlen = maxlen
+
+    def publish(self, job_id: str, status: str, stage: Optional[str] = None, sample: Optional[str] = None,
+                **fields) -> Optional[str]:
+        event = {"job_id": job_id, "status": status, "stage": stage, "sample": sample, "time": time.time(), **fields}
+        try:
+            event_id = self.client.xadd(self.key, {k: str(v) for k, v in event.items() if v is not None},
+                                        maxlen = self.maxlen, approximate = True)
+        except Exception as e:
+            # 事件只用于展示状态，Redis 不可用时不影响任务的执行
+            logger.warning(f"failed to publish job event {event}: {e!r}")
+            return None
+        return event_id.decode() if isinstance(event_id, bytes) else event_id
+
+    def enqueue(self, queue, func, *args, **kwargs):
+        """
+        与 queue.enqueue 相同，入队后写入 queued 事件
+        """
+        job = queue.enqueue(func, *args, **kwargs)
+        self.publish(job.id, QUEUED, func = getattr(func, "__name__", str(func)))
+        return job
+
+    def follow(self, last_id: str = "$", block_ms: int = 5000) -> Iterator[dict]:
+        """
+        阻塞地读取 last_id 之后的事件，"$" 表示只读取新的事件，"0" 表示从最早保留的事件开始
+        """
+        while True:
+            for _, entries in self.client.xread({self.key: last_id}, count = 500, block = block_ms) or []:
+                for event_id, fields in entries:
+                    last_id = event_id
+                    yield decode(fields)
+
+
+def tracked_job(func):
+    """
+    RQ 任务函数的装饰器：开始执行、完成和出错时写入事件，job_id 为当前 RQ 任务的 id，
+    不在 RQ worker 中调用时不写入事件
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from rq import get_current_job
+        from service.utils.config import load_job_publisher
+        job = get_current_job()
+        publisher = load_job_publisher() if job is not None else None
+        if publisher is not None:
+            publisher.publish(job.id, STARTED)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if publisher is not None:
+                publisher.publish(job.id, FAILED, error = repr(e))
+            raise
+        if publisher is not None:
+            publisher.publish(job.id, FINISHED)
+        return result
+    return wrapper
+
+
+class JobStatusView:
+    """
+    读取事件流，在内存中维护每个任务的最新状态：
+        {"job_id", "status", "stage", "stages": {阶段: 状态}, "failed_samples": [...], "updated", "events"}
+    样本的 failed 事件只有带 final（重试次数用完）时才计入 failed_samples，同一样本之后 completed 时移出
+    状态变化推送给所有订阅者（asyncio.Queue），订阅者处理不过来时丢弃最旧的事件
+        client:   redis.asyncio.Redis
+        max_jobs: 内存中保留的任务数量，超过后淘汰最久没有更新的任务
+        replay:   启动时是否读取流中保留的历史事件，恢复服务重启前的任务状态
+    """
+    def __init__(self, client, prefix: str = "pipeline-agent", max_jobs: int = 10000, block_ms: int = 5000,
+                 replay: bool = True, retry_interval: float = 1.0, queue_size: int = 1000):
+        self.client = client
+        self.key = events_key(prefix)
+        self.max_jobs = max_jobs
+        self.block_ms = block_ms
+        self.last_id = "0" if replay else "$"
+        self.retry_interval = retry_interval
+        self.queue_size = queue_size
+
+        self.jobs: OrderedDict[str, dict] = OrderedDict()
+        self.subscribers: dict[asyncio.Queue, Optional[set]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.events = 0
+        self.reads = 0
+        self.dropped = 0
+
+    def apply(self, event: dict) -> dict:
+        job_id = event["job_id"]
+        job = self.jobs.pop(job_id, None) or {"job_id": job_id, "status": None, "stage": None, "stages": {},
+                                               "failed_samples": [], "events": 0}
+        stage, sample, status = event.get("stage"), event.get("sample"), event["status"]
+        if stage is None:
+            if JOB_STATUS_ORDER.get(status, 0) >= JOB_STATUS_ORDER.get(job["status"], -1):
+                job["status"] = status
+                if "error" in event:
+                    job["error"] = event["error"]
+        elif sample is None:
+            job["stage"] = stage
+            job["stages"][stage] = status
+        elif status == FAILED and event.get("final") and sample not in job["failed_samples"]:
+            job["failed_samples"].append(sample)
+        elif status == COMPLETED and sample in job["failed_samples"]:
+            job["failed_samples"].remove(sample)
+        job["updated"] = event.get("time")
+        job["events"] += 1
+        self.jobs[job_id] = job
+        if self.max_jobs is not None and len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last = False)
+
+        self.events += 1
+        # 订阅者在之后才序列化事件，放入当时状态的副本，处理较慢的订阅者不会把后来的状态附加到较早的事件上
+        snapshot = {**job, "stages": dict(job["stages"]), "failed_samples": list(job["failed_samples"])}
+        for queue, job_ids in self.subscribers.items():
+            if job_ids is not None and job_id not in job_ids:
+                continue
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait({**event, "job": snapshot})
+        return job
+
+    async def read(self):
+        """
+        读取一批事件，没有新事件时最多阻塞 block_ms 毫秒
+        """
+        response = await self.client.xread({self.key: self.last_id}, count = 500, block = self.block_ms)
+        self.reads += 1
+        for _, entries in response or []:
+            for event_id, fields in entries:
+                self.last_id = event_id
+                self.apply(decode(fields))
+
+    async def run(self):
+        while True:
+            try:
+                await self.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"failed to read job events: {e!r}")
+                await asyncio.sleep(self.retry_interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def subscribe(self, job_ids: Optional[list[str]] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize = self.queue_size)
+        self.subscribers[queue] = set(job_ids) if job_ids else None
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.pop(queue, None)
+
+    def snapshot(self, job_ids: Optional[list[str]] = None) -> list[dict]:
+        if job_ids:
+            return [self.jobs[job_id] for job_id in job_ids if job_id in self.jobs]
+        return list(self.jobs.values())
+
+    async def stream(self, job_ids: Optional[list[str]] = None, heartbeat: float = 15):
+        """
+        SSE：先发送当前状态（snapshot），之后每次状态变化发送一个 status 事件，空闲 heartbeat 秒发送一个注释保持连接
+        """
+        queue = self.subscribe(job_ids)
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(self.snapshot(job_ids))}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self.jobs),
+            "subscribers": len(self.subscribers),
+            "events": self.events,
+            "reads": self.reads,
+            "dropped": self.dropped,
+            "running": self.task is not None and not self.task.done(),
+        }
@@ -0,0 +1,292 @@
+"""
+MD5CHECKING 阶段的 MD5 校验：按 md5sum 格式的清单校验下载的 FASTQ/BAM 文件
+
+    python -m service.tasks.md5 /data/batch/md5sum.txt --workers 8
+"""
+import os
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import hashlib
+import argparse
+import functools
+from typing import Callable, Iterable, Optional, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loguru import logger
+
+MiB = 1 << 20
+
+
+@functools.lru_cache(maxsize = None)
+def libcrypto():
+    """
+    OpenSSL 的 MD5_Init / MD5_Update / MD5_Final，找不到 libcrypto 时返回 None
+    """
+    path = ctypes.util.find_library("crypto")
+    if path is None:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+        lib.MD5_Init.argtypes = [ctypes.c_void_p]
+        lib.MD5_Update.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+        lib.MD5_Final.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        return lib
+    except (OSError, AttributeError):
+        return None
+
+
+class ResumableMd5:
+    """
+    状态可以保存和恢复的 MD5，TB 级文件的校验中断后从上次保存的位置继续，而不是从头开始
+    hashlib 的 md5 对象不能序列化，这里直接使用 OpenSSL 的 MD5_CTX（A, B, C, D, Nl, Nh, data[16], num，共 92 字节），
+    state() 返回 MD5_CTX 的内容；没有 libcrypto 时使用 hashlib，resumable 为 False，只能按文件恢复
+    """
+    CTX_SIZE = 92
+
+    def __init__(self, state: Optional[bytes] = None):
+        self.lib = libcrypto()
+        self.resumable = self.lib is not None
+        if not self.resumable:
+            if state is not None:
+                raise ValueError("MD5 state cannot be restored without libcrypto")
+            self.md5 = hashlib.md5()
+            return
+        self.ctx = ctypes.create_string_buffer(self.CTX_SIZE)
+        if state is None:
+            self.lib.MD5_Init(self.ctx)
+        elif len(state) != self.CTX_SIZE:
+            raise ValueError(f"Invalid MD5 state of {len(state)} bytes")
+        else:
+            ctypes.memmove(self.ctx, state, self.CTX_SIZE)
+
+    def update(self, buffer: bytearray, size: int):
+        if not self.resumable:
+            self.md5.update(memoryview(buffer)[:size])
+            return
+        self.lib.MD5_Update(self.ctx, (ctypes.c_char * len(buffer)).from_buffer(buffer), size)
+
+    def state(self) -> Optional[bytes]:
+        return self.ctx.raw if self.resumable else None
+
+    def hexdigest(self) -> str:
+        if not self.resumable:
+            return self.md5.hexdigest()
+        digest = ctypes.create_string_buffer(16)
+        ctx = ctypes.create_string_buffer(self.ctx.raw, self.CTX_SIZE)
+        self.lib.MD5_Final(digest, ctx)
+        return digest.raw.hex()
+
+
+def parse_manifest(manifest: str) -> list[tuple[str, str]]:
+    """
+    md5sum 格式的清单（每行 "<md5>  <文件名>"，二进制模式的文件名前有 "*"），相对路径相对于清单所在的目录
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    entries = []
+    with open(manifest) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            if len(parts) != 2 or len(parts[0]) != 32:
+                raise ValueError(f"{manifest}:{number}: invalid md5 line: {line!r}")
+            name = parts[1].lstrip("*")
+            entries.append((os.path.join(root, name), parts[0].lower()))
+    return entries
+
+
+def checkpoint_file(checkpoint_dir: str, path: str) -> str:
+    return os.path.join(checkpoint_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + ".json")
+
+
+def load_checkpoint(checkpoint_dir: Optional[str], path: str, stat: os.stat_result) -> Optional[dict]:
+    """
+    文件的大小或修改时间变化后之前的进度无效
+    """
+    if checkpoint_dir is None:
+        return None
+    try:
+        with open(checkpoint_file(checkpoint_dir, path)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("size") != stat.st_size or checkpoint.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_dir: Optional[str], path: str, checkpoint: dict):
+    if checkpoint_dir is None:
+        return
+    target = checkpoint_file(checkpoint_dir, path)
+    with open(target + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(target + ".tmp", target)
+
+
+def hash_file(path: str,
+              expected: Optional[str] = None,
+              chunk_size: int = 8 * MiB,
+              checkpoint_dir: Optional[str] = None,
+              checkpoint_interval: int = 256 * MiB,
+              max_bytes: Optional[int] = None) -> dict:
+    """
+    计算一个文件的 MD5，在进程池的 worker 中执行
+        chunk_size:          每次读取的字节数，读入同一个缓冲区（readinto），不为每块数据分配内存
+        checkpoint_dir:      每读取 checkpoint_interval 字节保存一次进度（偏移量和 MD5_CTX），None 表示不保存
+        max_bytes:           本次最多读取的字节数，达到后保存进度并返回 status 为 partial 的结果，None 表示读完整个文件
+    返回文件的校验结果，status 为 ok / mismatch / partial / missing / error，包括本次读取的字节数和吞吐量（MB/s）
+    """
+    result = {"path": path, "expected": expected, "md5": None, "status": None, "size": None,
+              "resumed_from": 0, "bytes": 0, "seconds": 0.0, "mb_per_s": None}
+    start = time.perf_counter()
+    try:
+        stat = os.stat(path)
+        result["size"] = stat.st_size
+        checkpoint = load_checkpoint(checkpoint_dir, path, stat)
+        if checkpoint is not None and checkpoint.get("md5"):
+            # 上一次已经完成
+            result.update(md5 = checkpoint["md5"], resumed_from = stat.st_size)
+        else:
+            resumable = checkpoint is not None and checkpoint.get("state") is not None and libcrypto() is not None
+            md5 = ResumableMd5(bytes.fromhex(checkpoint["state"]) if resumable else None)
+            offset = checkpoint["offset"] if resumable else 0
+            result["resumed_from"] = offset
+            progress = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+            buffer = bytearray(chunk_size)
+            saved = offset
+            with open(path, "rb", buffering = 0) as f:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                f.seek(offset)
+                while max_bytes is None or result["bytes"] < max_bytes:
+                    size = f.readinto(buffer)
+                    if not size:
+                        break
+                    md5.update(buffer, size)
+                    offset += size
+                    result["bytes"] += size
+                    if md5.resumable and offset - saved >= checkpoint_interval:
+                        save_checkpoint(checkpoint_dir, path, {**progress, "offset": offset, "state": md5.state().hex()})
+                        saved = offset
+
+            if offset < stat.st_size:
+                save_checkpoint(checkpoint_dir, path, {**progress, "offset": offset,
+                                                       "state": md5.state().hex() if md5.resumable else None})
+                result["status"] = "partial"
+            else:
+                result["md5"] = md5.hexdigest()
+                save_checkpoint(checkpoint_dir, path, {**progress, "offset": offset, "md5": result["md5"]})
+        if result["status"] is None:
+            result["status"] = "ok" if expected is None or result["md5"] == expected.lower() else "mismatch"
+    except FileNotFoundError as e:
+        result.update(status = "missing", error = str(e))
+    except OSError as e:
+        result.update(status = "error", error = str(e))
+
+    result["seconds"] = time.perf_counter() - start
+    if result["bytes"] and result["seconds"] > 0:
+        result["mb_per_s"] = result["bytes"] / MiB / result["seconds"]
+    return result
+
+
+class Md5Verifier:
+    """
+    并行校验一批文件的 MD5
+        workers:             进程池的进程数，默认为 CPU 数，不超过文件数；每个进程一次校验一个文件，大文件先开始
+        chunk_size:          每次读取的字节数，大块的顺序读取可以充分利用磁盘带宽
+        checkpoint_dir:      保存每个文件的进度，中断后再次校验时已完成的文件直接使用之前的结果，
+                             未完成的文件从上次保存的位置继续；校验清单时默认为清单所在目录下的 .md5-progress
+        checkpoint_interval: 保存进度的间隔（字节），中断后最多重新读取这么多数据
+    """
+    def __init__(self,
+                 workers: Optional[int] = None,
+                 chunk_size: int = 8 * MiB,
+                 checkpoint_dir: Optional[str] = None,
+                 checkpoint_interval: int = 256 * MiB):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+
+    def verify(self,
+               entries: Union[str, Iterable[tuple[str, Optional[str]]]],
+               on_result: Optional[Callable[[dict], None]] = None,
+               max_bytes: Optional[int] = None) -> dict:
+        """
+        entries 为清单文件的路径或 [(文件路径, 期望的 md5)]，每个文件校验完成后调用 on_result(结果)
+        返回 {"files": [每个文件的结果], "ok": 是否全部通过, "bytes": 本次读取的字节数, "seconds": 耗时, "mb_per_s": 总吞吐量}
+        """
+        checkpoint_dir = self.checkpoint_dir
+        if isinstance(entries, str):
+            if checkpoint_dir is None:
+                checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(entries)), ".md5-progress")
+            entries = parse_manifest(entries)
+        entries = list(entries)
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok = True)
+
+        def size_of(entry):
+            try:
+                return os.path.getsize(entry[0])
+            except OSError:
+                return 0
+
+        start = time.perf_counter()
+        results = []
+        kwargs = dict(chunk_size = self.chunk_size, checkpoint_dir = checkpoint_dir,
+                      checkpoint_interval = self.checkpoint_interval, max_bytes = max_bytes)
+        with ProcessPoolExecutor(max_workers = max(1, min(self.workers, len(entries)))) as pool:
+            futures = [pool.submit(hash_file, path, expected, **kwargs)
+                       for path, expected in sorted(entries, key = size_of, reverse = True)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                self.log(result)
+                if on_result is not None:
+                    on_result(result)
+
+        seconds = time.perf_counter() - start
+        total = sum(result["bytes"] for result in results)
+        order = {path: i for i, (path, _) in enumerate(entries)}
+        results.sort(key = lambda result: order[result["path"]])
+        return {"files": results,
+                "ok": all(result["status"] == "ok" for result in results),
+                "bytes": total,
+                "seconds": seconds,
+                "mb_per_s": total / MiB / seconds if seconds > 0 else None}
+
+    @staticmethod
+    def log(result: dict):
+        rate = f"{result['mb_per_s']:.0f} MB/s" if result["mb_per_s"] else "-"
+        resumed = f", resumed from {result['resumed_from'] / MiB:.0f} MiB" if result["resumed_from"] else ""
+        message = f"md5 {result['status']}: {result['path']} ({result['bytes'] / MiB:.0f} MiB in {result['seconds']:.1f}s, {rate}{resumed})"
+        if result["status"] in ("ok", "partial"):
+            logger.info(message)
+        else:
+            logger.warning(message + (f": {result['error']}" if result.get("error") else f", expected {result['expected']}, got {result['md5']}"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="md5sum 格式的清单")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--chunk-size", type = int, default = 8, help = "每次读取的大小（MiB）")
+    parser.add_argument("--checkpoint-dir", default = None, help = "保存进度的目录，默认为清单所在目录下的 .md5-progress")
+    args = parser.parse_args()
+
+    verifier = Md5Verifier(workers = args.workers, chunk_size = args.chunk_size * MiB, checkpoint_dir = args.checkpoint_dir)
+    summary = verifier.verify(args.manifest)
+    print(f"{len(summary['files'])} files, {summary['bytes'] / MiB:.0f} MiB in {summary['seconds']:.1f}s"
+          + (f", {summary['mb_per_s']:.0f} MB/s" if summary["mb_per_s"] else "")
+          + (", all ok" if summary["ok"] else ", FAILED"))
+    sys.exit(0 if summary["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
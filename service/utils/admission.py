@@ -0,0 +1,138 @@
+import math
+import time
+import asyncio
+from collections import defaultdict
+from typing import Optional
+
+from loguru import logger
+
+
+class AdmissionRejected(Exception):
+    """
+    请求未被接纳：status_code 为 429（用户自己的请求过多）或 503（服务过载），retry_after 为建议的重试等待秒数
+    """
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """
+    一次被接纳的图执行，release 可以重复调用，只有第一次生效
+    """
+    def __init__(self, controller: "AdmissionController", user: str):
+        self.controller = controller
+        self.user = user
+        self.start = time.monotonic()
+        self.released = False
+
+    async def release(self):
+        if not self.released:
+            self.released = True
+            await self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    图执行的准入控制，LLM 饱和时快速拒绝多余的请求，而不是让所有请求一起超时
+        max_concurrency: 同时执行的图的数量上限
+        max_per_user:    每个用户同时执行的图的数量上限，每个用户最多再排队 max_per_user 个请求，超过后返回 429
+        max_queue:       等待队列的长度上限，队列已满时立即返回 503
+        queue_timeout:   请求在队列中等待的最长时间（秒），超时后返回 503
+    None 表示不限制，Retry-After 按最近的平均执行时间和队列长度估算
+    metrics 为 ServiceMetrics 时记录等待时间和拒绝次数（ServiceMetrics.register_admission 会设置）
+    """
+    def __init__(self,
+                 max_concurrency: Optional[int] = None,
+                 max_per_user: Optional[int] = None,
+                 max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.metrics = None
+        self.condition = asyncio.Condition()
+
+        self.running = 0
+        self.waiting = 0
+        self.user_running = defaultdict(int)
+        self.user_waiting = defaultdict(int)
+
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        # 图执行时间的指数移动平均，用于估算 Retry-After
+        self.run_time = 1.0
+
+    def can_run(self, user: str) -> bool:
+        if self.max_concurrency is not None and self.running >= self.max_concurrency:
+            return False
+        if self.max_per_user is not None and self.user_running.get(user, 0) >= self.max_per_user:
+            return False
+        return True
+
+    def retry_after(self) -> int:
+        slots = self.max_concurrency or 1
+        return max(1, math.ceil(self.run_time * (self.waiting + 1) / slots))
+
+    def reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        if self.metrics is not None:
+            self.metrics.admission_rejected.labels(reason).inc()
+        logger.warning(f"admission rejected ({reason}): running {self.running}, waiting {self.waiting}")
+        return AdmissionRejected(status_code, self.retry_after(), reason)
+
+    async def acquire(self, user: str) -> AdmissionTicket:
+        start = time.monotonic()
+        async with self.condition:
+            if not self.can_run(user):
+                if self.max_per_user is not None and self.user_waiting.get(user, 0) >= self.max_per_user:
+                    raise self.reject(429, "user_limit")
+                if self.max_queue is not None and self.waiting >= self.max_queue:
+                    raise self.reject(503, "queue_full")
+
+                self.waiting += 1
+                self.user_waiting[user] += 1
+                try:
+                    await asyncio.wait_for(self.condition.wait_for(lambda: self.can_run(user)), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    raise self.reject(503, "queue_timeout")
+                finally:
+                    self.waiting -= 1
+                    self.user_waiting[user] -= 1
+                    if not self.user_waiting[user]:
+                        del self.user_waiting[user]
+
+            self.running += 1
+            self.user_running[user] += 1
+            self.admitted += 1
+            waited = time.monotonic() - start
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            if self.metrics is not None:
+                self.metrics.admission_wait_seconds.observe(waited)
+            return AdmissionTicket(self, user)
+
+    async def release(self, ticket: AdmissionTicket):
+        self.running -= 1
+        self.user_running[ticket.user] -= 1
+        if not self.user_running[ticket.user]:
+            del self.user_running[ticket.user]
+        self.run_time = 0.8 * self.run_time + 0.2 * (time.monotonic() - ticket.start)
+        async with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_ms": 1000 * self.wait_time / self.admitted if self.admitted else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_time,
+            "avg_run_seconds": self.run_time,
+        }
@@ -0,0 +1,773 @@
+import os
+import pickle
+import random
+import sqlite3
+import hashlib
+import weakref
+import functools
+import threading
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Sequence
+
+import ormsgpack
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import run_in_executor
+from langgraph.checkpoint.base import (WRITES_IDX_MAP,
+                                       BaseCheckpointSaver,
+                                       ChannelVersions,
+                                       Checkpoint,
+                                       CheckpointMetadata,
+                                       CheckpointTuple,
+                                       get_checkpoint_id,
+                                       get_checkpoint_metadata)
+from langgraph.checkpoint.memory import MemorySaver
+
+from service.utils.session import SessionStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id            TEXT NOT NULL,
+    checkpoint_ns        TEXT NOT NULL DEFAULT '',
+    checkpoint_id        TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type                 TEXT,
+    checkpoint           BLOB,
+    metadata_type        TEXT,
+    metadata             BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id     TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel       TEXT NOT NULL,
+    version       TEXT NOT NULL,
+    type          TEXT NOT NULL,
+    blob          BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id     TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id       TEXT NOT NULL,
+    idx           INTEGER NOT NULL,
+    channel       TEXT NOT NULL,
+    type          TEXT,
+    value         BLOB,
+    task_path     TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+def next_version(current: Optional[str]) -> str:
+    """
+    channel 版本号为 "{递增序号}.{随机数}"，可以按字符串排序，与 langgraph 内置的 checkpointer 相同
+    """
+    if current is None:
+        current_v = 0
+    elif isinstance(current, int):
+        current_v = current
+    else:
+        current_v = int(current.split(".")[0])
+    next_v = current_v + 1
+    next_h = random.random()
+    return f"{next_v:032}.{next_h:016}"
+
+
+class ChannelDeltas:
+    """
+    追加型 channel（messages）的增量写入：新的值以上一次写入的值为前缀时，只写入新增的消息和前一个版本号，
+    每 snapshot_every 个增量写入一次完整的值，读取时沿着版本链最多回溯 snapshot_every 个 blob
+        1. 前缀通过对象标识判断：add_messages 合并时未变化的消息仍是同一个对象，被替换或删除的消息会使前缀不成立
+        2. 每个会话只在内存中记录最近写入或读取的一个版本：各消息的弱引用和 content 的 hash，不引用消息本身，
+           checkpoint 被淘汰或写入磁盘后消息可以释放，释放后前缀不成立；
+           服务重启或者会话由其他 worker 写入后，下一次写入完整的值
+        3. snapshot_every 为 None 时总是写入完整的值
+    """
+    type_name = "delta"
+
+    def __init__(self, serde, channels: Sequence[str] = ("messages",), snapshot_every: Optional[int] = None,
+                 max_threads: Optional[int] = 10000):
+        self.serde = serde
+        self.channels = set(channels)
+        self.snapshot_every = snapshot_every
+        # thread_id -> {(checkpoint_ns, channel): (version, 各消息的弱引用, 各消息 content 的 hash, 距离上一个完整值的增量数)}
+        self.last = SessionStore(max_size=max_threads, sizeof=self.sizeof)
+
+    @staticmethod
+    def sizeof(thread_id: str, entries: dict) -> int:
+        # 每条消息一个弱引用（约 80 字节）和列表中的两个元素
+        return sum(100 * len(refs) for _, refs, _, _ in entries.values())
+
+    @staticmethod
+    def fingerprint(message: Any) -> int:
+        content = getattr(message, "content", None)
+        # str 的 hash 缓存在对象上，只在第一次写入时计算
+        return hash(content) if isinstance(content, str) else id(content)
+
+    def _record(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: list, depth: int):
+        entries = self.last.get(thread_id) or {}
+        try:
+            entries[(checkpoint_ns, channel)] = (version, [weakref.ref(v) for v in value],
+                                                 [self.fingerprint(v) for v in value], depth)
+        except TypeError:
+            # 不支持弱引用的值，下一次写入完整的值
+            entries.pop((checkpoint_ns, channel), None)
+        self.last[thread_id] = entries
+
+    def _base(self, thread_id: str, checkpoint_ns: str, channel: str, value: list):
+        entries = self.last.get(thread_id) or {}
+        if (checkpoint_ns, channel) not in entries:
+            return None
+        version, refs, fingerprints, depth = entries[(checkpoint_ns, channel)]
+        if depth + 1 >= self.snapshot_every or len(value) < len(refs):
+            return None
+        for ref, fingerprint, new in zip(refs, fingerprints, value):
+            if ref() is not new or self.fingerprint(new) != fingerprint:
+                return None
+        return version, len(refs), depth
+
+    def dumps(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: Any) -> tuple[str, bytes]:
+        if self.snapshot_every is None or channel not in self.channels or type(value) is not list:
+            return self.serde.dumps_typed(value)
+        if base := self._base(thread_id, checkpoint_ns, channel, value):
+            base_version, start, depth = base
+            self._record(thread_id, checkpoint_ns, channel, version, value, depth + 1)
+            return self.type_name, ormsgpack.packb([base_version, *self.serde.dumps_typed(value[start:])])
+        self._record(thread_id, checkpoint_ns, channel, version, value, 0)
+        return self.serde.dumps_typed(value)
+
+    def loads(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, type_: str, blob: bytes,
+              fetch: Callable[[str], tuple[str, bytes]]) -> Any:
+        """
+        fetch(version) 返回同一个 channel 指定版本的 (type, blob)
+        """
+        tails, depth = [], 0
+        while type_ == self.type_name:
+            base_version, tail_type, tail_blob = ormsgpack.unpackb(blob)
+            tails.append(self.serde.loads_typed((tail_type, tail_blob)))
+            type_, blob = fetch(base_version)
+            depth += 1
+        value = self.serde.loads_typed((type_, blob))
+        for tail in reversed(tails):
+            value.extend(tail)
+        if self.snapshot_every is not None and channel in self.channels and type(value) is list:
+            # 记录读取的值，在它后面继续对话时可以写入增量
+            self._record(thread_id, checkpoint_ns, channel, version, value, depth)
+        return value
+
+    def forget(self, thread_id: str):
+        self.last.pop(thread_id, None)
+
+
+class SQLiteSaver(BaseCheckpointSaver[str]):
+    """
+    基于 SQLite 的 checkpoint 存储，服务重启后可以恢复所有会话以及未完成的 interrupt
+        1. 使用 WAL 模式，读写互不阻塞，synchronous=NORMAL 降低每次提交的 fsync 开销
+        2. 每个图步骤的 checkpoint 和发生变化的 channel 在同一个事务中批量写入，未变化的 channel 不重复写入
+        3. 所有表的主键都以 thread_id 开头，按会话读取时直接命中索引
+        4. 启动时不加载任何会话，只在某个 thread_id 的请求到达时才读取对应的 checkpoint
+        5. snapshot_every 不为 None 时，messages 按增量写入，见 ChannelDeltas
+    """
+    def __init__(self, path: str = "data/checkpoints.sqlite", *, serde = None, snapshot_every: Optional[int] = None):
+        super().__init__(serde=serde)
+        self.deltas = ChannelDeltas(self.serde, snapshot_every=snapshot_every)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql: str, params: Sequence = ()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _transaction(self, statements: list[tuple[str, list[Sequence]]]):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    if rows:
+                        self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict[str, Any]:
+        if not versions:
+            return {}
+        keys = list(versions.items())
+        where = " OR ".join(["(channel = ? AND version = ?)"] * len(keys))
+        rows = self._execute(
+            f"SELECT channel, type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND ({where})",
+            [thread_id, checkpoint_ns, *[str(v) for kv in keys for v in kv]])
+
+        def fetch(channel: str, version: str) -> tuple[str, bytes]:
+            return self._execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, version))[0]
+
+        return {channel: self.deltas.loads(thread_id, checkpoint_ns, channel, str(versions[channel]), type_, blob,
+                                           functools.partial(fetch, channel))
+                    for channel, type_, blob in rows if type_ != "empty"}
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list[tuple[str, str, Any]]:
+        rows = self._execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id))
+        return [(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, channel, type_, value in rows]
+
+    def _build_tuple(self, thread_id: str, checkpoint_ns: str, row: Sequence) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        checkpoint_: Checkpoint = self.serde.loads_typed((type_, checkpoint))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint_,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint_["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id))
+        else:
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns))
+        if not rows:
+            return None
+        return self._build_tuple(thread_id, checkpoint_ns, rows[0])
+
+    def list(self,
+             config: Optional[RunnableConfig],
+             *,
+             filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+
+        rows = self._execute(
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            f"FROM checkpoints {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY checkpoint_id DESC",
+            params)
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if filter:
+                metadata = self.serde.loads_typed((row[4], row[5]))
+                if not all(value == metadata.get(key) for key, value in filter.items()):
+                    continue
+            if limit is not None and limit <= 0:
+                break
+            elif limit is not None:
+                limit -= 1
+            yield self._build_tuple(thread_id, checkpoint_ns, row)
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        values: dict[str, Any] = c.pop("channel_values")
+
+        blobs = []
+        for k, v in new_versions.items():
+            type_, blob = self.deltas.dumps(thread_id, checkpoint_ns, k, str(v), values[k]) if k in values else ("empty", b"")
+            blobs.append((thread_id, checkpoint_ns, k, str(v), type_, blob))
+
+        type_, serialized_checkpoint = self.serde.dumps_typed(c)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        try:
+            self._transaction([
+                ("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs),
+                ("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 [(thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                   type_, serialized_checkpoint, metadata_type, serialized_metadata)]),
+            ])
+        except BaseException:
+            # 增量的基础版本没有写入，下一次写入完整的值
+            self.deltas.forget(thread_id)
+            raise
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self,
+                   config: RunnableConfig,
+                   writes: Sequence[tuple[str, Any]],
+                   task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # 特殊的写入（错误，中断等）覆盖旧值，普通写入只保留第一次的结果
+        verb = "INSERT OR REPLACE" if all(c in WRITES_IDX_MAP for c, _ in writes) else "INSERT OR IGNORE"
+        rows = [(thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(c, idx), c,
+                 *self.serde.dumps_typed(v), task_path)
+                    for idx, (c, v) in enumerate(writes)]
+        self._transaction([(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)])
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.deltas.forget(thread_id)
+        self._transaction([
+            ("DELETE FROM checkpoints WHERE thread_id = ?", [(thread_id,)]),
+            ("DELETE FROM blobs WHERE thread_id = ?", [(thread_id,)]),
+            ("DELETE FROM writes WHERE thread_id = ?", [(thread_id,)]),
+        ])
+
+    def stats(self) -> dict:
+        threads = self._execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints")[0][0]
+        return {"count": threads, "bytes": os.path.getsize(self.path), "deltas": self.deltas.last.stats()}
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await run_in_executor(None, self.get_tuple, config)
+
+    async def alist(self,
+                    config: Optional[RunnableConfig],
+                    *,
+                    filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await run_in_executor(None, lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await run_in_executor(None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = "") -> None:
+        return await run_in_executor(None, self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await run_in_executor(None, self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return next_version(current)
+
+
+class RedisSaver(BaseCheckpointSaver[str]):
+    """
+    基于 Redis 的 checkpoint 存储，多个 worker 和节点共享同一份会话，任何一个 worker 都可以继续另一个 worker 中断的对话
+        1. 每个会话的所有 key 都使用 {thread_id} 作为 hash tag，在 Redis Cluster 中落在同一个 slot，可以在一个事务中写入
+        2. checkpoint_id 按时间排序，保存在 score 为 0 的有序集合中，通过 ZREVRANGEBYLEX 读取最新或者指定之前的 checkpoint
+        3. 每个图步骤的 checkpoint 和发生变化的 channel 在同一个 MULTI/EXEC 事务中写入
+        4. ttl 不为 None 时，会话的 key 在最后一次写入 ttl 秒后过期
+        5. snapshot_every 不为 None 时，messages 按增量写入，见 ChannelDeltas
+    """
+    def __init__(self, client = None, url: str = "redis://localhost:6379/0", prefix: str = "pipeline-agent",
+                 ttl: Optional[int] = None, *, serde = None, snapshot_every: Optional[int] = None):
+        super().__init__(serde=serde)
+        self.deltas = ChannelDeltas(self.serde, snapshot_every=snapshot_every)
+        if client is None:
+            from redis import Redis
+            client = Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, thread_id: str, kind: str, *parts: str) -> str:
+        return ":".join([f"{self.prefix}:{{{thread_id}}}", kind, *parts])
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict[str, Any]:
+        if not versions:
+            return {}
+        key = self._key(thread_id, "blobs", checkpoint_ns)
+        channels = list(versions)
+        values = self.client.hmget(key, [f"{channel}\0{versions[channel]}" for channel in channels])
+
+        def fetch(channel: str, version: str) -> tuple[str, bytes]:
+            type_, blob = self.client.hget(key, f"{channel}\0{version}").split(b"\0", 1)
+            return type_.decode(), blob
+
+        blobs = {}
+        for channel, value in zip(channels, values):
+            if value is None:
+                continue
+            type_, blob = value.split(b"\0", 1)
+            if type_ != b"empty":
+                blobs[channel] = self.deltas.loads(thread_id, checkpoint_ns, channel, str(versions[channel]),
+                                                   type_.decode(), blob, functools.partial(fetch, channel))
+        return blobs
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list[tuple[str, str, Any]]:
+        writes = []
+        for field, value in self.client.hgetall(self._key(thread_id, "writes", checkpoint_ns, checkpoint_id)).items():
+            task_id, idx = field.decode().rsplit("\0", 1)
+            channel, type_, _, blob = value.split(b"\0", 3)
+            writes.append(((task_id, int(idx)), (task_id, channel.decode(), self.serde.loads_typed((type_.decode(), blob)))))
+        return [write for _, write in sorted(writes, key=lambda x: x[0])]
+
+    def _build_tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> Optional[CheckpointTuple]:
+        saved = self.client.hgetall(self._key(thread_id, "checkpoint", checkpoint_ns, checkpoint_id))
+        if not saved:
+            return None
+        checkpoint_: Checkpoint = self.serde.loads_typed((saved[b"type"].decode(), saved[b"checkpoint"]))
+        parent_checkpoint_id = saved[b"parent"].decode()
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint_,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint_["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((saved[b"metadata_type"].decode(), saved[b"metadata"])),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+        )
+
+    def _checkpoint_ids(self, thread_id: str, checkpoint_ns: str, before: Optional[str] = None, limit: Optional[int] = None) -> list[str]:
+        ids = self.client.zrevrangebylex(self._key(thread_id, "checkpoints", checkpoint_ns),
+                                         f"({before}" if before else "+", "-",
+                                         start=0 if limit else None, num=limit)
+        return [checkpoint_id.decode() for checkpoint_id in ids]
+
+    def _threads(self) -> list[str]:
+        head, tail = f"{self.prefix}:{{", "}:namespaces"
+        return [key.decode()[len(head):-len(tail)] for key in self.client.scan_iter(match=f"{self.prefix}:{{*}}:namespaces")]
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            ids = self._checkpoint_ids(thread_id, checkpoint_ns, limit=1)
+            if not ids:
+                return None
+            checkpoint_id = ids[0]
+        return self._build_tuple(thread_id, checkpoint_ns, checkpoint_id)
+
+    def list(self,
+             config: Optional[RunnableConfig],
+             *,
+             filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        threads = [config["configurable"]["thread_id"]] if config else self._threads()
+        before_checkpoint_id = get_checkpoint_id(before) if before else None
+
+        candidates = []
+        for thread_id in threads:
+            if config and (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                namespaces = [checkpoint_ns]
+            else:
+                namespaces = [ns.decode() for ns in self.client.smembers(self._key(thread_id, "namespaces"))]
+            for checkpoint_ns in namespaces:
+                if config and (checkpoint_id := get_checkpoint_id(config)):
+                    ids = [checkpoint_id] if not before_checkpoint_id or checkpoint_id < before_checkpoint_id else []
+                else:
+                    ids = self._checkpoint_ids(thread_id, checkpoint_ns, before=before_checkpoint_id)
+                candidates.extend((checkpoint_id, thread_id, checkpoint_ns) for checkpoint_id in ids)
+
+        for checkpoint_id, thread_id, checkpoint_ns in sorted(candidates, reverse=True):
+            if limit is not None and limit <= 0:
+                break
+            item = self._build_tuple(thread_id, checkpoint_ns, checkpoint_id)
+            if item is None:
+                continue
+            if filter and not all(value == item.metadata.get(key) for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    def _expire(self, pipe, *keys: str):
+        if self.ttl is not None:
+            for key in keys:
+                pipe.expire(key, self.ttl)
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        values: dict[str, Any] = c.pop("channel_values")
+
+        blobs = {}
+        for k, v in new_versions.items():
+            type_, blob = self.deltas.dumps(thread_id, checkpoint_ns, k, str(v), values[k]) if k in values else ("empty", b"")
+            blobs[f"{k}\0{v}"] = type_.encode() + b"\0" + blob
+
+        type_, serialized_checkpoint = self.serde.dumps_typed(c)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        keys = [self._key(thread_id, "namespaces"),
+                self._key(thread_id, "checkpoints", checkpoint_ns),
+                self._key(thread_id, "checkpoint", checkpoint_ns, checkpoint["id"])]
+
+        pipe = self.client.pipeline(transaction=True)
+        if blobs:
+            pipe.hset(self._key(thread_id, "blobs", checkpoint_ns), mapping=blobs)
+            keys.append(self._key(thread_id, "blobs", checkpoint_ns))
+        pipe.hset(keys[2], mapping={
+            "parent": config["configurable"].get("checkpoint_id") or "",
+            "type": type_,
+            "checkpoint": serialized_checkpoint,
+            "metadata_type": metadata_type,
+            "metadata": serialized_metadata,
+        })
+        pipe.zadd(keys[1], {checkpoint["id"]: 0})
+        pipe.sadd(keys[0], checkpoint_ns)
+        self._expire(pipe, *keys)
+        try:
+            pipe.execute()
+        except BaseException:
+            # 增量的基础版本没有写入，下一次写入完整的值
+            self.deltas.forget(thread_id)
+            raise
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self,
+                   config: RunnableConfig,
+                   writes: Sequence[tuple[str, Any]],
+                   task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        key = self._key(thread_id, "writes", checkpoint_ns, checkpoint_id)
+        # 特殊的写入（错误，中断等）覆盖旧值，普通写入只保留第一次的结果
+        replace = all(c in WRITES_IDX_MAP for c, _ in writes)
+
+        pipe = self.client.pipeline(transaction=True)
+        for idx, (c, v) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(v)
+            field = f"{task_id}\0{WRITES_IDX_MAP.get(c, idx)}"
+            value = b"\0".join([c.encode(), type_.encode(), task_path.encode(), blob])
+            if replace:
+                pipe.hset(key, field, value)
+            else:
+                pipe.hsetnx(key, field, value)
+        self._expire(pipe, key)
+        pipe.execute()
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.deltas.forget(thread_id)
+        keys = [self._key(thread_id, "namespaces")]
+        for ns in self.client.smembers(keys[0]):
+            checkpoint_ns = ns.decode()
+            keys += [self._key(thread_id, "checkpoints", checkpoint_ns), self._key(thread_id, "blobs", checkpoint_ns)]
+            for checkpoint_id in self.client.zrange(self._key(thread_id, "checkpoints", checkpoint_ns), 0, -1):
+                keys += [self._key(thread_id, "checkpoint", checkpoint_ns, checkpoint_id.decode()),
+                         self._key(thread_id, "writes", checkpoint_ns, checkpoint_id.decode())]
+        self.client.delete(*keys)
+
+    def stats(self) -> dict:
+        # 占用的内存由 Redis 的 maxmemory 和 ttl 管理，这里只统计会话数量
+        return {"count": len(self._threads()), "deltas": self.deltas.last.stats()}
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await run_in_executor(None, self.get_tuple, config)
+
+    async def alist(self,
+                    config: Optional[RunnableConfig],
+                    *,
+                    filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await run_in_executor(None, lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await run_in_executor(None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = "") -> None:
+        return await run_in_executor(None, self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await run_in_executor(None, self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return next_version(current)
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    有容量上限的内存 checkpoint 存储，防止长时间运行的服务因为会话不断增加而耗尽内存
+        max_threads: 内存中最多保留的会话数量，超过后淘汰最久未访问的会话
+        ttl:         会话空闲超过 ttl 秒后淘汰
+        spill_dir:   被淘汰的会话写入该目录，再次访问时从磁盘恢复；None 表示直接丢弃
+    """
+    def __init__(self, max_threads = None, ttl = None, spill_dir = None, *, serde = None):
+        super().__init__(serde=serde)
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        # thread_id -> 会话占用的字节数
+        self.sessions = SessionStore(max_size=max_threads, 
+                                     ttl=ttl, 
+                                     on_evict=self._evict, 
+                                     sizeof=lambda thread_id, size: size)
+
+    def _spill_path(self, thread_id: str) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha1(str(thread_id).encode()).hexdigest() + ".pkl")
+
+    def _thread_data(self, thread_id: str) -> dict:
+        return {
+            "storage": {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()},
+            "writes": {k: dict(v) for k, v in self.writes.items() if k[0] == thread_id},
+            "blobs": {k: v for k, v in self.blobs.items() if k[0] == thread_id},
+        }
+
+    def _evict(self, thread_id: str, size: int):
+        if self.spill_dir:
+            with open(self._spill_path(thread_id), "wb") as f:
+                pickle.dump(self._thread_data(thread_id), f)
+        super().delete_thread(thread_id)
+
+    def _restore(self, thread_id: str) -> int:
+        if not self.spill_dir or not os.path.exists(self._spill_path(thread_id)):
+            return 0
+        with open(self._spill_path(thread_id), "rb") as f:
+            data = pickle.load(f)
+        os.remove(self._spill_path(thread_id))
+        for ns, checkpoints in data["storage"].items():
+            self.storage[thread_id][ns].update(checkpoints)
+        for k, v in data["writes"].items():
+            self.writes[k].update(v)
+        self.blobs.update(data["blobs"])
+        return sum(len(v[1]) for v in data["blobs"].values()) + \
+               sum(len(c[0][1]) + len(c[1][1]) for checkpoints in data["storage"].values() for c in checkpoints.values())
+
+    def _touch(self, thread_id: str, added: int = 0):
+        """
+        刷新会话的访问时间，累加新写入的字节数，会话已经被写入磁盘时先恢复到内存
+        """
+        if thread_id in self.sessions:
+            self.sessions[thread_id] = self.sessions[thread_id] + added
+        else:
+            self.sessions[thread_id] = self._restore(thread_id) + added
+
+    def get_tuple(self, config):
+        with self.lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter = None, before = None, limit = None):
+        with self.lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self.lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            added = sum(len(self.blobs[(thread_id, checkpoint_ns, k, v)][1]) for k, v in new_versions.items())
+            saved, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            self._touch(thread_id, added + len(saved[1]) + len(saved_metadata[1]))
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path = ""):
+        with self.lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(config["configurable"]["thread_id"])
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            if thread_id in self.sessions:
+                del self.sessions[thread_id]
+            if self.spill_dir and os.path.exists(self._spill_path(thread_id)):
+                os.remove(self._spill_path(thread_id))
+            super().delete_thread(thread_id)
+
+    def stats(self) -> dict:
+        stats = self.sessions.stats()
+        stats["spilled"] = len(os.listdir(self.spill_dir)) if self.spill_dir else 0
+        return stats
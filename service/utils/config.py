@@ -1,14 +1,369 @@
+import os
 import yaml
-from langchain_ollama import ChatOllama
+import functools
 
-def load_model(config = "config/model.yaml"):
-    
-    with open(config, "r") as f:
-        config = yaml.safe_load(f)
+def load_yaml(path):
+    """
+    读取 YAML 文件，按 (路径, 修改时间) 缓存，启动时多个 loader 读取同一个文件只解析一次，文件修改后重新解析
+    返回的对象在调用之间共享，调用方不要修改
+    """
+    return parse_yaml(os.path.abspath(path), os.stat(path).st_mtime_ns)
 
-    llm = ChatOllama(
-        model       = config.get("ollama").get("model_name"),
-        temperature = config.get("ollama").get("temperature"),
-    )
+@functools.lru_cache(maxsize = 64)
+def parse_yaml(path, mtime):
+    with open(path, "r") as f:
+        return yaml.load(f, Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+def load_model(config = "config/model.yaml", backend = None):
+
+    config = load_yaml(config)
+
+    backend = backend or config.get("backend", "ollama")
+    cache = load_llm_cache(config.get("cache", {}))
+
+    if backend == "ollama":
+        from langchain_ollama import ChatOllama
+        return ChatOllama(
+            model       = config.get("ollama").get("model_name"),
+            temperature = config.get("ollama").get("temperature"),
+            keep_alive  = config.get("ollama").get("keep_alive"),
+            cache       = cache,
+        )
+
+    if backend == "vllm":
+        import httpx
+        from langchain_openai import ChatOpenAI
+        vllm_config = config.get("vllm")
+        http_client, http_async_client = http_clients(
+            max_in_flight    = vllm_config.get("max_in_flight", 64),
+            keepalive_expiry = vllm_config.get("keepalive_expiry", 60),
+        )
+        return ChatOpenAI(
+            model             = vllm_config.get("model_name"),
+            temperature       = vllm_config.get("temperature"),
+            base_url          = vllm_config.get("base_url"),
+            api_key           = vllm_config.get("api_key", "EMPTY"),
+            timeout           = httpx.Timeout(vllm_config.get("timeout", 120),
+                                              connect = vllm_config.get("connect_timeout", 5),
+                                              pool    = vllm_config.get("queue_timeout")),
+            max_retries       = vllm_config.get("max_retries", 2),
+            stream_usage      = vllm_config.get("stream_usage", True),
+            http_client       = http_client,
+            http_async_client = http_async_client,
+            cache             = cache,
+        )
+
+    if backend == "fake":
+        # 负载测试和基准测试使用的确定性假模型，不需要模型服务
+        from service.utils.fake_llm import FakeChatModel
+        fake_config = config.get("fake", {})
+        rules = fake_config.get("rules")
+        return FakeChatModel(
+            latency           = fake_config.get("latency", 0.05),
+            tokens_per_second = fake_config.get("tokens_per_second", 50),
+            model_name        = fake_config.get("model_name", "fake"),
+            cache             = cache,
+            **({"rules": [(rule["match"], rule["reply"]) for rule in rules]} if rules is not None else {}),
+            **({"reply": fake_config["reply"]} if fake_config.get("reply") else {}),
+        )
+
+    raise ValueError(f"Unknown model backend: {backend}")
+
+def load_llm_cache(cache_config):
+    """
+    model.yaml 中的 cache 配置，enabled 为 false 时返回 None（不使用缓存）
+    """
+    if not cache_config.get("enabled", False):
+        return None
+    return llm_cache(path        = cache_config.get("path", "data/llm_cache.sqlite"),
+                     tags        = tuple((tag, None if replies is None else tuple(replies))
+                                         for tag, replies in (cache_config.get("tags") or {}).items()),
+                     max_entries = cache_config.get("max_entries", 10000),
+                     max_bytes   = cache_config.get("max_bytes"),
+                     ttl         = cache_config.get("ttl"))
+
+@functools.lru_cache(maxsize = None)
+def llm_cache(path, tags, max_entries, max_bytes, ttl):
+    """
+    同一个文件只打开一个缓存，多次调用 load_model 得到的模型共用同一个缓存和命中统计
+    """
+    from service.utils.llm_cache import SQLiteLLMCache
+    return SQLiteLLMCache(path, tags = dict(tags), max_entries = max_entries, max_bytes = max_bytes, ttl = ttl)
+
+@functools.lru_cache(maxsize = None)
+def http_clients(max_in_flight = 64, keepalive_expiry = 60):
+    """
+    OpenAI 兼容后端共用的 keep-alive 连接池，多次调用 load_model 得到的模型共用同一组连接，
+    同时进行的请求数不超过 max_in_flight，其余请求在连接池中排队
+    """
+    import httpx
+    limits = httpx.Limits(max_connections           = max_in_flight,
+                          max_keepalive_connections = max_in_flight,
+                          keepalive_expiry          = keepalive_expiry)
+    return httpx.Client(limits = limits), httpx.AsyncClient(limits = limits)
+
+def load_service_config(config = "config/service.yaml"):
+
+    return load_yaml(config) or {}
+
+def load_checkpointer(config = "config/service.yaml"):
+
+    checkpointer_config = load_service_config(config).get("checkpointer", {})
+    checkpointer_type = checkpointer_config.get("type", "memory")
+    serde = load_serializer(config)
+
+    if checkpointer_type == "memory":
+        from service.utils.checkpoint import BoundedMemorySaver
+        session_config = load_service_config(config).get("session", {})
+        return BoundedMemorySaver(max_threads = session_config.get("max_threads"),
+                                  ttl         = session_config.get("ttl"),
+                                  spill_dir   = session_config.get("spill_dir"),
+                                  serde       = serde)
+
+    if checkpointer_type == "sqlite":
+        from service.utils.checkpoint import SQLiteSaver
+        return SQLiteSaver(checkpointer_config.get("path", "data/checkpoints.sqlite"),
+                           serde          = serde,
+                           snapshot_every = checkpointer_config.get("snapshot_every"))
+
+    if checkpointer_type == "redis":
+        from service.utils.checkpoint import RedisSaver
+        redis_config = load_service_config(config).get("redis", {})
+        return RedisSaver(load_redis(config),
+                          prefix         = redis_config.get("prefix", "pipeline-agent"),
+                          ttl            = load_service_config(config).get("session", {}).get("ttl"),
+                          serde          = serde,
+                          snapshot_every = checkpointer_config.get("snapshot_every"))
+
+    raise ValueError(f"Unknown checkpointer type: {checkpointer_type}")
+
+def load_serializer(config = "config/service.yaml"):
+
+    serializer = load_service_config(config).get("checkpointer", {}).get("serializer", "jsonplus")
+
+    if serializer == "jsonplus":
+        return None
+
+    if serializer == "typed-msgpack":
+        from service.utils.serde import TypedMsgpackSerializer
+        return TypedMsgpackSerializer()
+
+    raise ValueError(f"Unknown checkpoint serializer: {serializer}")
+
+def load_redis(config = "config/service.yaml", asyncio = False):
+
+    redis_config = load_service_config(config).get("redis", {})
+    return redis_client(redis_config.get("url", "redis://localhost:6379/0"), asyncio)
+
+@functools.lru_cache(maxsize = None)
+def redis_client(url, asyncio = False):
+    """
+    同一个 url 的 checkpointer，interrupted_threads 和会话锁共用一个连接池
+    """
+    if asyncio:
+        from redis.asyncio import Redis
+    else:
+        from redis import Redis
+    return Redis.from_url(url)
+
+def load_session_store(config = "config/service.yaml", **kwargs):
+
+    session_config = load_service_config(config).get("session", {})
+
+    if session_config.get("store", "memory") == "redis":
+        from service.utils.session import RedisSessionStore
+        redis_config = load_service_config(config).get("redis", {})
+        return RedisSessionStore(load_redis(config),
+                                 prefix = redis_config.get("prefix", "pipeline-agent"),
+                                 ttl    = session_config.get("ttl"))
+
+    from service.utils.session import SessionStore
+    return SessionStore(max_size = session_config.get("max_threads"),
+                        ttl      = session_config.get("ttl"),
+                        **kwargs)
+
+def load_thread_lock(config = "config/service.yaml"):
+
+    # 会话保存在 Redis 中时可能有多个 worker，使用分布式锁，否则使用进程内的锁
+    if load_service_config(config).get("checkpointer", {}).get("type") == "redis":
+        from service.utils.lock import RedisThreadLock
+        redis_config = load_service_config(config).get("redis", {})
+        return RedisThreadLock(load_redis(config, asyncio = True),
+                               prefix  = redis_config.get("prefix", "pipeline-agent"),
+                               timeout = redis_config.get("lock_timeout", 30),
+                               wait    = redis_config.get("lock_wait", 60))
+
+    from service.utils.lock import LocalThreadLock
+    return LocalThreadLock()
+
+def load_intent_classifier(config = "config/service.yaml", prompt_file = "config/prompts/DialogueProcessor.yaml"):
+
+    classifier_config = load_service_config(config).get("intent_classifier", {})
+    if not classifier_config.get("enabled", False):
+        return None
+
+    from service.chat.classifier import IntentClassifier
+    examples = load_yaml(prompt_file).get("examples")
+
+    return IntentClassifier(examples,
+                            k              = classifier_config.get("k", 5),
+                            threshold      = classifier_config.get("threshold", 0.8),
+                            min_similarity = classifier_config.get("min_similarity", 0.5),
+                            log_file       = classifier_config.get("log_file"),
+                            max_examples   = classifier_config.get("max_examples", 5000))
+
+def load_prompt_builder(config = "config/service.yaml", prompt_file = "config/prompts/pipeline/task_new.yaml"):
+
+    from service.chat.pipeline.prompts import pipeline_prompt_builder
+    few_shot_config = load_service_config(config).get("few_shot", {})
+    task_config = load_service_config(config).get("pipeline_task", {})
+
+    return pipeline_prompt_builder(prompt_file,
+                                   few_shot_k            = few_shot_config.get("k"),
+                                   few_shot_token_budget = few_shot_config.get("token_budget"),
+                                   structured_output     = task_config.get("structured_output", False))
+
+def load_admission_controller(config = "config/service.yaml"):
+
+    from service.utils.admission import AdmissionController
+    admission_config = load_service_config(config).get("admission", {})
+
+    return AdmissionController(max_concurrency = admission_config.get("max_concurrency"),
+                               max_per_user    = admission_config.get("max_per_user"),
+                               max_queue       = admission_config.get("max_queue"),
+                               queue_timeout   = admission_config.get("queue_timeout"))
+
+def load_model_warmer(config = "config/service.yaml", llm = None, processor = None,
+                      prompt_file = "config/prompts/pipeline/task_new.yaml"):
+
+    warmup_config = load_service_config(config).get("warmup", {})
+    if not warmup_config.get("enabled", False):
+        return None
+
+    from service.chat.states import PipelineState
+    from service.utils.warmup import ModelWarmer
+
+    # 预热 DialogueProcessor 和 task_new 的提示，用户输入只是占位，缓存的是前面的系统提示和 few-shot 示例
+    prompts = []
+    if processor is not None:
+        prompts.append(processor.prompts.format_messages(user_message="hello"))
+    builder = load_prompt_builder(config, prompt_file)
+    state = PipelineState(messages=[])
+    if builder.structured_output:
+        prompts.append(builder.structured_pipeline_task_prompt(state).format_messages(user_input="hello"))
+    formatter_prompt, _ = builder.new_pipeline_task_prompt(state)
+    prompts.append(formatter_prompt.format_messages(user_input="hello"))
+
+    return ModelWarmer(llm or load_model(),
+                       prompts,
+                       timeout             = warmup_config.get("timeout", 120),
+                       retry_interval      = warmup_config.get("retry_interval", 5),
+                       keep_alive_interval = warmup_config.get("keep_alive_interval"))
+
+def load_metrics(config = "config/service.yaml"):
+
+    metrics_config = load_service_config(config).get("metrics", {})
+    if not metrics_config.get("enabled", False):
+        return None
+
+    from service.utils.metrics import ServiceMetrics
+    return ServiceMetrics(namespace = metrics_config.get("namespace", "pipeline_agent"))
+
+def load_token_budget(config = "config/service.yaml"):
+
+    usage_config = load_service_config(config).get("usage", {})
+    kwargs = dict(window       = usage_config.get("window", 3600),
+                  max_requests = usage_config.get("max_requests"),
+                  max_tokens   = usage_config.get("max_tokens"))
+
+    if usage_config.get("store", "memory") == "redis":
+        from service.utils.usage import RedisTokenBudget
+        redis_config = load_service_config(config).get("redis", {})
+        return RedisTokenBudget(load_redis(config, asyncio = True),
+                                prefix = redis_config.get("prefix", "pipeline-agent"),
+                                ttl    = load_service_config(config).get("session", {}).get("ttl"),
+                                **kwargs)
+
+    from service.utils.usage import TokenBudget
+    return TokenBudget(max_chats = usage_config.get("max_chats", 10000),
+                       max_users = usage_config.get("max_users", 10000), **kwargs)
+
+def load_history_compactor(config = "config/service.yaml", llm = None, lock = None,
+                           prompt_file = "config/prompts/DialogueProcessor.yaml"):
+
+    from service.chat.history import HistoryCompactor
+    history_config = load_service_config(config).get("history", {})
+    prompt = load_yaml(prompt_file).get("summary")
+
+    return HistoryCompactor(window    = history_config.get("window"),
+                            slack     = history_config.get("slack", 10),
+                            summarize = history_config.get("summarize", False),
+                            llm       = llm,
+                            prompt    = prompt,
+                            lock      = lock)
+
+@functools.lru_cache(maxsize = None)
+def transfer_budget(max_concurrency = 16, max_bytes_per_second = None):
+    """
+    同一进程中的所有下载任务共用一个预算
+    """
+    from service.tasks.download import TransferBudget
+    return TransferBudget(max_concurrency = max_concurrency, max_bytes_per_second = max_bytes_per_second)
+
+def load_transfer_budget(config = "config/service.yaml"):
+
+    from service.tasks.download import MiB
+    download_config = load_service_config(config).get("download", {})
+    rate = download_config.get("max_mb_per_second")
+    kwargs = dict(max_concurrency      = download_config.get("max_concurrency", 16),
+                  max_bytes_per_second = rate * MiB if rate else None)
+
+    if download_config.get("store", "memory") == "redis":
+        from service.tasks.download import RedisTransferBudget
+        return RedisTransferBudget(load_redis(config),
+                                   prefix = load_service_config(config).get("redis", {}).get("prefix", "pipeline-agent"),
+                                   ttl    = download_config.get("slot_ttl", 60),
+                                   **kwargs)
+    return transfer_budget(**kwargs)
+
+def load_downloader(config = "config/service.yaml"):
+
+    from service.tasks.download import Downloader, MiB
+    download_config = load_service_config(config).get("download", {})
+    return Downloader(budget         = load_transfer_budget(config),
+                      part_size      = int(download_config.get("part_size_mb", 64) * MiB),
+                      max_attempts   = download_config.get("max_attempts", 5),
+                      retry_interval = download_config.get("retry_interval", 1))
+
+def load_download_source(source_type, config = "config/service.yaml"):
+    """
+    source_type 为 data_source_type 的取值（iRODS, AWS, Storage, Scratch）或 HTTP
+    """
+    from service.tasks.download import SOURCES
+    if source_type not in SOURCES:
+        raise ValueError(f"Unknown data source: {source_type}")
+    source_config = load_service_config(config).get("download", {}).get("sources", {}).get(source_type) or {}
+    return SOURCES[source_type](**source_config)
+
+def load_job_publisher(config = "config/service.yaml"):
+
+    jobs_config = load_service_config(config).get("jobs", {})
+    if not jobs_config.get("enabled", False):
+        return None
+
+    from service.tasks.events import JobEventPublisher
+    return JobEventPublisher(load_redis(config),
+                             prefix = load_service_config(config).get("redis", {}).get("prefix", "pipeline-agent"),
+                             maxlen = jobs_config.get("maxlen", 100000))
+
+def load_job_status_view(config = "config/service.yaml"):
+
+    jobs_config = load_service_config(config).get("jobs", {})
+    if not jobs_config.get("enabled", False):
+        return None
+
+    from service.tasks.events import JobStatusView
+    return JobStatusView(load_redis(config, asyncio = True),
+                         prefix   = load_service_config(config).get("redis", {}).get("prefix", "pipeline-agent"),
+                         max_jobs = jobs_config.get("max_jobs", 10000))
 
-    return llm
\ No newline at end of file
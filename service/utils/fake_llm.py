@@ -0,0 +1,114 @@
+"""
+确定性的假 LLM，用于负载测试和基准测试：回复只由输入决定，延迟和生成速度可以配置
+在 config/model.yaml 中设置 backend: fake 后由 load_model 创建，服务的其余部分与使用真实模型时相同
+"""
+import re
+import time
+import asyncio
+from typing import Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from service.chat.pipeline.examples import estimate_tokens
+
+INTRODUCTION = ("I am a knowledgeable AI agent capable of assisting with complex data processing pipeline tasks "
+                "and providing expert information on biology and medicine")
+
+# 按顺序匹配最后一条消息，第一个匹配的规则给出回复：
+# DialogueProcessor 的意图分类（pipeline / medical），话题切换时的确认问题，其余为自我介绍
+DEFAULT_RULES = [
+    (r"confirm if user is starting a new topic",
+     "It seems that you are starting a new topic, do you want to switch to it? Please answer with 'yes' or 'no'."),
+    (r"classify the intent.*\b(pipeline|data|process|sequencing|fastq|wes|wgs|rna-seq)",
+     "pipeline"),
+    (r"classify the intent.*\b(medic\w*|patients?|symptoms?|disease|cancer|pneumonia|treatment)",
+     "medical"),
+]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    确定性的假聊天模型
+        latency:           第一个 token 之前的延迟（秒），模拟 prefill 和网络往返
+        tokens_per_second: 生成速度，回复按空格分词，每个词一个 token，None 表示没有生成时间
+        rules:             [(正则表达式, 回复)]，不区分大小写地匹配最后一条消息，都不匹配时回复 reply
+        reply:             默认回复
+    返回的 usage_metadata 按 estimate_tokens 计算输入 token 数，输出 token 数为回复的词数
+    """
+    latency: float = 0.05
+    tokens_per_second: Optional[float] = 50.0
+    rules: list[tuple[str, str]] = DEFAULT_RULES
+    reply: str = INTRODUCTION
+    model_name: str = "fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.model_name
+        return params
+
+    def respond(self, messages) -> str:
+        text = str(messages[-1].content) if messages else ""
+        for pattern, reply in self.rules:
+            if re.search(pattern, text, re.IGNORECASE | re.DOTALL):
+                return reply
+        return self.reply
+
+    def tokens(self, reply: str) -> list[str]:
+        return [word if i == 0 else " " + word for i, word in enumerate(reply.split(" "))]
+
+    def usage(self, messages, tokens: list[str]) -> dict:
+        input_tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        return {"input_tokens": input_tokens, "output_tokens": len(tokens), "total_tokens": input_tokens + len(tokens)}
+
+    @property
+    def token_interval(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self.respond(messages)
+        tokens = self.tokens(reply)
+        time.sleep(self.latency + self.token_interval * len(tokens))
+        message = AIMessage(content=reply, usage_metadata=self.usage(messages, tokens),
+                            response_metadata={"model_name": self.model_name, "finish_reason": "stop"})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self.respond(messages)
+        tokens = self.tokens(reply)
+        await asyncio.sleep(self.latency + self.token_interval * len(tokens))
+        message = AIMessage(content=reply, usage_metadata=self.usage(messages, tokens),
+                            response_metadata={"model_name": self.model_name, "finish_reason": "stop"})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.tokens(self.respond(messages))
+        time.sleep(self.latency)
+        for token in tokens:
+            time.sleep(self.token_interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # 与 ollama 和 stream_usage 的 OpenAI 兼容后端相同，用量在最后一个 chunk 中返回
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.usage(messages, tokens),
+                                                         response_metadata={"model_name": self.model_name,
+                                                                            "finish_reason": "stop"}))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.tokens(self.respond(messages))
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            await asyncio.sleep(self.token_interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.usage(messages, tokens),
+                                                         response_metadata={"model_name": self.model_name,
+                                                                            "finish_reason": "stop"}))
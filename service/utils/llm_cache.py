@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Iterable, Mapping, Optional
+
+import ormsgpack
+from loguru import logger
+from langchain_core.caches import BaseCache
+from langchain_core.outputs import ChatGeneration
+from langchain_core.runnables.config import var_child_runnable_config
+
+from service.utils.serde import pack, ext_hook
+
+# 缓存命中时没有调用模型，usage 记为 0
+CACHED_USAGE = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    LangChain 传给缓存的 prompt 是序列化的消息列表，只保留每条消息的类型和内容，并合并连续的空白，
+    消息 id 和 additional_kwargs 不同、内容相同的 prompt 使用同一个缓存
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return " ".join(prompt.split())
+    normalized = []
+    for message in messages if isinstance(messages, list) else [messages]:
+        kwargs = message.get("kwargs", {}) if isinstance(message, dict) else {}
+        content = kwargs.get("content", message)
+        content = " ".join(content.split()) if isinstance(content, str) else json.dumps(content, sort_keys=True)
+        normalized.append([kwargs.get("type"), content])
+    return json.dumps(normalized, ensure_ascii=False)
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LLM 回复的磁盘缓存（SQLite），作为 load_model 返回的模型的 cache 使用
+        1. key 为 llm_string（模型名称、temperature 等参数）和规范化后的消息的 sha256
+        2. 只缓存带有 tags 中的 tag 的链（config 中的 tags）发出的调用，例如意图分类和信息提取；tags 的值为允许缓存的回复，
+           None 表示任意回复，例如意图分类只缓存分类标签。对话回复、预热请求和后台的历史摘要都直接调用模型
+        3. 条目超过 max_entries 或总大小超过 max_bytes 时淘汰最久未访问的条目（LRU），超过 ttl 秒的条目视为不存在
+    缓存的消息不保存 id，命中时由 LangChain 按当前的 run 生成新的 id，usage 记为 0
+    """
+    def __init__(self,
+                 path: str = "data/llm_cache.sqlite",
+                 tags: Mapping[str, Optional[Iterable[str]]] = None,
+                 max_entries: Optional[int] = 10000,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        self.path = path
+        self.tags = {tag: None if replies is None else set(replies)
+                     for tag, replies in (tags if tags is not None else {"classifier": ("pipeline", "medical")}).items()}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS llm_cache ("
+                          "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                          "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self.lock = threading.Lock()
+        self.entries, self.bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evicted = 0
+        self.expired = 0
+
+    def tag(self) -> Optional[str]:
+        config = var_child_runnable_config.get()
+        return next((tag for tag in config.get("tags") or () if tag in self.tags), None) if config else None
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{normalize_prompt(prompt)}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        tag = self.tag()
+        if tag is None:
+            return None
+
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.delete(key)
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses[tag] += 1
+                return None
+            self.conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self.hits[tag] += 1
+
+        messages = ormsgpack.unpackb(row[0], ext_hook=ext_hook)
+        return [ChatGeneration(message=message) for message in messages]
+
+    def update(self, prompt: str, llm_string: str, return_val: list):
+        tag = self.tag()
+        if tag is None or not all(isinstance(g, ChatGeneration) for g in return_val):
+            return
+        replies = self.tags[tag]
+        if replies is not None and any(g.message.content not in replies for g in return_val):
+            return
+
+        messages = [g.message.model_copy(update={"id": None, "usage_metadata": CACHED_USAGE}) for g in return_val]
+        value = pack(messages)
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self.lock:
+            self.delete(key)
+            self.conn.execute("INSERT INTO llm_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                              (key, value, len(value), now, now))
+            self.entries += 1
+            self.bytes += len(value)
+            self.evict()
+
+    def delete(self, key: str):
+        row = self.conn.execute("DELETE FROM llm_cache WHERE key = ? RETURNING size", (key,)).fetchone()
+        if row is not None:
+            self.entries -= 1
+            self.bytes -= row[0]
+
+    def evict(self):
+        over_entries = self.max_entries is not None and self.entries > self.max_entries
+        over_bytes = self.max_bytes is not None and self.bytes > self.max_bytes
+        if not over_entries and not over_bytes:
+            return
+        # 一次淘汰超出部分再加 10%，不必每次写入都淘汰
+        count = max(1, (self.entries - (self.max_entries or self.entries)) + self.entries // 10)
+        self.conn.execute("DELETE FROM llm_cache WHERE key IN "
+                          "(SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)", (count,))
+        entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        self.evicted += self.entries - entries
+        self.entries, self.bytes = entries, size
+        logger.debug(f"llm cache evicted {count} entries, {self.entries} entries, {self.bytes} bytes left")
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            self.evict()
+
+    def clear(self, **kwargs: Any):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.entries, self.bytes = 0, 0
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
@@ -0,0 +1,115 @@
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from loguru import logger
+
+
+class ThreadBusy(TimeoutError):
+    """
+    等待会话锁超时：同一会话的上一轮对话还没有结束
+    """
+
+
+class LocalThreadLock:
+    """
+    进程内的会话锁，同一个 thread_id 的多轮对话依次执行，只适用于单个 worker
+    """
+    def __init__(self):
+        # thread_id -> (锁, 正在使用或等待该锁的请求数)
+        self.locks: dict[str, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str):
+        entry = self.locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[thread_id]
+
+    def stats(self) -> dict:
+        return {"threads": len(self.locks)}
+
+
+class RedisThreadLock:
+    """
+    基于 Redis 的分布式会话锁，多个 worker 和节点上同一个 thread_id 的多轮对话依次执行
+        timeout: 锁的租期（秒），持有锁期间每 timeout / 3 秒续期一次，worker 崩溃后锁在 timeout 秒内自动释放
+        wait:    等待同一会话上一轮对话结束的最长时间（秒），超时抛出 ThreadBusy，None 表示一直等待
+    """
+    def __init__(self, client = None, url: str = "redis://localhost:6379/0", prefix: str = "pipeline-agent",
+                 timeout: float = 30, wait: Optional[float] = 60, poll: float = 0.05):
+        if client is None:
+            from redis.asyncio import Redis
+            client = Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+        self.wait = wait
+        self.poll = poll
+        self.held = 0
+
+    def _key(self, thread_id: str) -> str:
+        return f"{self.prefix}:{{{thread_id}}}:lock"
+
+    async def acquire(self, key: str, token: str) -> bool:
+        deadline = None if self.wait is None else asyncio.get_running_loop().time() + self.wait
+        while not await self.client.set(key, token, nx=True, px=int(self.timeout * 1000)):
+            if deadline is not None and asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(self.poll)
+        return True
+
+    async def if_owner(self, key: str, token: str, command: str, *args) -> bool:
+        """
+        锁仍然属于 token 时执行 command（续期或者删除），使用 WATCH/MULTI 保证检查和执行之间锁没有被其他请求获得
+        """
+        from redis.exceptions import WatchError
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if (await pipe.get(key) or b"").decode() != token:
+                    return False
+                pipe.multi()
+                getattr(pipe, command)(key, *args)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str):
+        key, token = self._key(thread_id), uuid.uuid4().hex
+        if not await self.acquire(key, token):
+            raise ThreadBusy(f"thread {thread_id} is busy")
+
+        released = asyncio.Event()
+
+        async def renew():
+            while await self.if_owner(key, token, "pexpire", int(self.timeout * 1000)):
+                try:
+                    await asyncio.wait_for(released.wait(), self.timeout / 3)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            logger.warning(f"lost lock of thread {thread_id}")
+
+        self.held += 1
+        renewal = asyncio.create_task(renew())
+        try:
+            yield
+        finally:
+            self.held -= 1
+            # 等待续期结束后再删除锁：续期的 WATCH/MULTI 与删除同时执行时删除会失败，
+            # 而 cancel 可能在客户端内部被吞掉，只取消任务时续期会一直进行下去
+            released.set()
+            await renewal
+            await self.if_owner(key, token, "delete")
+
+    def stats(self) -> dict:
+        return {"threads": self.held}
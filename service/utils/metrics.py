@@ -0,0 +1,192 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphInterrupt
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# LLM 调用和整个流式响应可能持续几十秒
+LONG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    通过 LangChain 回调记录图节点和 LLM 调用的耗时，随 config["callbacks"] 传给图，子图和 LLM 调用自动继承
+        1. 节点：run 的名称与 metadata 中的 langgraph_node 相同（chat, pipeline, update_chat_state, 各个 PipelineTaskAction
+           和 AnalysisWorkflowStages 节点等），节点内部的 prompt、chain 等 runnable 不单独记录
+        2. 节点抛出 GraphInterrupt 时计为 interrupt，其他异常计为 error
+        3. LLM：按模型名称（ls_model_name）记录调用耗时、第一个 chunk 的延迟、token 数量和每秒生成的 token 数，
+           后端没有返回 usage 时按流式输出的 chunk 数量计算
+    run_inline 为 True，回调在当前协程中直接执行，不经过线程池
+    """
+    run_inline = True
+
+    def __init__(self, metrics: "ServiceMetrics"):
+        self.metrics = metrics
+        # run_id -> (节点名称, 开始时间)
+        self.nodes: dict[UUID, tuple[str, float]] = {}
+        # run_id -> [模型名称, 开始时间, 第一个 chunk 的时间, chunk 数量]
+        self.llm_runs: dict[UUID, list] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       metadata: Optional[dict] = None, **kwargs: Any):
+        name = kwargs.get("name")
+        # 与节点同名的 RunnableLambda（例如 chat）的父 run 就是节点本身，不重复记录
+        if metadata and name is not None and name == metadata.get("langgraph_node") and parent_run_id not in self.nodes:
+            self.nodes[run_id] = (name, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        node = self.nodes.pop(run_id, None)
+        if node is not None:
+            self.metrics.node_seconds.labels(node[0]).observe(time.perf_counter() - node[1])
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        node = self.nodes.pop(run_id, None)
+        if node is None:
+            return
+        name, start = node
+        self.metrics.node_seconds.labels(name).observe(time.perf_counter() - start)
+        if isinstance(error, GraphInterrupt):
+            self.metrics.interrupts.labels(name).inc()
+        else:
+            self.metrics.node_errors.labels(name).inc()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs: Any):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self.llm_runs[run_id] = [model, time.perf_counter(), None, 0]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        run = self.llm_runs.get(run_id)
+        if run is not None:
+            if run[2] is None:
+                run[2] = time.perf_counter()
+                self.metrics.llm_first_chunk_seconds.labels(run[0]).observe(run[2] - run[1])
+            run[3] += 1
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        run = self.llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        model, start, _, chunks = run
+        seconds = time.perf_counter() - start
+        self.metrics.llm_seconds.labels(model).observe(seconds)
+
+        usage = None
+        if response.generations and response.generations[0]:
+            usage = getattr(getattr(response.generations[0][0], "message", None), "usage_metadata", None)
+        output_tokens = usage["output_tokens"] if usage else chunks
+        if usage:
+            self.metrics.llm_tokens.labels(model, "input").inc(usage["input_tokens"])
+        self.metrics.llm_tokens.labels(model, "output").inc(output_tokens)
+        if output_tokens and seconds > 0:
+            self.metrics.llm_tokens_per_second.labels(model).observe(output_tokens / seconds)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        run = self.llm_runs.pop(run_id, None)
+        if run is not None:
+            self.metrics.llm_seconds.labels(run[0]).observe(time.perf_counter() - run[1])
+            self.metrics.llm_errors.labels(run[0]).inc()
+
+
+class ServiceMetrics:
+    """
+    服务的 Prometheus 指标，/metrics 返回 render() 的内容
+        节点:   pipeline_agent_node_seconds{node}, pipeline_agent_node_errors_total{node}, pipeline_agent_interrupts_total{node}
+        LLM:    pipeline_agent_llm_seconds{model}, pipeline_agent_llm_first_chunk_seconds{model},
+                pipeline_agent_llm_tokens_total{model,type}, pipeline_agent_llm_tokens_per_second{model},
+                pipeline_agent_llm_errors_total{model}
+        流式:   pipeline_agent_stream_first_chunk_seconds, pipeline_agent_stream_seconds{status}
+        会话:   pipeline_agent_sessions_in_flight
+        准入:   pipeline_agent_admission_in_flight, pipeline_agent_admission_queue_depth,
+                pipeline_agent_admission_wait_seconds, pipeline_agent_admission_rejected_total{reason}
+                （register_admission 之后才更新）
+        缓存:   pipeline_agent_llm_cache_hits_total{tag}, pipeline_agent_llm_cache_misses_total{tag},
+                pipeline_agent_llm_cache_evictions_total, pipeline_agent_llm_cache_entries, pipeline_agent_llm_cache_bytes
+                （register_cache 之后才有）
+    每个实例使用独立的 registry；uvicorn --workers 启动多个进程时每个 worker 分别统计
+    """
+    def __init__(self, namespace: str = "pipeline_agent"):
+        self.registry = CollectorRegistry()
+        kwargs = {"namespace": namespace, "registry": self.registry}
+
+        self.node_seconds = Histogram("node_seconds", "LangGraph node latency", ["node"], **kwargs)
+        self.node_errors = Counter("node_errors", "LangGraph node failures", ["node"], **kwargs)
+        self.interrupts = Counter("interrupts", "Interrupts raised by LangGraph nodes", ["node"], **kwargs)
+
+        self.llm_seconds = Histogram("llm_seconds", "LLM call latency", ["model"], buckets=LONG_BUCKETS, **kwargs)
+        self.llm_first_chunk_seconds = Histogram("llm_first_chunk_seconds", "Time to the first streamed chunk of an LLM call",
+                                                 ["model"], buckets=LONG_BUCKETS, **kwargs)
+        self.llm_tokens = Counter("llm_tokens", "LLM tokens", ["model", "type"], **kwargs)
+        self.llm_tokens_per_second = Histogram("llm_tokens_per_second", "LLM output tokens per second",
+                                               ["model"], buckets=RATE_BUCKETS, **kwargs)
+        self.llm_errors = Counter("llm_errors", "LLM call failures", ["model"], **kwargs)
+
+        self.stream_first_chunk_seconds = Histogram("stream_first_chunk_seconds",
+                                                    "Time from the request to the first content chunk of a stream",
+                                                    buckets=LONG_BUCKETS, **kwargs)
+        self.stream_seconds = Histogram("stream_seconds", "Duration of streamed responses", ["status"],
+                                        buckets=LONG_BUCKETS, **kwargs)
+        self.sessions_in_flight = Gauge("sessions_in_flight", "Chat turns being executed", **kwargs)
+
+        self.admission_in_flight = Gauge("admission_in_flight", "Graph runs admitted and not yet released", **kwargs)
+        self.admission_queue_depth = Gauge("admission_queue_depth", "Requests waiting for admission", **kwargs)
+        self.admission_wait_seconds = Histogram("admission_wait_seconds", "Time admitted requests waited in the queue",
+                                                buckets=LONG_BUCKETS, **kwargs)
+        self.admission_rejected = Counter("admission_rejected", "Requests rejected by admission control",
+                                          ["reason"], **kwargs)
+
+        self.namespace = namespace
+        self.callback = MetricsCallbackHandler(self)
+
+    def register_cache(self, cache):
+        """
+        导出 LLM 回复缓存（SQLiteLLMCache）的命中和淘汰次数，在抓取时读取 cache.stats()
+        """
+        self.registry.register(CacheCollector(cache, self.namespace))
+
+    def register_admission(self, admission):
+        """
+        导出准入控制（AdmissionController）的状态：执行数和队列长度在抓取时读取，等待时间和拒绝次数由 admission 记录
+        """
+        self.admission_in_flight.set_function(lambda: admission.running)
+        self.admission_queue_depth.set_function(lambda: admission.waiting)
+        admission.metrics = self
+
+    @contextmanager
+    def session(self):
+        """
+        一轮对话的图执行期间计入 sessions_in_flight
+        """
+        self.sessions_in_flight.inc()
+        try:
+            yield
+        finally:
+            self.sessions_in_flight.dec()
+
+    def render(self) -> tuple[bytes, str]:
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+
+class CacheCollector:
+    """
+    LLM 回复缓存的计数由缓存自己维护，抓取 /metrics 时转换为 Prometheus 指标
+    """
+    def __init__(self, cache, namespace: str = "pipeline_agent"):
+        self.cache = cache
+        self.prefix = f"{namespace}_llm_cache"
+
+    def collect(self):
+        stats = self.cache.stats()
+        for name, documentation in (("hits", "LLM cache hits"), ("misses", "LLM cache misses")):
+            family = CounterMetricFamily(f"{self.prefix}_{name}", documentation, labels=["tag"])
+            for tag, value in stats[name].items():
+                family.add_metric([tag], value)
+            yield family
+        yield CounterMetricFamily(f"{self.prefix}_evictions", "LLM cache entries evicted or expired",
+                                  value=stats["evicted"] + stats["expired"])
+        yield GaugeMetricFamily(f"{self.prefix}_entries", "LLM cache entries", value=stats["entries"])
+        yield GaugeMetricFamily(f"{self.prefix}_bytes", "LLM cache size in bytes", value=stats["bytes"])
@@ -0,0 +1,132 @@
+import enum
+from typing import Any
+
+import ormsgpack
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage, ChatMessage, ChatMessageChunk,
+                                     FunctionMessage, FunctionMessageChunk, HumanMessage, HumanMessageChunk,
+                                     RemoveMessage, SystemMessage, SystemMessageChunk, ToolMessage, ToolMessageChunk)
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from service.chat.constants import AnalysisWorkflowStages, PipelineStatus, PipelineTaskAction, PipelineType
+
+EXT_MESSAGE = 1
+EXT_ENUM = 2
+EXT_TUPLE = 3
+EXT_DICT = 4
+
+MESSAGE_TYPES: dict[str, type[BaseMessage]] = {
+    cls.model_fields["type"].default: cls
+        for cls in (AIMessage, AIMessageChunk, ChatMessage, ChatMessageChunk, FunctionMessage, FunctionMessageChunk,
+                    HumanMessage, HumanMessageChunk, RemoveMessage, SystemMessage, SystemMessageChunk,
+                    ToolMessage, ToolMessageChunk)
+}
+# 所有消息共有的字段，按固定顺序写入，其余字段（tool_calls, tool_call_id 等）按字段名写入
+BASE_FIELDS = ("content", "id", "name", "additional_kwargs", "response_metadata")
+EXTRA_FIELDS: dict[type, tuple[str, ...]] = {
+    cls: tuple(f for f in cls.model_fields if f not in BASE_FIELDS and f != "type") for cls in MESSAGE_TYPES.values()
+}
+
+# 按 [模块, 类名, 值] 写入的枚举；读取时只在这里查找类，不导入 checkpoint 中记录的任意模块，
+# 其他枚举交给 JsonPlusSerializer（受 allowed_objects 限制）
+ENUM_TYPES: dict[tuple[str, str], type[enum.Enum]] = {}
+
+
+def register_enum(cls: type[enum.Enum]) -> type[enum.Enum]:
+    ENUM_TYPES[(cls.__module__, cls.__qualname__)] = cls
+    return cls
+
+
+for _cls in (AnalysisWorkflowStages, PipelineStatus, PipelineTaskAction, PipelineType):
+    register_enum(_cls)
+
+# 字符串子类（str 枚举等）、tuple 和 datetime 等类型交给 default 处理，不被 ormsgpack 转换成普通类型
+OPTIONS = (ormsgpack.OPT_PASSTHROUGH_ENUM | ormsgpack.OPT_PASSTHROUGH_TUPLE | ormsgpack.OPT_PASSTHROUGH_SUBCLASS |
+           ormsgpack.OPT_PASSTHROUGH_DATETIME | ormsgpack.OPT_PASSTHROUGH_UUID | ormsgpack.OPT_PASSTHROUGH_DATACLASS |
+           ormsgpack.OPT_PASSTHROUGH_BIG_INT)
+
+
+def pack(obj: Any) -> bytes:
+    try:
+        return ormsgpack.packb(obj, default=default, option=OPTIONS)
+    except TypeError:
+        # key 不是字符串的 dict（例如 PipelineState.args 中以 AnalysisWorkflowStages 为 key 的各阶段参数）
+        return ormsgpack.packb(prepare(obj), default=default, option=OPTIONS)
+
+
+def prepare(obj: Any) -> Any:
+    if type(obj) is dict:
+        if all(type(k) is str for k in obj):
+            return {k: prepare(v) for k, v in obj.items()}
+        return ormsgpack.Ext(EXT_DICT, pack([[k, v] for k, v in obj.items()]))
+    if type(obj) is list:
+        return [prepare(v) for v in obj]
+    return obj
+
+
+def default(obj: Any) -> ormsgpack.Ext:
+    cls = type(obj)
+    if cls in EXTRA_FIELDS:
+        fields = [obj.type, obj.content, obj.id, obj.name, obj.additional_kwargs, obj.response_metadata]
+        extra = {f: getattr(obj, f) for f in EXTRA_FIELDS[cls]}
+        return ormsgpack.Ext(EXT_MESSAGE, pack(fields + [extra] if extra else fields))
+    if isinstance(obj, enum.Enum) and ENUM_TYPES.get((cls.__module__, cls.__qualname__)) is cls:
+        return ormsgpack.Ext(EXT_ENUM, pack([cls.__module__, cls.__qualname__, obj.value]))
+    if cls is tuple:
+        return ormsgpack.Ext(EXT_TUPLE, pack(list(obj)))
+    raise TypeError(f"Unsupported type: {cls}")
+
+
+def ext_hook(code: int, data: bytes) -> Any:
+    value = ormsgpack.unpackb(data, ext_hook=ext_hook)
+    if code == EXT_MESSAGE:
+        type_, content, id_, name, additional_kwargs, response_metadata, *extra = value
+        # 字段在写入时已经校验过，直接构造，不再经过 pydantic 校验
+        return MESSAGE_TYPES[type_].model_construct(content=content, id=id_, name=name,
+                                                    additional_kwargs=additional_kwargs,
+                                                    response_metadata=response_metadata,
+                                                    **(extra[0] if extra else {}))
+    if code == EXT_ENUM:
+        module, qualname, enum_value = value
+        cls = ENUM_TYPES.get((module, qualname))
+        if cls is None:
+            raise ValueError(f"Unregistered enum type: {module}.{qualname}")
+        return cls(enum_value)
+    if code == EXT_TUPLE:
+        return tuple(value)
+    if code == EXT_DICT:
+        return {k: v for k, v in value}
+    raise ValueError(f"Unknown msgpack extension type: {code}")
+
+
+class TypedMsgpackSerializer(SerializerProtocol):
+    """
+    checkpoint 的 msgpack 序列化，按固定的 schema 写入消息和枚举，比默认的 JsonPlusSerializer 更快、更小
+        1. 消息写为 [type, content, id, name, additional_kwargs, response_metadata, 其余字段]，
+           不写类路径，读取时用 model_construct 构造，不再经过 pydantic 校验
+        2. 注册的枚举（PipelineTaskAction, AnalysisWorkflowStages 等，见 register_enum）、tuple 和以枚举为 key 的 dict 读取后保持原来的类型
+        3. 其他类型（Send, Interrupt, datetime, pydantic 模型等）交给 JsonPlusSerializer，
+           已有的 checkpoint 也由 JsonPlusSerializer 读取
+    """
+    type_name = "typed-msgpack"
+
+    def __init__(self, fallback: SerializerProtocol = None):
+        self.fallback = fallback or JsonPlusSerializer()
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.fallback.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.fallback.loads(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        try:
+            return self.type_name, pack(obj)
+        except TypeError:
+            return self.fallback.dumps_typed(obj)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, blob = data
+        if type_ == self.type_name:
+            return ormsgpack.unpackb(blob, ext_hook=ext_hook)
+        return self.fallback.loads_typed(data)
@@ -0,0 +1,155 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+
+def default_sizeof(key, value) -> int:
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class SessionStore(MutableMapping):
+    """
+    有容量上限的会话字典，用于保存按 thread_id 索引的会话数据，例如 interrupted_threads
+        max_size: 最多保留的会话数量，超过后淘汰最久未访问的会话（LRU），None 表示不限制
+        ttl:      会话空闲超过 ttl 秒后淘汰，None 表示不按时间淘汰
+        on_evict: 会话被淘汰时的回调 on_evict(key, value)，例如把冷会话写入磁盘
+        sizeof:   估算每个会话占用的字节数 sizeof(key, value)
+    读取和写入都会刷新会话的访问时间，并顺带清理过期的会话
+    """
+    def __init__(self,
+                 max_size: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+                 sizeof: Callable[[Hashable, Any], int] = default_sizeof):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.sizeof = sizeof
+        self.lock = threading.RLock()
+        self.data: OrderedDict[Hashable, tuple[Any, float, int]] = OrderedDict()
+        self.bytes = 0
+        self.evicted = 0
+
+    def __getitem__(self, key):
+        with self.lock:
+            self.evict_expired()
+            value, _, size = self.data[key]
+            self.data[key] = (value, time.monotonic(), size)
+            self.data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.data:
+                self.bytes -= self.data.pop(key)[2]
+            size = self.sizeof(key, value)
+            self.data[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            self.evict_expired()
+            while self.max_size is not None and len(self.data) > self.max_size:
+                self.evict(next(iter(self.data)))
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.bytes -= self.data.pop(key)[2]
+
+    def __contains__(self, key):
+        with self.lock:
+            self.evict_expired()
+            return key in self.data
+
+    def __iter__(self) -> Iterator:
+        with self.lock:
+            return iter(list(self.data))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def evict(self, key):
+        with self.lock:
+            value, _, size = self.data.pop(key)
+            self.bytes -= size
+            self.evicted += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def evict_expired(self):
+        if self.ttl is None:
+            return
+        deadline = time.monotonic() - self.ttl
+        with self.lock:
+            # OrderedDict 按访问时间排序，最久未访问的会话在最前面
+            expired = []
+            for key, (_, accessed, _) in self.data.items():
+                if accessed > deadline:
+                    break
+                expired.append(key)
+            for key in expired:
+                self.evict(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "count": len(self.data),
+                "bytes": self.bytes,
+                "evicted": self.evicted,
+            }
+
+
+class RedisSessionStore(MutableMapping):
+    """
+    保存在 Redis 中的会话字典，与 SessionStore 的接口相同，多个 worker 和节点共享，例如 interrupted_threads
+        ttl: 会话空闲超过 ttl 秒后由 Redis 删除，读取和写入都会刷新过期时间，None 表示不过期
+    pop 使用 GETDEL，同一个中断只会被一个 worker 取出并恢复
+    """
+    def __init__(self, client = None, url: str = "redis://localhost:6379/0", prefix: str = "pipeline-agent",
+                 name: str = "interrupt", ttl: Optional[float] = None):
+        if client is None:
+            from redis import Redis
+            client = Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.name = name
+        self.ttl = int(ttl) if ttl is not None else None
+
+    def _key(self, key) -> str:
+        return f"{self.prefix}:{{{key}}}:{self.name}"
+
+    def __getitem__(self, key):
+        value = self.client.getex(self._key(key), ex=self.ttl) if self.ttl else self.client.get(self._key(key))
+        if value is None:
+            raise KeyError(key)
+        return value.decode()
+
+    def __setitem__(self, key, value):
+        self.client.set(self._key(key), value, ex=self.ttl)
+
+    def __delitem__(self, key):
+        if not self.client.delete(self._key(key)):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(self.client.exists(self._key(key)))
+
+    def pop(self, key, *default):
+        value = self.client.getdel(self._key(key))
+        if value is not None:
+            return value.decode()
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator:
+        head, tail = f"{self.prefix}:{{", f"}}:{self.name}"
+        return iter([key.decode()[len(head):-len(tail)]
+                         for key in self.client.scan_iter(match=f"{self.prefix}:{{*}}:{self.name}")])
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def stats(self) -> dict:
+        # 过期的会话由 Redis 删除，这里只统计会话数量
+        return {"count": len(self)}
@@ -0,0 +1,45 @@
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+class StartupProfile:
+    """
+    记录服务启动各阶段的耗时，start 为导入 main 时记录的 time.perf_counter()
+    """
+    def __init__(self, start: Optional[float] = None):
+        self.start = start if start is not None else time.perf_counter()
+        self.last = self.start
+        self.stages: dict[str, float] = {}
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages[stage] = now - self.last
+        self.last = now
+
+    def done(self):
+        logger.info("startup: " + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in self.stages.items())
+                    + f", total {(self.last - self.start) * 1000:.0f} ms")
+
+    def stats(self) -> dict:
+        return {
+            "stages_ms": {stage: seconds * 1000 for stage, seconds in self.stages.items()},
+            "total_ms": (self.last - self.start) * 1000,
+        }
+
+
+class LazyASGIApp:
+    """
+    在第一次请求时才创建的 ASGI 应用，用于很少使用、导入开销大的路由（例如 langserve）
+    """
+    def __init__(self, build: Callable[[], Callable]):
+        self.build = build
+        self.app = None
+
+    async def __call__(self, scope, receive, send):
+        if self.app is None:
+            start = time.perf_counter()
+            self.app = self.build()
+            logger.info(f"lazy app {self.build.__name__} built in {(time.perf_counter() - start) * 1000:.0f} ms")
+        await self.app(scope, receive, send)
@@ -0,0 +1,253 @@
+import math
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+from uuid import UUID
+
+from loguru import logger
+from langchain_core.callbacks import BaseCallbackHandler
+
+from service.chat.pipeline.examples import estimate_tokens
+from service.utils.admission import AdmissionRejected
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def empty_usage() -> dict:
+    return dict.fromkeys(USAGE_FIELDS, 0)
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    一次图执行中所有 LLM 调用的 token 用量，每个请求使用一个新的实例，随 config["callbacks"] 传给图，
+    子图和各个节点中的 LLM 调用自动继承
+    优先使用模型返回的 usage_metadata，后端没有返回 usage 时按 estimate_tokens 估算，estimated 为 True
+    """
+    run_inline = True
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self.estimated = False
+        # run_id -> 输入的消息，只在没有 usage_metadata 时用于估算
+        self.prompts: dict[UUID, list] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        self.prompts[run_id] = messages
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        messages = self.prompts.pop(run_id, None)
+        self.calls += 1
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if usage:
+            self.prompt_tokens += usage["input_tokens"]
+            self.completion_tokens += usage["output_tokens"]
+            return
+
+        self.estimated = True
+        if messages:
+            self.prompt_tokens += sum(estimate_tokens(str(m.content)) for m in messages[0])
+        if generation is not None:
+            self.completion_tokens += estimate_tokens(generation.text)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self.prompts.pop(run_id, None)
+
+    def usage(self) -> dict:
+        """
+        OpenAI 兼容的 usage
+        """
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
+
+
+class TokenBudget:
+    """
+    按用户和会话统计 token 用量，并限制每个用户在固定时间窗口内的请求数和 token 数，单个用户不能长时间占满 GPU
+        window:       时间窗口（秒）
+        max_requests: 每个用户每个窗口内的请求数上限，None 表示不限制
+        max_tokens:   每个用户每个窗口内的 token 数上限（prompt + completion），None 表示不限制；
+                      在请求开始前检查，已经开始的对话不会被中断，用户最多超出一轮对话的用量
+        max_chats:    内存中保留用量的会话数量，超过后淘汰最久未访问的会话
+        max_users:    内存中保留窗口计数和累计用量的用户数量，超过后淘汰最久未访问的用户（没有用户信息时按会话统计，
+                      用户数随会话增长）
+    超过上限时 acquire 抛出 AdmissionRejected(429)，Retry-After 为当前窗口剩余的秒数；
+    acquire 之后请求被准入控制拒绝时调用 release 退回计入的请求数
+    只适用于单个 worker，多个 worker 使用 RedisTokenBudget
+    """
+    def __init__(self,
+                 window: float = 3600,
+                 max_requests: Optional[int] = None,
+                 max_tokens: Optional[int] = None,
+                 max_chats: Optional[int] = 10000,
+                 max_users: Optional[int] = 10000):
+        self.window = window
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.max_chats = max_chats
+        self.max_users = max_users
+
+        # user -> [窗口编号, 窗口内的请求数, 窗口内的 token 数]
+        self.windows: OrderedDict[str, list] = OrderedDict()
+        # user / chat_id -> 累计的 usage 和请求数
+        self.users: OrderedDict[str, dict] = OrderedDict()
+        self.chats: OrderedDict[str, dict] = OrderedDict()
+        self.rejected = defaultdict(int)
+        self.total_tokens = 0
+
+    @staticmethod
+    def touch(store: OrderedDict, key: str, default, max_size: Optional[int]):
+        """
+        返回 store[key]（不存在时为 default），并移到最近访问的位置，超过 max_size 时淘汰最久未访问的条目
+        """
+        value = store.pop(key, None)
+        store[key] = value = default if value is None else value
+        if max_size is not None and len(store) > max_size:
+            store.popitem(last=False)
+        return value
+
+    def current(self) -> tuple[int, int]:
+        """
+        返回 (当前窗口的编号, 窗口剩余的秒数)
+        """
+        now = time.time()
+        index = int(now // self.window)
+        return index, max(1, math.ceil((index + 1) * self.window - now))
+
+    def reject(self, user: str, reason: str, retry_after: int) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        logger.warning(f"usage budget exceeded ({reason}): user {user}")
+        return AdmissionRejected(429, retry_after, reason)
+
+    async def acquire(self, user: str):
+        index, retry_after = self.current()
+        window = self.touch(self.windows, user, [index, 0, 0], self.max_users)
+        if window[0] != index:
+            window[:] = [index, 0, 0]
+        if self.max_tokens is not None and window[2] >= self.max_tokens:
+            raise self.reject(user, "token_budget", retry_after)
+        if self.max_requests is not None and window[1] >= self.max_requests:
+            raise self.reject(user, "request_budget", retry_after)
+        window[1] += 1
+
+    async def release(self, user: str):
+        index, _ = self.current()
+        window = self.windows.get(user)
+        if window is not None and window[0] == index and window[1] > 0:
+            window[1] -= 1
+
+    async def record(self, user: str, chat_id: Optional[str], usage: dict):
+        index, _ = self.current()
+        window = self.windows.get(user)
+        if window is not None and window[0] == index:
+            window[2] += usage["total_tokens"]
+
+        self.total_tokens += usage["total_tokens"]
+        totals = [self.touch(self.users, user, {**empty_usage(), "requests": 0}, self.max_users)]
+        if chat_id is not None:
+            totals.append(self.touch(self.chats, chat_id, {**empty_usage(), "requests": 0}, self.max_chats))
+        for total in totals:
+            total["requests"] += 1
+            for field in USAGE_FIELDS:
+                total[field] += usage[field]
+
+    async def usage(self, user: Optional[str] = None, chat_id: Optional[str] = None) -> dict:
+        result = {}
+        if user is not None:
+            index, retry_after = self.current()
+            window = self.windows.get(user)
+            requests, tokens = (window[1], window[2]) if window is not None and window[0] == index else (0, 0)
+            result["user"] = {**self.users.get(user, {**empty_usage(), "requests": 0}),
+                              "window": {"requests": requests, "tokens": tokens, "reset_seconds": retry_after,
+                                         "max_requests": self.max_requests, "max_tokens": self.max_tokens}}
+        if chat_id is not None:
+            result["chat"] = self.chats.get(chat_id, {**empty_usage(), "requests": 0})
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.users),
+            "chats": len(self.chats),
+            "total_tokens": self.total_tokens,
+            "rejected": dict(self.rejected),
+        }
+
+
+class RedisTokenBudget(TokenBudget):
+    """
+    用量和窗口计数保存在 Redis 中，多个 worker 和节点共享同一个预算
+        {prefix}:usage:window:{user}:{窗口编号}  窗口内的请求数和 token 数，窗口结束后过期
+        {prefix}:usage:user:{user}               用户累计的 usage
+        {prefix}:usage:chat:{chat_id}            会话累计的 usage，ttl 秒后过期，None 表示不过期
+    client 为 redis.asyncio.Redis
+    """
+    def __init__(self, client, prefix: str = "pipeline-agent", ttl: Optional[float] = None, **kwargs):
+        super().__init__(max_chats=None, max_users=None, **kwargs)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.recorded = 0
+
+    def _window_key(self, user: str, index: int) -> str:
+        return f"{self.prefix}:usage:window:{user}:{index}"
+
+    async def acquire(self, user: str):
+        index, retry_after = self.current()
+        key = self._window_key(user, index)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, "requests", 1)
+            pipe.hget(key, "tokens")
+            pipe.expire(key, int(self.window) + 60)
+            requests, tokens, _ = await pipe.execute()
+
+        reason = None
+        if self.max_tokens is not None and int(tokens or 0) >= self.max_tokens:
+            reason = "token_budget"
+        elif self.max_requests is not None and requests > self.max_requests:
+            reason = "request_budget"
+        if reason is not None:
+            # 被拒绝的请求不计入窗口内的请求数
+            await self.client.hincrby(key, "requests", -1)
+            raise self.reject(user, reason, retry_after)
+
+    async def release(self, user: str):
+        index, _ = self.current()
+        await self.client.hincrby(self._window_key(user, index), "requests", -1)
+
+    async def record(self, user: str, chat_id: Optional[str], usage: dict):
+        index, _ = self.current()
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(self._window_key(user, index), "tokens", usage["total_tokens"])
+            for key in [f"{self.prefix}:usage:user:{user}"] + ([f"{self.prefix}:usage:chat:{chat_id}"] if chat_id else []):
+                pipe.hincrby(key, "requests", 1)
+                for field in USAGE_FIELDS:
+                    pipe.hincrby(key, field, usage[field])
+            if chat_id and self.ttl is not None:
+                pipe.expire(f"{self.prefix}:usage:chat:{chat_id}", int(self.ttl))
+            await pipe.execute()
+        self.recorded += usage["total_tokens"]
+
+    async def usage(self, user: Optional[str] = None, chat_id: Optional[str] = None) -> dict:
+        def decode(values: dict) -> dict:
+            return {**empty_usage(), "requests": 0, **{k.decode(): int(v) for k, v in values.items()}}
+
+        result = {}
+        if user is not None:
+            index, retry_after = self.current()
+            window = await self.client.hgetall(self._window_key(user, index))
+            result["user"] = {**decode(await self.client.hgetall(f"{self.prefix}:usage:user:{user}")),
+                              "window": {"requests": int(window.get(b"requests", 0)), "tokens": int(window.get(b"tokens", 0)),
+                                         "reset_seconds": retry_after,
+                                         "max_requests": self.max_requests, "max_tokens": self.max_tokens}}
+        if chat_id is not None:
+            result["chat"] = decode(await self.client.hgetall(f"{self.prefix}:usage:chat:{chat_id}"))
+        return result
+
+    def stats(self) -> dict:
+        # 用户和会话的用量在 Redis 中，这里只统计当前 worker 记录的 token 数和拒绝的请求
+        return {"total_tokens": self.recorded, "rejected": dict(self.rejected)}
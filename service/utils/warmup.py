@@ -0,0 +1,121 @@
+import time
+import asyncio
+from typing import Optional
+
+from loguru import logger
+from langchain_core.messages import BaseMessage
+
+
+def limit_tokens(llm, max_tokens: int = 1):
+    """
+    返回只生成 max_tokens 个 token 的模型副本（ChatOllama 的 num_predict，ChatOpenAI 的 max_tokens），
+    副本与原模型共用同一个客户端和连接池；其他模型原样返回
+    """
+    for field in ("num_predict", "max_tokens"):
+        if field in type(llm).model_fields:
+            return llm.model_copy(update={field: max_tokens})
+    return llm
+
+
+class ModelWarmer:
+    """
+    启动时预热 LLM，并在服务空闲时保持模型常驻
+        1. 启动后在后台依次发送 prompts（DialogueProcessor 和 task_new 的系统提示与 few-shot 示例），每次只生成一个 token，
+           后端加载模型，并缓存这些静态前缀（ollama 的 KV cache，vLLM 的 prefix caching）；失败时每 retry_interval 秒重试
+        2. 预热完成后 ready 为 True，/ready 才返回 200，负载均衡不会把请求发给还没有加载模型的实例
+        3. 最近 keep_alive_interval 秒内没有请求（touch）时再发送一次第一个 prompt，
+           模型不会因为空闲被 ollama 卸载，前缀缓存和连接池中的连接也不会过期；None 表示不发送
+    """
+    def __init__(self,
+                 llm,
+                 prompts: list[list[BaseMessage]],
+                 timeout: Optional[float] = 120,
+                 retry_interval: float = 5,
+                 keep_alive_interval: Optional[float] = None):
+        self.llm = limit_tokens(llm)
+        self.prompts = prompts
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.keep_alive_interval = keep_alive_interval
+
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.last_active = time.monotonic()
+
+        self.attempts = 0
+        self.warmup_seconds: Optional[float] = None
+        self.pings = 0
+        self.failed_pings = 0
+        self.last_error: Optional[str] = None
+
+    def touch(self):
+        """
+        记录一次请求，keep-alive 只在空闲时发送
+        """
+        self.last_active = time.monotonic()
+
+    async def send(self, prompt: list[BaseMessage]):
+        await asyncio.wait_for(self.llm.ainvoke(prompt), self.timeout)
+
+    async def warm_up(self):
+        start = time.monotonic()
+        while True:
+            self.attempts += 1
+            try:
+                for prompt in self.prompts:
+                    await self.send(prompt)
+                break
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"model warm-up failed (attempt {self.attempts}), retry in {self.retry_interval}s: {self.last_error}")
+                await asyncio.sleep(self.retry_interval)
+
+        self.warmup_seconds = time.monotonic() - start
+        self.last_error = None
+        self.touch()
+        self.ready.set()
+        logger.info(f"model warmed up in {self.warmup_seconds * 1000:.0f} ms, {len(self.prompts)} prompts")
+
+    async def keep_alive(self):
+        while True:
+            idle = time.monotonic() - self.last_active
+            if idle < self.keep_alive_interval:
+                await asyncio.sleep(self.keep_alive_interval - idle)
+                continue
+            try:
+                await self.send(self.prompts[0])
+                self.pings += 1
+            except Exception as e:
+                self.failed_pings += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"model keep-alive failed: {self.last_error}")
+            self.touch()
+
+    async def run(self):
+        await self.warm_up()
+        if self.keep_alive_interval is not None and self.prompts:
+            await self.keep_alive()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready.is_set(),
+            "attempts": self.attempts,
+            "warmup_ms": self.warmup_seconds * 1000 if self.warmup_seconds is not None else None,
+            "idle_seconds": time.monotonic() - self.last_active,
+            "keep_alive_pings": self.pings,
+            "failed_pings": self.failed_pings,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from service.utils.admission import AdmissionController, AdmissionRejected
+
+
+def test_queue_full_and_release():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_queue=1)
+        first = await admission.acquire("alice")
+        waiting = asyncio.create_task(admission.acquire("bob"))
+        await asyncio.sleep(0)
+        assert admission.stats()["queue_depth"] == 1
+
+        with pytest.raises(AdmissionRejected) as e:
+            await admission.acquire("carol")
+        assert e.value.status_code == 503 and e.value.retry_after >= 1
+
+        await first.release()
+        second = await waiting
+        assert admission.stats()["running"] == 1
+        await second.release()
+        await second.release()
+        assert admission.stats()["running"] == 0
+
+    asyncio.run(run())
+
+
+def test_per_user_limit():
+    async def run():
+        admission = AdmissionController(max_per_user=1)
+        ticket = await admission.acquire("alice")
+        queued = asyncio.create_task(admission.acquire("alice"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as e:
+            await admission.acquire("alice")
+        assert e.value.status_code == 429
+        # 其他用户不受影响
+        await (await admission.acquire("bob")).release()
+
+        await ticket.release()
+        await (await queued).release()
+        assert admission.stats()["rejected"] == {"user_limit": 1}
+
+    asyncio.run(run())
+
+
+def test_queue_timeout():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, queue_timeout=0.05)
+        await admission.acquire("alice")
+        with pytest.raises(AdmissionRejected) as e:
+            await admission.acquire("bob")
+        assert e.value.status_code == 503 and e.value.reason == "queue_timeout"
+        assert admission.stats()["queue_depth"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,148 @@
+from typing import Optional, TypedDict
+
+import pytest
+from langgraph.types import interrupt, Command
+from langgraph.graph import StateGraph, START
+
+from service.utils.checkpoint import SQLiteSaver
+
+
+class State(TypedDict):
+    foo: str
+    human_value: Optional[str]
+
+
+def node(state: State):
+    answer = interrupt("what is your age?")
+    return {"human_value": answer}
+
+
+def build(path):
+    builder = StateGraph(State)
+    builder.add_node("node", node)
+    builder.add_edge(START, "node")
+    return builder.compile(checkpointer=SQLiteSaver(path))
+
+
+def test_interrupt_survives_restart(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    config = {"configurable": {"thread_id": "1"}}
+
+    graph = build(path)
+    graph.invoke({"foo": "abc"}, config)
+    assert graph.get_state(config).tasks[0].interrupts[0].value == "what is your age?"
+    graph.checkpointer.close()
+
+    # 重新打开数据库，恢复中断
+    graph = build(path)
+    assert graph.get_state(config).tasks[0].interrupts
+    assert graph.invoke(Command(resume="42"), config) == {"foo": "abc", "human_value": "42"}
+    assert len(list(graph.checkpointer.list(config))) == len(list(graph.get_state_history(config)))
+
+
+def test_delete_thread(tmp_path):
+    saver = SQLiteSaver(str(tmp_path / "checkpoints.sqlite"))
+    graph = build(saver.path)
+    config = {"configurable": {"thread_id": "2"}}
+    graph.invoke({"foo": "abc"}, config)
+    saver.delete_thread("2")
+    assert saver.get_tuple(config) is None
+
+
+def build_chat(saver):
+    from langchain_core.messages import AIMessage
+    from service.chat.states import ProcessorState
+
+    builder = StateGraph(ProcessorState)
+    builder.add_node("chat", lambda state: {"messages": [AIMessage(content=f"reply {len(state.messages)}")]})
+    builder.add_edge(START, "chat")
+    return builder.compile(checkpointer=saver)
+
+
+def test_messages_written_as_deltas(tmp_path):
+    from langchain_core.messages import HumanMessage, RemoveMessage
+    from service.utils.serde import TypedMsgpackSerializer
+
+    path = str(tmp_path / "checkpoints.sqlite")
+    config = {"configurable": {"thread_id": "3"}}
+    graph = build_chat(SQLiteSaver(path, serde=TypedMsgpackSerializer(), snapshot_every=4))
+    for i in range(6):
+        # 每轮写入两次：用户消息和回复
+        graph.invoke({"messages": [HumanMessage(content=f"user {i}")]}, config)
+    types = [t for t, in graph.checkpointer._execute("SELECT type FROM blobs WHERE channel = 'messages' ORDER BY version")]
+    # 每 4 次写入一次完整的消息列表
+    assert types == ["typed-msgpack", "delta", "delta", "delta"] * 3
+    expected = graph.get_state(config).values["messages"]
+    graph.checkpointer.close()
+
+    # 重新打开数据库，沿着版本链恢复消息，并在恢复的值后面继续写入增量
+    graph = build_chat(SQLiteSaver(path, serde=TypedMsgpackSerializer(), snapshot_every=4))
+    assert graph.get_state(config).values["messages"] == expected
+    graph.invoke({"messages": [HumanMessage(content="user 6")]}, config)
+    messages = graph.get_state(config).values["messages"]
+    assert messages[:-2] == expected and [m.content for m in messages[-2:]] == ["user 6", "reply 13"]
+    assert graph.checkpointer._execute(
+        "SELECT type FROM blobs WHERE channel = 'messages' ORDER BY version DESC LIMIT 1")[0][0] == "delta"
+
+    # 删除消息后前缀不成立，写入完整的值
+    graph.update_state(config, {"messages": [RemoveMessage(id=expected[0].id)]})
+    assert graph.checkpointer._execute(
+        "SELECT type FROM blobs WHERE channel = 'messages' ORDER BY version DESC LIMIT 1")[0][0] == "typed-msgpack"
+    assert graph.get_state(config).values["messages"][:-2] == expected[1:]
+
+
+def test_typed_msgpack_keeps_types():
+    from langchain_core.messages import AIMessage
+    from langgraph.types import Send
+    from service.chat.states import PipelineState
+    from service.chat.constants import PipelineTaskAction
+    from service.utils.serde import TypedMsgpackSerializer
+
+    serde = TypedMsgpackSerializer()
+    args = PipelineState(messages=[]).args
+    message = AIMessage(content="", id="1", tool_calls=[{"name": "f", "args": {"a": 1}, "id": "t"}])
+    for value in (args, PipelineTaskAction.NEW, [message], ("a", 1)):
+        type_, blob = serde.dumps_typed(value)
+        assert type_ == "typed-msgpack" and serde.loads_typed((type_, blob)) == value
+    # 以 AnalysisWorkflowStages 为 key 的阶段参数读取后仍是枚举
+    assert list(serde.loads_typed(serde.dumps_typed(args))) == list(args)
+    # 其他类型由 jsonplus 处理
+    assert serde.dumps_typed([Send("node", {})])[0] == "msgpack"
+
+
+def test_typed_msgpack_only_loads_registered_enums():
+    import enum
+    import ormsgpack
+    from service.utils.serde import EXT_ENUM, TypedMsgpackSerializer
+
+    serde = TypedMsgpackSerializer()
+    # 构造的 checkpoint 不能通过枚举调用任意函数
+    blob = ormsgpack.packb(ormsgpack.Ext(EXT_ENUM, ormsgpack.packb(["os", "getenv", "HOME"])))
+    with pytest.raises(ValueError):
+        serde.loads_typed(("typed-msgpack", blob))
+
+    # 没有注册的枚举交给 jsonplus
+    class Color(enum.Enum):
+        RED = 1
+    assert serde.dumps_typed(Color.RED)[0] == "msgpack"
+
+
+def test_deltas_do_not_keep_messages_alive():
+    import gc
+    import weakref
+    from langchain_core.messages import HumanMessage
+    from service.utils.checkpoint import ChannelDeltas
+    from service.utils.serde import TypedMsgpackSerializer
+
+    deltas = ChannelDeltas(TypedMsgpackSerializer(), snapshot_every=4)
+    messages = [HumanMessage(content=f"user {i}", id=str(i)) for i in range(3)]
+    assert deltas.dumps("1", "", "messages", "v1", messages)[0] == "typed-msgpack"
+    assert deltas.dumps("1", "", "messages", "v2", messages + [HumanMessage(content="user 3")])[0] == "delta"
+    assert deltas.last.stats()["bytes"] > 0
+
+    # 只记录弱引用，消息释放后写入完整的值
+    ref = weakref.ref(messages[0])
+    messages = [HumanMessage(content=m.content, id=m.id) for m in messages]
+    gc.collect()
+    assert ref() is None
+    assert deltas.dumps("1", "", "messages", "v3", messages)[0] == "typed-msgpack"
@@ -0,0 +1,55 @@
+from service.chat.classifier import IntentClassifier
+
+EXAMPLES = [
+    {"user": "We received some data, could you help with processing it ?", "assistant": "pipeline"},
+    {"user": "What are the symptoms of pneumonia in elderly patients?", "assistant": "medical"},
+    {"user": "Hello, how are you?", "assistant": "I am a knowledgeable AI agent"},
+]
+
+
+def test_confident_prediction():
+    classifier = IntentClassifier(EXAMPLES, k=1)
+    assert classifier.predict("we received some data, could you help processing it") == "pipeline"
+    assert classifier.predict("hello, how are you") == "I am a knowledgeable AI agent"
+    assert classifier.stats()["hits"] == 2
+
+
+def test_unknown_input_falls_back_to_llm(tmp_path):
+    log_file = str(tmp_path / "turns.jsonl")
+    classifier = IntentClassifier(EXAMPLES, log_file=log_file)
+    assert classifier.predict("run sarek on batch01") is None
+
+    classifier.record("run sarek on batch01", "pipeline", 0.5)
+    classifier.build_index()
+    assert classifier.stats()["misses"] == 1
+
+    # 记录的对话在重启后作为样本加载
+    restarted = IntentClassifier(EXAMPLES, k=1, log_file=log_file)
+    assert restarted.predict("run sarek on batch01") == "pipeline"
+
+
+def test_log_is_deduplicated_and_capped(tmp_path):
+    log_file = tmp_path / "turns.jsonl"
+    classifier = IntentClassifier(EXAMPLES, log_file=str(log_file), max_examples=4)
+    # 中断恢复时同一条输入会重复记录
+    classifier.record("run sarek on batch01", "pipeline", 0.5)
+    classifier.record("run sarek on batch01", "pipeline", 0.5)
+    assert len(log_file.read_text().splitlines()) == 1
+
+    for i in range(10):
+        classifier.record(f"is fever {i} a symptom of flu", "medical", 0.5)
+    assert len(classifier.texts) == 4
+    assert len(log_file.read_text().splitlines()) <= 2 * 4
+
+    # 重启时只加载最近的 max_examples 条，并重写文件
+    restarted = IntentClassifier(EXAMPLES, log_file=str(log_file), max_examples=4)
+    assert list(restarted.logged) == [f"is fever {i} a symptom of flu" for i in range(6, 10)]
+    assert len(log_file.read_text().splitlines()) == 4
+
+
+def test_log_is_disabled_by_default():
+    from service.utils.config import load_intent_classifier
+
+    # 日志中是用户的原始输入，需要在配置中显式启用
+    classifier = load_intent_classifier()
+    assert classifier.log_file is None and classifier.max_examples == 5000
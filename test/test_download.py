@@ -0,0 +1,196 @@
+import os
+import json
+import asyncio
+import hashlib
+
+import fakeredis
+import httpx
+import pytest
+
+from benchmark.file_server import file_app
+from service.tasks.download import Downloader, FileSource, HttpSource, RedisTransferBudget, TransferBudget, pwrite_all
+
+
+def write(path, size, seed):
+    data = (hashlib.sha256(seed.encode()).digest() * (size // 32 + 1))[:size]
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+class FlakySource(FileSource):
+    """
+    每个分段第一次读取 fail_after 字节后断开
+    """
+    def __init__(self, root, fail_after):
+        super().__init__(root, block_size=10_000)
+        self.fail_after = fail_after
+        self.failed = set()
+        self.served = 0
+
+    async def read(self, remote, start, end):
+        sent = 0
+        async for chunk in super().read(remote, start, end):
+            if (remote, end) not in self.failed and sent >= self.fail_after:
+                self.failed.add((remote, end))
+                raise ConnectionResetError("connection reset by peer")
+            sent += len(chunk)
+            self.served += len(chunk)
+            yield chunk
+
+
+class SlowSource(FileSource):
+    """
+    第一个分段立即失败，其他分段慢速读取；记录正在读取的分段数
+    """
+    def __init__(self, root):
+        super().__init__(root, block_size=1024)
+        self.active = 0
+
+    async def read(self, remote, start, end):
+        if start == 0:
+            raise ConnectionResetError("connection reset by peer")
+        self.active += 1
+        try:
+            async for chunk in super().read(remote, start, end):
+                await asyncio.sleep(0.005)
+                yield chunk
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.parametrize("store", ["memory", "redis"])
+@pytest.mark.parametrize("ranges", [True, False])
+def test_http_download_files_in_parallel_parts(tmp_path, ranges, store):
+    remote, local = tmp_path / "remote", tmp_path / "local"
+    remote.mkdir()
+    data = {name: write(remote / name, size, name) for name, size in (("a.fastq.gz", 250_001), ("b.bam", 99_999))}
+    app = file_app(str(remote), ranges=ranges)
+    budget = TransferBudget(max_concurrency=3) if store == "memory" else \
+        RedisTransferBudget(fakeredis.FakeRedis(), max_concurrency=3, poll_interval=0.01)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://files")
+        source = HttpSource(client=client)
+        try:
+            downloader = Downloader(budget, part_size=64_000, write_size=16_000)
+            return await downloader.download(source, [(name, str(local / name)) for name in data])
+        finally:
+            await source.aclose()
+
+    summary = asyncio.run(run())
+    assert summary["ok"] and summary["bytes"] == 350_000 and summary["mb_per_s"] > 0
+    for name, content in data.items():
+        assert (local / name).read_bytes() == content
+        assert not os.path.exists(local / f"{name}.part.json")
+    # 4 + 2 个分段，不支持 Range 时每个文件一个请求
+    assert app.state.stats["requests"] == (6 if ranges else 2)
+    assert budget.peak <= 3 and budget.active == 0
+
+    # 已经下载的文件跳过
+    assert [f["status"] for f in asyncio.run(run())["files"]] == ["exists", "exists"]
+
+
+def test_interrupted_parts_resume_from_written_bytes(tmp_path):
+    remote, local = tmp_path / "remote", tmp_path / "local"
+    remote.mkdir()
+    content = write(remote / "a.fastq.gz", 300_000, "resume")
+    source = FlakySource(str(remote), fail_after=30_000)
+
+    # 不重试：每个分段写入 30000 字节后失败，进度保存在 .part.json
+    failed = asyncio.run(Downloader(part_size=100_000, write_size=10_000, checkpoint_interval=10_000, max_attempts=1)
+                         .download(source, [("a.fastq.gz", str(local / "a.fastq.gz"))]))
+    assert not failed["ok"] and failed["files"][0]["status"] == "error"
+    assert os.path.exists(local / "a.fastq.gz.part.json")
+
+    resumed = asyncio.run(Downloader(part_size=100_000, write_size=10_000)
+                          .download(source, [("a.fastq.gz", str(local / "a.fastq.gz"))]))
+    assert resumed["ok"] and resumed["files"][0]["resumed_from"] == 90_000
+    assert resumed["bytes"] == 210_000 and source.served == 300_000
+    assert (local / "a.fastq.gz").read_bytes() == content
+
+
+def test_redis_budget_is_shared_between_processes():
+    server = fakeredis.FakeServer()
+    # 两个对象模拟两个 RQ work-horse 进程
+    budgets = [RedisTransferBudget(fakeredis.FakeRedis(server=server), max_concurrency=2,
+                                   max_bytes_per_second=1_000_000, burst=0, poll_interval=0.01) for _ in range(2)]
+
+    async def run():
+        slots = [await budgets[0].acquire(), await budgets[1].acquire()]
+        waiting = asyncio.ensure_future(budgets[1].acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done() and budgets[0].stats()["active_total"] == 2
+        await budgets[0].release(slots[0])
+        slots[0] = await asyncio.wait_for(waiting, 1)
+
+        # 两个进程的传输共用同一个令牌桶
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[budget.consume(100_000, slot) for budget, slot in zip(budgets, slots) for _ in range(2)])
+        seconds = asyncio.get_running_loop().time() - start
+        for budget, slot in zip(budgets, slots):
+            await budget.release(slot)
+        return seconds
+
+    assert 0.35 < asyncio.run(run()) < 1.2
+    assert budgets[0].stats()["active_total"] == 0
+
+
+def test_pwrite_all_retries_short_writes(tmp_path, monkeypatch):
+    pwrite = os.pwrite
+    # 每次最多写入 3 个字节，模拟 NFS 的部分写入
+    monkeypatch.setattr(os, "pwrite", lambda fd, data, offset: pwrite(fd, bytes(data[:3]), offset))
+    fd = os.open(tmp_path / "a.part", os.O_RDWR | os.O_CREAT)
+    try:
+        pwrite_all(fd, b"0123456789", 2)
+    finally:
+        os.close(fd)
+    assert (tmp_path / "a.part").read_bytes() == b"\0\0" + b"0123456789"
+
+
+def test_budget_limits_bandwidth():
+    budget = TransferBudget(max_concurrency=None, max_bytes_per_second=1_000_000, burst=0)
+
+    async def run():
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[budget.consume(100_000) for _ in range(3)])
+        return asyncio.get_running_loop().time() - start
+
+    assert 0.25 < asyncio.run(run()) < 1.0
+
+
+def test_failed_part_cancels_other_parts_before_closing_file(tmp_path):
+    remote, local = tmp_path / "remote", tmp_path / "local"
+    remote.mkdir()
+    write(remote / "a.fastq.gz", 40_000, "cancel")
+    source = SlowSource(str(remote))
+
+    async def run():
+        summary = await Downloader(part_size=10_000, write_size=1024, max_attempts=1) \
+            .download(source, [("a.fastq.gz", str(local / "a.fastq.gz"))])
+        # 失败后立即打开的文件可能复用下载文件的描述符，不能被还在执行的分段写入
+        other = tmp_path / "other"
+        fd = os.open(other, os.O_RDWR | os.O_CREAT)
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            os.close(fd)
+        return summary, other.read_bytes()
+
+    summary, other = asyncio.run(run())
+    assert summary["files"][0]["status"] == "error" and "connection reset" in summary["files"][0]["error"]
+    assert source.active == 0 and other == b""
+    with open(local / "a.fastq.gz.part.json") as f:
+        progress = json.load(f)
+    assert progress["written"][0] == 0 and sum(progress["written"]) < 30_000
+
+
+def test_file_source_stays_under_root(tmp_path):
+    root = tmp_path / "storage"
+    root.mkdir()
+    (tmp_path / "secret").write_text("secret")
+    source = FileSource(str(root))
+    assert source.path("/project/a.fastq.gz") == str(root / "project" / "a.fastq.gz")
+    for remote in ("../secret", "project/../../secret"):
+        with pytest.raises(PermissionError):
+            source.path(remote)
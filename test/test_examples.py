@@ -0,0 +1,35 @@
+from service.chat.states import PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder
+from service.chat.pipeline.examples import TokenBudgetExampleSelector, estimate_tokens
+
+EXAMPLES = [
+    {"user": "user_message: Please use GeSA.", "assistant": "pipeline_name: 'GeSA'"},
+    {"user": "user_message: It is from iRODS.", "assistant": "data_source_type: 'iRODS'"},
+    {"user": "user_message: There are both mouse and human data.", "assistant": "sequencing_species: null"},
+]
+
+
+def test_selects_most_relevant_in_original_order():
+    selector = TokenBudgetExampleSelector(EXAMPLES, k=2)
+    selected = selector.select_examples({"user_input": "the data is human", "missing_key": "data_source_type"})
+    assert selected == [EXAMPLES[1], EXAMPLES[2]]
+
+
+def test_token_budget():
+    budget = estimate_tokens(" ".join(EXAMPLES[0].values()))
+    selector = TokenBudgetExampleSelector(EXAMPLES, token_budget=budget)
+    assert selector.select_examples({"user_input": "use GeSA"}) == [EXAMPLES[0]]
+    stats = selector.stats()
+    assert stats["tokens_after"] <= budget < stats["tokens_before"]
+
+
+def test_prompt_builder_sends_fewer_messages():
+    state = PipelineState(messages=[])
+    full, _ = pipeline_prompt_builder().new_pipeline_task_prompt(state)
+    selected, _ = pipeline_prompt_builder(few_shot_k=2).new_pipeline_task_prompt(state)
+
+    full_messages = full.format_messages(user_input="WES data of project METAPRISM")
+    selected_messages = selected.format_messages(user_input="WES data of project METAPRISM")
+    # system, output, 用户消息模板 + 每个示例一问一答
+    assert len(selected_messages) == 3 + 2 * 2 < len(full_messages)
+    assert selected_messages[-1].content == full_messages[-1].content
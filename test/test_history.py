@@ -0,0 +1,85 @@
+import json
+import asyncio
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.language_models.fake_chat_models import FakeListChatModel, GenericFakeChatModel
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START
+
+from service.chat.states import ProcessorState, PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder
+from service.chat.history import HistoryCompactor, summary_messages
+from service.utils.lock import LocalThreadLock
+
+
+def reply(state: ProcessorState):
+    return {"messages": [AIMessage(content=f"reply {len(state.messages)}")]}
+
+
+def build():
+    builder = StateGraph(ProcessorState)
+    builder.add_node("chat", reply)
+    builder.add_edge(START, "chat")
+    return builder.compile(checkpointer=MemorySaver())
+
+
+def test_window_keeps_pinned_messages_and_starts_at_user_turn():
+    compactor = HistoryCompactor(window=4, slack=0)
+    messages = [SystemMessage(content="system")]
+    for i in range(4):
+        messages += [HumanMessage(content=f"user {i}"), AIMessage(content=f"ai {i}")]
+    messages[3].additional_kwargs["pinned"] = True
+    messages.append(AIMessage(content="ai 3 again"))
+
+    removed = compactor.select(messages)
+    # 最近 4 条从 "ai 2" 开始，窗口向后对齐到 "user 3"
+    assert [m.content for m in removed] == ["user 0", "ai 0", "ai 1", "user 2", "ai 2"]
+    assert compactor.select(messages[:5]) == []
+
+
+def test_compaction_in_background_with_summary():
+    prompt = "summary: {summary}\nargs: {args}\n{messages}"
+    compactor = HistoryCompactor(window=4, slack=2, summarize=True, prompt=prompt, lock=LocalThreadLock(),
+                                 llm=FakeListChatModel(responses=[f"summary {i}" for i in range(1, 5)]))
+    graph = build()
+    config = {"configurable": {"thread_id": "1"}}
+
+    async def run():
+        for i in range(10):
+            await graph.ainvoke({"messages": [HumanMessage(content=f"user {i}")]}, config)
+            compactor.schedule(graph, config)
+            await asyncio.gather(*compactor.tasks.values())
+        return await graph.aget_state(config)
+
+    snapshot = asyncio.run(run())
+    messages = snapshot.values["messages"]
+    # 每轮增加 2 条消息，超过 window + slack 时压缩到 window 条
+    assert [m.content for m in messages] == ["user 8", "reply 5", "user 9", "reply 7"]
+    assert snapshot.values["summary"] == "summary 4"
+    assert compactor.stats()["compactions"] == 4 and compactor.stats()["removed"] == 16
+    assert not compactor.tasks
+
+
+class Prompts(BaseCallbackHandler):
+    def __init__(self):
+        self.messages = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.messages.extend(messages)
+
+
+def test_summary_is_given_to_new_task_prompt():
+    llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content=json.dumps({"project_name": "XPC", "message": "Which sequencing type ?"})),
+    ]))
+    state = PipelineState(messages=[], summary="The user works on project XPC")
+    prompts = Prompts()
+    chain = pipeline_prompt_builder(structured_output=True).new_pipeline_task_chain(llm, state)
+    chain.invoke({"user_input": "same project as before"}, {"callbacks": [prompts]})
+
+    first = prompts.messages[0][0]
+    assert isinstance(first, SystemMessage) and "The user works on project XPC" in first.content
+    # 没有摘要时 prompt 不变
+    messages = [HumanMessage(content="user 0")]
+    assert summary_messages(None, messages) == messages
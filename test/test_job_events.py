@@ -0,0 +1,118 @@
+import json
+import asyncio
+
+import fakeredis
+from langgraph.checkpoint.memory import MemorySaver
+
+from service.chat.pipeline.stage.pipeline import PipelineWorkflow, PipelineStatus
+from service.tasks.events import JobEventPublisher, JobStatusView, QUEUED, STARTED, FINISHED, FAILED
+
+
+class AlwaysCompleted(PipelineWorkflow):
+    def route_state_running(self, state):
+        return PipelineStatus.COMPLETED.value
+
+
+class ResumedSamples(PipelineWorkflow):
+    """
+    每个样本的下载先失败一次，自动恢复后完成；s3 的下载总是出错
+    """
+    def route_state_running(self, state):
+        if state.stage == "downloading" and state.resume_count == 0:
+            return PipelineStatus.FAILED.value
+        return PipelineStatus.COMPLETED.value
+
+    def pipeline_running(self, state):
+        if state.stage == "downloading" and state.sample == "s3":
+            raise RuntimeError("download of s3 failed")
+        return super().pipeline_running(state)
+
+
+def events_of(client):
+    return [{k.decode(): v.decode() for k, v in fields.items()} for _, fields in client.xrange("test:jobs:events")]
+
+
+def test_status_view_follows_job_and_stage_events():
+    server = fakeredis.FakeServer()
+    publisher = JobEventPublisher(fakeredis.FakeRedis(server=server), prefix="test")
+    publisher.publish("job-1", QUEUED)
+
+    async def run():
+        view = JobStatusView(fakeredis.FakeAsyncRedis(server=server), prefix="test", max_jobs=2, block_ms=10)
+        # 重放服务启动前的事件
+        await view.read()
+        assert view.snapshot(["job-1"])[0]["status"] == QUEUED
+
+        frames = view.stream(["job-1"], heartbeat=0.05)
+        snapshot = await anext(frames)
+        assert snapshot.startswith("event: snapshot\n") and json.loads(snapshot.split("data: ")[1])[0]["job_id"] == "job-1"
+
+        publisher.publish("job-1", STARTED)
+        publisher.publish("job-2", STARTED)
+        publisher.publish("job-1", "running", stage="downloading")
+        publisher.publish("job-1", FAILED, stage="downloading", sample="s3", error="timeout", final=1)
+        await view.read()
+
+        # 只收到订阅的任务的状态变化
+        status = json.loads((await anext(frames)).split("data: ")[1])
+        assert status["status"] == STARTED and status["job"]["job_id"] == "job-1"
+        # 每个事件附带当时的任务状态，不受之后的事件影响
+        status = json.loads((await anext(frames)).split("data: ")[1])
+        assert status["job"]["stages"] == {"downloading": "running"} and status["job"]["failed_samples"] == []
+        await anext(frames)
+        assert await anext(frames) == ": keep-alive\n\n"
+        await frames.aclose()
+        assert view.stats()["subscribers"] == 0
+
+        job = view.snapshot(["job-1"])[0]
+        assert job["status"] == STARTED and job["stage"] == "downloading"
+        assert job["stages"] == {"downloading": "running"} and job["failed_samples"] == ["s3"]
+
+        # 超过 max_jobs 时淘汰最久没有更新的任务
+        publisher.publish("job-3", FINISHED)
+        await view.read()
+        assert [job["job_id"] for job in view.snapshot()] == ["job-1", "job-3"]
+        return view.stats()
+
+    stats = asyncio.run(run())
+    assert stats["events"] == 6 and stats["dropped"] == 0
+
+
+def test_workflow_publishes_stage_transitions():
+    client = fakeredis.FakeRedis()
+    publisher = JobEventPublisher(client, prefix="test")
+    graph = AlwaysCompleted(checkpointer=MemorySaver(), events=publisher, retry_interval=0).compile()
+    graph.invoke({"messages": ["start"], "samples": ["s1", "s2"]}, {"configurable": {"thread_id": "job-1"}})
+
+    events = events_of(client)
+    assert {event["job_id"] for event in events} == {"job-1"}
+    stages = [(event["stage"], event["status"]) for event in events if "sample" not in event]
+    assert ("notify", PipelineStatus.COMPLETED.value) in stages and stages[-1] == ("completed", "completed")
+    # 按样本执行的阶段每个样本一组事件，汇总时写入阶段的状态
+    samples = {event["sample"] for event in events if event.get("stage") == "downloading" and "sample" in event}
+    assert samples == {"s1", "s2"}
+    assert ("downloading", PipelineStatus.COMPLETED.value) in stages
+
+
+def test_only_final_sample_failures_are_reported():
+    client = fakeredis.FakeRedis()
+    publisher = JobEventPublisher(client, prefix="test")
+    graph = ResumedSamples(checkpointer=MemorySaver(), events=publisher, max_attempts=2, retry_interval=0).compile()
+    output = graph.invoke({"messages": ["start"], "samples": ["s1", "s2", "s3"]}, {"configurable": {"thread_id": "job-1"}})
+    assert {sample: result["status"] for sample, result in output["results"]["downloading"].items()} == \
+        {"s1": "completed", "s2": "completed", "s3": "failed"}
+
+    view = JobStatusView(None, prefix="test")
+    events = events_of(client)
+    # s1 和 s2 自动恢复前的 failed 事件不计入 failed_samples
+    assert {e["sample"] for e in events if e.get("sample") and e["status"] == FAILED} == {"s1", "s2", "s3"}
+    for event in events:
+        job = view.apply(event)
+    assert job["failed_samples"] == ["s3"] and job["stages"]["downloading"] == FAILED
+
+
+def test_late_queued_event_does_not_override_worker_status():
+    view = JobStatusView(None, prefix="test")
+    view.apply({"job_id": "job-1", "status": STARTED, "time": 1.0})
+    view.apply({"job_id": "job-1", "status": FINISHED, "time": 2.0})
+    assert view.apply({"job_id": "job-1", "status": QUEUED, "time": 0.5})["status"] == FINISHED
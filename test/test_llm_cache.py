@@ -0,0 +1,90 @@
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END, MessagesState
+
+from service.utils.llm_cache import SQLiteLLMCache
+from service.utils.metrics import ServiceMetrics
+
+
+def replies():
+    i = 0
+    while True:
+        i += 1
+        yield AIMessage(content=f"reply {i}", usage_metadata={"input_tokens": 10, "output_tokens": 2, "total_tokens": 12})
+
+
+def build_graph(llm):
+    # extract 节点通过带 tag 的链调用模型，reply 节点直接调用模型
+    extract = (RunnableLambda(lambda messages: messages) | llm).with_config(tags=["extraction"])
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("extract", lambda state: {"messages": [extract.invoke(state["messages"][-1:])]})
+    builder.add_node("reply", lambda state: {"messages": [llm.invoke(state["messages"][-1:])]})
+    builder.add_edge(START, "extract")
+    builder.add_edge("extract", "reply")
+    builder.add_edge("reply", END)
+    return builder.compile()
+
+
+def test_cache_only_tagged_calls(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"), tags={"extraction": None})
+    graph = build_graph(GenericFakeChatModel(messages=replies(), cache=cache))
+
+    first = graph.invoke({"messages": [HumanMessage(content="hello  there")]})["messages"]
+    # 空白不同的相同消息命中缓存，reply 节点不缓存
+    second = graph.invoke({"messages": [HumanMessage(content="hello there ")]})["messages"]
+
+    assert first[1].content == second[1].content == "reply 1"
+    assert first[2].content == "reply 2" and second[2].content == "reply 3"
+    # 命中时使用新的消息 id，usage 为 0
+    assert second[1].id != first[1].id and second[1].usage_metadata["total_tokens"] == 0
+    assert cache.stats()["hits"] == {"extraction": 1} and cache.stats()["misses"] == {"extraction": 1}
+    # 图之外的调用（预热、历史摘要）不缓存
+    llm = GenericFakeChatModel(messages=replies(), cache=cache)
+    assert llm.invoke("hello there").content != llm.invoke("hello there").content
+
+    # 重新打开文件后缓存仍然有效
+    reopened = SQLiteLLMCache(str(tmp_path / "cache.sqlite"), tags={"extraction": None})
+    graph = build_graph(GenericFakeChatModel(messages=replies(), cache=reopened))
+    assert graph.invoke({"messages": [HumanMessage(content="hello there")]})["messages"][1].content == "reply 1"
+
+
+def test_cache_lru_eviction_ttl_and_metrics(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"), tags={"extraction": None}, max_entries=3, ttl=0.2)
+    metrics = ServiceMetrics()
+    metrics.register_cache(cache)
+    graph = build_graph(GenericFakeChatModel(messages=replies(), cache=cache))
+
+    def ask(text):
+        return graph.invoke({"messages": [HumanMessage(content=text)]})["messages"][1].content
+
+    answers = {text: ask(text) for text in ("a", "b", "c")}
+    assert ask("a") == answers["a"]
+    # "b" 最久未访问，写入 "d" 时被淘汰
+    ask("d")
+    assert cache.stats()["entries"] <= 3 and cache.stats()["evicted"] >= 1
+    assert ask("a") == answers["a"] and ask("b") != answers["b"]
+
+    time.sleep(0.3)
+    assert ask("a") != answers["a"]
+    assert cache.stats()["expired"] == 1
+
+    sample = metrics.registry.get_sample_value
+    assert sample("pipeline_agent_llm_cache_hits_total", {"tag": "extraction"}) == 2
+    assert sample("pipeline_agent_llm_cache_misses_total", {"tag": "extraction"}) == 6
+    assert sample("pipeline_agent_llm_cache_entries") == cache.stats()["entries"]
+
+
+def test_classifier_caches_only_labels(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"))
+    labels = iter([AIMessage(content="pipeline"), AIMessage(content="我是流水线助手"), AIMessage(content="您好")])
+    classify = (RunnableLambda(lambda text: text) | GenericFakeChatModel(messages=labels, cache=cache)) \
+        .with_config(tags=["classifier"])
+
+    assert classify.invoke("新建任务").content == classify.invoke("新建任务").content == "pipeline"
+    # 对话外的问题得到的自由文本回复不缓存
+    assert classify.invoke("你是谁").content == "我是流水线助手" and classify.invoke("你是谁").content == "您好"
+    assert cache.stats()["entries"] == 1 and cache.stats()["hits"] == {"classifier": 1}
@@ -0,0 +1,54 @@
+import os
+import hashlib
+
+import pytest
+
+from service.tasks.md5 import Md5Verifier, ResumableMd5, hash_file, libcrypto, parse_manifest
+
+
+def write(path, size, seed):
+    data = hashlib.sha256(seed.encode()).digest() * (size // 32 + 1)
+    data = data[:size]
+    with open(path, "wb") as f:
+        f.write(data)
+    return hashlib.md5(data).hexdigest()
+
+
+def test_verify_manifest(tmp_path):
+    good = write(tmp_path / "a.fastq.gz", 300_001, "a")
+    write(tmp_path / "b.fastq.gz", 200_000, "b")
+    (tmp_path / "md5sum.txt").write_text(f"{good}  a.fastq.gz\n{'0' * 32} *b.fastq.gz\n{'1' * 32}  missing.bam\n")
+
+    entries = parse_manifest(str(tmp_path / "md5sum.txt"))
+    assert entries[1] == (str(tmp_path / "b.fastq.gz"), "0" * 32)
+
+    results = []
+    summary = Md5Verifier(workers=2, chunk_size=65_536).verify(str(tmp_path / "md5sum.txt"), on_result=results.append)
+    assert [f["status"] for f in summary["files"]] == ["ok", "mismatch", "missing"]
+    assert not summary["ok"] and len(results) == 3
+    assert summary["files"][0]["mb_per_s"] > 0 and summary["bytes"] == 500_001
+    assert os.path.isdir(tmp_path / ".md5-progress")
+
+
+@pytest.mark.skipif(libcrypto() is None, reason="resumable md5 needs libcrypto")
+def test_interrupted_check_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / "a.bam")
+    expected = write(path, 1_000_003, "resume")
+    kwargs = dict(chunk_size=10_007, checkpoint_dir=str(tmp_path), checkpoint_interval=100_000)
+
+    partial = hash_file(path, expected, max_bytes=450_000, **kwargs)
+    assert partial["status"] == "partial"
+    resumed = hash_file(path, expected, **kwargs)
+    assert resumed["status"] == "ok" and resumed["resumed_from"] == partial["bytes"]
+    assert resumed["bytes"] == 1_000_003 - partial["bytes"]
+    # 完成后再次校验直接使用保存的结果，文件修改后重新计算
+    assert hash_file(path, expected, **kwargs)["bytes"] == 0
+    os.utime(path, ns=(0, 0))
+    assert hash_file(path, expected, **kwargs)["bytes"] == 1_000_003
+
+    md5 = ResumableMd5()
+    buffer = bytearray(b"hello world")
+    md5.update(buffer, 5)
+    restored = ResumableMd5(md5.state())
+    restored.update(buffer, 11)
+    assert restored.hexdigest() == hashlib.md5(b"hello" + b"hello world").hexdigest()
@@ -0,0 +1,97 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END, MessagesState
+from langgraph.types import Command, interrupt
+
+from service import DialogueProcessor
+from service.utils.metrics import ServiceMetrics
+
+
+def replies(content="Hello, I can help you with data processing pipelines"):
+    while True:
+        yield AIMessage(content=content)
+
+
+def sample(metrics, name, **labels):
+    return metrics.registry.get_sample_value(f"pipeline_agent_{name}", labels)
+
+
+def test_node_and_llm_metrics_for_streamed_turn():
+    metrics = ServiceMetrics()
+    graph = DialogueProcessor(GenericFakeChatModel(messages=replies()), checkpointer=MemorySaver()).compile()
+    config = {"configurable": {"thread_id": "metrics"}, "callbacks": [metrics.callback]}
+
+    async def run():
+        for _ in range(2):
+            async for _ in graph.astream({"messages": HumanMessage(content="hi")}, config=config,
+                                         stream_mode=["messages", "updates"]):
+                pass
+
+    asyncio.run(run())
+    # chat 节点和节点内同名的 RunnableLambda 只记录一次
+    assert sample(metrics, "node_seconds_count", node="chat") == 2
+    assert sample(metrics, "llm_seconds_count", model="GenericFakeChatModel") == 2
+    assert sample(metrics, "llm_first_chunk_seconds_count", model="GenericFakeChatModel") == 2
+    # 没有 usage 时按流式输出的 chunk 计数
+    assert sample(metrics, "llm_tokens_total", model="GenericFakeChatModel", type="output") > 0
+    assert not metrics.callback.nodes and not metrics.callback.llm_runs
+    assert b"pipeline_agent_node_seconds_bucket" in metrics.render()[0]
+
+
+def test_interrupts_and_errors_are_counted_per_node():
+    def ask(state):
+        interrupt("continue?")
+        return state
+
+    def fail(state):
+        raise ValueError("broken")
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("ask", ask)
+    builder.add_node("fail", fail)
+    builder.add_edge(START, "ask")
+    builder.add_edge("ask", "fail")
+    builder.add_edge("fail", END)
+    graph = builder.compile(checkpointer=MemorySaver())
+
+    metrics = ServiceMetrics()
+    config = {"configurable": {"thread_id": "interrupt"}, "callbacks": [metrics.callback]}
+    graph.invoke({"messages": [HumanMessage(content="hi")]}, config)
+    assert sample(metrics, "interrupts_total", node="ask") == 1
+
+    with metrics.session():
+        assert sample(metrics, "sessions_in_flight") == 1
+        try:
+            graph.invoke(Command(resume="yes"), config)
+        except ValueError:
+            pass
+    assert sample(metrics, "sessions_in_flight") == 0
+    assert sample(metrics, "node_errors_total", node="fail") == 1
+
+
+def test_admission_metrics():
+    from service.utils.admission import AdmissionController, AdmissionRejected
+
+    metrics = ServiceMetrics()
+    admission = AdmissionController(max_concurrency=1, max_queue=1)
+    metrics.register_admission(admission)
+
+    async def run():
+        first = await admission.acquire("alice")
+        waiting = asyncio.create_task(admission.acquire("bob"))
+        await asyncio.sleep(0)
+        assert sample(metrics, "admission_in_flight") == 1 and sample(metrics, "admission_queue_depth") == 1
+        try:
+            await admission.acquire("carol")
+        except AdmissionRejected:
+            pass
+        await first.release()
+        await (await waiting).release()
+
+    asyncio.run(run())
+    assert sample(metrics, "admission_in_flight") == 0 and sample(metrics, "admission_queue_depth") == 0
+    assert sample(metrics, "admission_rejected_total", reason="queue_full") == 1
+    assert sample(metrics, "admission_wait_seconds_count") == 2
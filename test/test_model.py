@@ -0,0 +1,133 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from service.utils.config import load_model
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI 兼容的 /v1/chat/completions 假服务，记录同时处理的请求数和客户端使用的连接
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.ports.add(self.client_address[1])
+        time.sleep(0.1)
+        with server.lock:
+            server.in_flight -= 1
+
+        content = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": body["messages"][-1]["content"]}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.in_flight = server.max_in_flight = 0
+    server.ports = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def write_config(tmp_path, server, max_in_flight):
+    config = tmp_path / "model.yaml"
+    config.write_text(f"""
+backend: vllm
+vllm:
+  temperature: 0
+  model_name: stub
+  base_url: http://127.0.0.1:{server.server_address[1]}/v1
+  max_in_flight: {max_in_flight}
+  timeout: 5
+  max_retries: 0
+""")
+    return str(config)
+
+
+def test_vllm_backend_limits_in_flight_requests(tmp_path, stub_server):
+    llm = load_model(write_config(tmp_path, stub_server, max_in_flight=2))
+
+    async def run():
+        return await asyncio.gather(*[llm.ainvoke(f"hello {i}") for i in range(6)])
+
+    replies = asyncio.run(run())
+    assert [reply.content for reply in replies] == [f"hello {i}" for i in range(6)]
+    assert stub_server.max_in_flight == 2
+    # 请求复用 keep-alive 连接
+    assert len(stub_server.ports) == 2
+
+
+def test_models_share_connection_pool(tmp_path, stub_server):
+    config = write_config(tmp_path, stub_server, max_in_flight=3)
+    first, second = load_model(config), load_model(config)
+    assert first.invoke("ping").content == "ping"
+    assert second.invoke("pong").content == "pong"
+    assert len(stub_server.ports) == 1
+
+
+def test_unknown_backend(tmp_path):
+    config = tmp_path / "model.yaml"
+    config.write_text("backend: unknown\n")
+    with pytest.raises(ValueError):
+        load_model(str(config))
+
+
+def test_fake_backend_is_deterministic(tmp_path):
+    config = tmp_path / "model.yaml"
+    config.write_text("""
+backend: fake
+fake:
+  latency: 0
+  tokens_per_second: null
+  rules: [{match: 'ping', reply: 'pong pong'}]
+  reply: 'default reply'
+""")
+    llm = load_model(str(config))
+    assert llm.invoke("ping").content == "pong pong"
+    assert llm.invoke("hello").content == "default reply"
+
+    chunks = list(llm.stream("ping"))
+    assert "".join(chunk.content for chunk in chunks) == "pong pong"
+    # 与 ollama 相同，用量在最后一个 chunk 中返回
+    assert chunks[-1].usage_metadata["output_tokens"] == 2
+
+
+def test_fake_backend_classifies_like_the_prompts(tmp_path):
+    # 使用默认规则，不启用 LLM 回复缓存
+    config = tmp_path / "model.yaml"
+    config.write_text("""
+backend: fake
+fake:
+  latency: 0
+  tokens_per_second: null
+""")
+    llm = load_model(str(config))
+    assert llm.invoke("please classify the intent of the user message:\nWe received some data").content == "pipeline"
+    assert llm.invoke("please classify the intent of the user message:\nsymptoms of pneumonia").content == "medical"
@@ -0,0 +1,128 @@
+import asyncio
+from typing import Optional, TypedDict
+
+import fakeredis
+import pytest
+from langgraph.types import interrupt, Command
+from langgraph.graph import StateGraph, START
+
+from service.utils.checkpoint import RedisSaver
+from service.utils.session import RedisSessionStore
+from service.utils.lock import LocalThreadLock, RedisThreadLock, ThreadBusy
+
+
+class State(TypedDict):
+    foo: str
+    human_value: Optional[str]
+
+
+def node(state: State):
+    answer = interrupt("what is your age?")
+    return {"human_value": answer}
+
+
+def build(saver):
+    builder = StateGraph(State)
+    builder.add_node("node", node)
+    builder.add_edge(START, "node")
+    return builder.compile(checkpointer=saver)
+
+
+def test_interrupt_resumed_by_another_worker():
+    server = fakeredis.FakeServer()
+    config = {"configurable": {"thread_id": "1"}}
+
+    build(RedisSaver(fakeredis.FakeRedis(server=server))).invoke({"foo": "abc"}, config)
+
+    # 另一个 worker 使用自己的连接恢复中断
+    graph = build(RedisSaver(fakeredis.FakeRedis(server=server)))
+    assert graph.get_state(config).tasks[0].interrupts[0].value == "what is your age?"
+    assert graph.invoke(Command(resume="42"), config) == {"foo": "abc", "human_value": "42"}
+    assert len(list(graph.checkpointer.list(config))) == len(list(graph.get_state_history(config)))
+    assert len(list(graph.checkpointer.list(config, limit=1))) == 1
+
+    graph.checkpointer.delete_thread("1")
+    assert graph.checkpointer.get_tuple(config) is None
+    assert fakeredis.FakeRedis(server=server).keys() == []
+
+
+def test_interrupt_registry_pops_once():
+    server = fakeredis.FakeServer()
+    first = RedisSessionStore(fakeredis.FakeRedis(server=server), ttl=60)
+    second = RedisSessionStore(fakeredis.FakeRedis(server=server), ttl=60)
+
+    first["thread"] = "node:1234"
+    assert "thread" in second and list(second) == ["thread"]
+    assert second.pop("thread", None) == "node:1234"
+    assert first.pop("thread", None) is None
+
+
+def turns(lock, threads):
+    events = []
+
+    async def turn(thread_id, i):
+        async with lock.hold(thread_id):
+            events.append(("start", thread_id, i))
+            await asyncio.sleep(0.05)
+            events.append(("end", thread_id, i))
+
+    async def run():
+        await asyncio.gather(*[turn(thread_id, i) for i, thread_id in enumerate(threads)])
+
+    asyncio.run(run())
+    return events
+
+
+def test_redis_lock_serializes_turns_of_a_chat():
+    lock = RedisThreadLock(fakeredis.FakeAsyncRedis(), timeout=0.03, poll=0.01)
+    # 锁的租期比一轮对话短，持有期间需要续期
+    events = turns(lock, ["a", "a", "b"])
+    a = [event[0] for event in events if event[1] == "a"]
+    assert a == ["start", "end", "start", "end"]
+    # 不同会话可以同时执行
+    assert events.index(("start", "b", 2)) < events.index(("end", "a", 0))
+
+
+def test_redis_lock_raises_thread_busy_only_while_waiting():
+    lock = RedisThreadLock(fakeredis.FakeAsyncRedis(), wait=0.05, poll=0.01)
+
+    async def run():
+        async with lock.hold("a"):
+            with pytest.raises(ThreadBusy):
+                async with lock.hold("a"):
+                    pass
+        # 持有锁期间抛出的 TimeoutError 不是 ThreadBusy
+        with pytest.raises(TimeoutError) as e:
+            async with lock.hold("a"):
+                raise TimeoutError("model timed out")
+        assert not isinstance(e.value, ThreadBusy)
+    asyncio.run(run())
+
+
+def test_local_lock_serializes_turns_of_a_chat():
+    lock = LocalThreadLock()
+    events = turns(lock, ["a", "a"])
+    assert [event[0] for event in events] == ["start", "end", "start", "end"]
+    assert lock.locks == {}
+
+
+def test_messages_deltas_shared_between_workers():
+    from langchain_core.messages import AIMessage, HumanMessage
+    from service.chat.states import ProcessorState
+    from service.utils.serde import TypedMsgpackSerializer
+
+    def build_chat(client):
+        builder = StateGraph(ProcessorState)
+        builder.add_node("chat", lambda state: {"messages": [AIMessage(content=f"reply {len(state.messages)}")]})
+        builder.add_edge(START, "chat")
+        return builder.compile(checkpointer=RedisSaver(client, serde=TypedMsgpackSerializer(), snapshot_every=3))
+
+    server = fakeredis.FakeServer()
+    config = {"configurable": {"thread_id": "1"}}
+    first = build_chat(fakeredis.FakeRedis(server=server))
+    second = build_chat(fakeredis.FakeRedis(server=server))
+    for i in range(4):
+        graph = first if i % 2 else second
+        graph.invoke({"messages": [HumanMessage(content=f"user {i}")]}, config)
+    assert [m.content for m in first.get_state(config).values["messages"]][-2:] == ["user 3", "reply 7"]
+    assert first.get_state(config).values["messages"] == second.get_state(config).values["messages"]
@@ -0,0 +1,49 @@
+import time
+
+from langchain_core.messages import HumanMessage
+from langgraph.graph import StateGraph, START, MessagesState
+
+from service.utils.session import SessionStore
+from service.utils.checkpoint import BoundedMemorySaver
+
+
+def test_lru_eviction():
+    evicted = []
+    store = SessionStore(max_size=2, on_evict=lambda k, v: evicted.append(k))
+    store["a"], store["b"] = 1, 2
+    store["a"]
+    store["c"] = 3
+    assert evicted == ["b"]
+    assert sorted(store) == ["a", "c"]
+    assert store.stats()["count"] == 2 and store.stats()["evicted"] == 1
+
+
+def test_ttl_eviction():
+    store = SessionStore(ttl=0.01)
+    store["a"] = 1
+    time.sleep(0.02)
+    assert "a" not in store
+    assert store.stats() == {"count": 0, "bytes": 0, "evicted": 1}
+
+
+def build(checkpointer):
+    builder = StateGraph(MessagesState)
+    builder.add_node("echo", lambda state: {"messages": [("ai", state["messages"][-1].content)]})
+    builder.add_edge(START, "echo")
+    return builder.compile(checkpointer=checkpointer)
+
+
+def test_bounded_saver_spills_cold_threads(tmp_path):
+    saver = BoundedMemorySaver(max_threads=2, spill_dir=str(tmp_path))
+    graph = build(saver)
+    for thread in ["1", "2", "3"]:
+        graph.invoke({"messages": [HumanMessage(content=thread)]}, {"configurable": {"thread_id": thread}})
+
+    assert saver.stats()["count"] == 2
+    assert saver.stats()["spilled"] == 1
+    assert "1" not in saver.storage
+
+    # 再次访问被淘汰的会话时从磁盘恢复
+    state = graph.get_state({"configurable": {"thread_id": "1"}})
+    assert [m.content for m in state.values["messages"]] == ["1", "1"]
+    assert saver.stats()["count"] == 2 and saver.stats()["bytes"] > 0
@@ -0,0 +1,80 @@
+import json
+import asyncio
+
+from langchain_core.messages import AIMessageChunk
+
+from service.chat.stream import TokenStreamFilter, SSEEncoder, coalesce
+
+
+def make_filter():
+    return TokenStreamFilter(nodes=["chat"], labels=["pipeline", "medical"])
+
+
+def feed(token_filter, tokens, node="chat", tags=("classifier",), msg_id="run-1"):
+    metadata = {"langgraph_node": node, "tags": list(tags)}
+    return [token_filter(AIMessageChunk(content=t, id=msg_id), metadata) for t in tokens]
+
+
+def test_classifier_label_is_hidden():
+    token_filter = make_filter()
+    assert feed(token_filter, ["pipe", "line"]) == [None, None]
+    assert token_filter.flush() is None
+
+
+def test_classifier_reply_is_released_once_not_a_label():
+    token_filter = make_filter()
+    assert feed(token_filter, ["Med", "ical", " staff", " only"]) == [None, None, "Medical staff", " only"]
+
+
+def test_partial_label_is_flushed_at_node_end():
+    token_filter = make_filter()
+    assert feed(token_filter, ["med"]) == [None]
+    assert token_filter.flush() == "med"
+
+
+def test_other_nodes_are_hidden():
+    token_filter = make_filter()
+    assert feed(token_filter, ["hello"], node="update_chat_state", tags=()) == [None]
+    assert "update_chat_state" in token_filter.seen_nodes
+
+
+def test_untagged_tokens_are_streamed():
+    token_filter = make_filter()
+    assert feed(token_filter, ["pipe", "line"], tags=()) == ["pipe", "line"]
+
+
+def test_encoder_matches_chat_completion_chunk():
+    encoder = SSEEncoder("thread-1", "hello")
+    frame = encoder.content('say "hi"\n')
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    chunk = json.loads(frame[6:])
+    assert chunk["thread_id"] == "thread-1" and chunk["object"] == "chat.completion.chunk"
+    assert chunk["choices"] == [{"index": 0, "delta": {"content": 'say "hi"\n'}, "finish_reason": None}]
+    assert json.loads(encoder.frame({}, "stop")[6:])["choices"][0]["finish_reason"] == "stop"
+
+
+def contents(chunks):
+    frames = [frame for chunk in chunks for frame in chunk.split(b"\n\n") if frame.startswith(b"data: {")]
+    return [json.loads(frame[6:])["choices"][0]["delta"].get("content") for frame in frames]
+
+
+def test_coalesce_merges_tokens_between_control_frames():
+    encoder = SSEEncoder("thread-1", "hello")
+
+    async def events():
+        yield encoder.frame({"role": "assistant"})
+        for token in ["a", "b", "c", "d"]:
+            yield token
+        await asyncio.sleep(0.05)
+        yield "e"
+        yield encoder.frame({}, "stop")
+        yield encoder.DONE
+
+    async def run(**kwargs):
+        return [chunk async for chunk in coalesce(events(), encoder, **kwargs)]
+
+    assert contents(asyncio.run(run())) == [None, "a", "b", "c", "d", "e", None]
+    # 第一个 token 立即输出，之后的 token 按时间和大小合并，结束标记之前先输出缓存
+    assert contents(asyncio.run(run(flush_interval=0.02))) == [None, "a", "bcd", "e", None]
+    assert contents(asyncio.run(run(flush_interval=0.02, flush_size=2))) == [None, "a", "bc", "d", "e", None]
+    assert asyncio.run(run(flush_interval=0.02))[-1].endswith(encoder.DONE)
@@ -0,0 +1,43 @@
+import json
+
+from langchain_core.messages import AIMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+
+from service.chat.states import PipelineState
+from service.chat.pipeline.prompts import pipeline_prompt_builder
+
+
+def turn(**kwargs):
+    return AIMessage(content=json.dumps(kwargs, indent=1))
+
+
+def test_structured_turn_uses_one_call():
+    llm = GenericFakeChatModel(messages=iter([
+        turn(project_name="METAPRISM", sequencing_type="WES", message="Which pipeline, GeSA or nfcore/Sarek ?"),
+    ]))
+    builder = pipeline_prompt_builder(structured_output=True)
+    state = PipelineState(messages=[])
+
+    response = builder.new_pipeline_task_chain(llm, state).invoke({"user_input": "WES data of project METAPRISM"})
+    assert response.content == "Which pipeline, GeSA or nfcore/Sarek ?"
+    assert state.args["project_name"] == "METAPRISM"
+    assert state.args["sequencing_type"] == "WES"
+    assert state.args["keyword_topics"] == "pipeline_name"
+    assert builder.structured_turns == 1 and builder.fallback_turns == 0
+
+
+def test_invalid_enum_falls_back_to_two_calls():
+    llm = GenericFakeChatModel(messages=iter([
+        # 物种只能是 human 或 mouse
+        turn(project_name="XPC", sequencing_species="human and mouse", message="Which species ?"),
+        AIMessage(content="project_name: 'XPC'\nsequencing_type: 'WGS'"),
+        AIMessage(content="Which pipeline would you like to run ?"),
+    ]))
+    builder = pipeline_prompt_builder(structured_output=True)
+    state = PipelineState(messages=[])
+
+    response = builder.new_pipeline_task_chain(llm, state).invoke({"user_input": "WGS of XPC, human and mouse"})
+    assert response.content == "Which pipeline would you like to run ?"
+    assert state.args["project_name"] == "XPC"
+    assert state.args["sequencing_species"] is None
+    assert builder.fallback_turns == 1
@@ -0,0 +1,104 @@
+import asyncio
+
+import fakeredis
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langgraph.checkpoint.memory import MemorySaver
+
+from service import DialogueProcessor
+from service.utils.admission import AdmissionRejected
+from service.utils.usage import RedisTokenBudget, TokenBudget, UsageCallbackHandler
+
+
+def replies(usage=None):
+    while True:
+        yield AIMessage(content="I can help you with data processing pipelines", usage_metadata=usage)
+
+
+def test_usage_summed_over_llm_calls_of_a_turn():
+    usage = {"input_tokens": 120, "output_tokens": 8, "total_tokens": 128}
+    chat = DialogueProcessor(GenericFakeChatModel(messages=replies(usage)), checkpointer=MemorySaver())
+    graph = chat.compile()
+    handler = UsageCallbackHandler()
+    config = {"configurable": {"thread_id": "usage"}, "callbacks": [handler]}
+    graph.invoke({"messages": HumanMessage(content="hi")}, config)
+    chat.llm.invoke("an LLM call of another node", config={"callbacks": [handler]})
+
+    assert handler.usage() == {"prompt_tokens": 240, "completion_tokens": 16, "total_tokens": 256}
+    assert handler.calls == 2 and not handler.estimated
+
+
+def test_usage_estimated_without_usage_metadata():
+    handler = UsageCallbackHandler()
+    GenericFakeChatModel(messages=replies()).invoke([HumanMessage(content="hello world")], config={"callbacks": [handler]})
+    assert handler.estimated
+    assert handler.usage()["prompt_tokens"] > 0 and handler.usage()["completion_tokens"] > 0
+
+
+@pytest.mark.parametrize("make_budget", [
+    lambda **kwargs: TokenBudget(**kwargs),
+    lambda **kwargs: RedisTokenBudget(fakeredis.FakeAsyncRedis(), **kwargs),
+])
+def test_budget_limits_requests_and_tokens_per_user(make_budget):
+    async def run():
+        budget = make_budget(window=3600, max_requests=3, max_tokens=1000)
+        used = {"prompt_tokens": 500, "completion_tokens": 100, "total_tokens": 600}
+
+        await budget.acquire("alice")
+        await budget.record("alice", "chat-1", used)
+        await budget.acquire("alice")
+        await budget.record("alice", "chat-2", used)
+        # 窗口内已经使用了 1200 个 token
+        with pytest.raises(AdmissionRejected) as e:
+            await budget.acquire("alice")
+        assert e.value.status_code == 429 and e.value.reason == "token_budget" and e.value.retry_after > 0
+
+        # 其他用户不受影响，请求数达到上限后拒绝
+        for _ in range(3):
+            await budget.acquire("bob")
+        with pytest.raises(AdmissionRejected) as e:
+            await budget.acquire("bob")
+        assert e.value.reason == "request_budget"
+
+        return await budget.usage("alice", "chat-1"), budget.stats()
+
+    usage, stats = asyncio.run(run())
+    assert usage["user"]["total_tokens"] == 1200 and usage["user"]["requests"] == 2
+    assert usage["user"]["window"]["tokens"] == 1200
+    assert usage["chat"] == {"prompt_tokens": 500, "completion_tokens": 100, "total_tokens": 600, "requests": 1}
+    assert stats["rejected"] == {"token_budget": 1, "request_budget": 1}
+
+
+@pytest.mark.parametrize("make_budget", [
+    lambda **kwargs: TokenBudget(**kwargs),
+    lambda **kwargs: RedisTokenBudget(fakeredis.FakeAsyncRedis(), **kwargs),
+])
+def test_budget_release_refunds_rejected_requests(make_budget):
+    async def run():
+        budget = make_budget(window=3600, max_requests=1)
+        # 请求被准入控制拒绝后退回，不占用用户的请求数
+        await budget.acquire("alice")
+        await budget.release("alice")
+        await budget.acquire("alice")
+        with pytest.raises(AdmissionRejected):
+            await budget.acquire("alice")
+    asyncio.run(run())
+
+
+def test_budget_memory_bounded_by_users_and_chats():
+    used = {"prompt_tokens": 5, "completion_tokens": 5, "total_tokens": 10}
+
+    async def run():
+        budget = TokenBudget(max_chats=3, max_users=3)
+        # 没有用户信息时按会话统计，每个会话一个用户
+        for i in range(10):
+            await budget.acquire(f"chat-{i}")
+            await budget.record(f"chat-{i}", f"chat-{i}", used)
+        await budget.acquire("chat-0")
+        return budget
+
+    budget = asyncio.run(run())
+    assert len(budget.windows) == len(budget.users) == len(budget.chats) == 3
+    assert list(budget.windows)[-1] == "chat-0" and "chat-0" not in budget.users
+    assert budget.stats()["total_tokens"] == 100
@@ -0,0 +1,83 @@
+import asyncio
+
+import yaml
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+
+from service.utils.config import load_model
+from service.utils.warmup import ModelWarmer, limit_tokens
+
+
+class FlakyModel(GenericFakeChatModel):
+    """
+    前 failures 次调用失败，记录每次调用收到的消息
+    """
+    failures: int = 0
+    calls: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(messages)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("model is loading")
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def replies():
+    while True:
+        yield AIMessage(content="ok")
+
+
+def test_limit_tokens_shares_client(tmp_path):
+    # 使用 config/model.yaml 中的模型参数，不启用 LLM 回复缓存
+    with open("config/model.yaml") as f:
+        model_config = yaml.safe_load(f)
+    model_config["cache"]["enabled"] = False
+    config = tmp_path / "model.yaml"
+    config.write_text(yaml.safe_dump(model_config))
+
+    llm = load_model(str(config), backend="vllm")
+    limited = limit_tokens(llm)
+    assert limited.max_tokens == 1 and llm.max_tokens is None
+    assert limited.root_async_client is llm.root_async_client
+
+    ollama = limit_tokens(load_model(str(config), backend="ollama"))
+    assert ollama.num_predict == 1 and ollama.keep_alive == "30m"
+
+
+def test_ready_after_warm_up_retries():
+    prompts = [[SystemMessage(content="system"), HumanMessage(content="hello")], [HumanMessage(content="task_new")]]
+    llm = FlakyModel(messages=replies(), failures=2, calls=[])
+    warmer = ModelWarmer(llm, prompts, retry_interval=0.01)
+
+    async def run():
+        warmer.start()
+        assert not warmer.ready.is_set()
+        await asyncio.wait_for(warmer.ready.wait(), 5)
+        await warmer.stop()
+
+    asyncio.run(run())
+    stats = warmer.stats()
+    assert stats["ready"] and stats["attempts"] == 3 and stats["last_error"] is None
+    # 两次失败之后依次发送所有 prompt
+    assert [m[-1].content for m in llm.calls[-2:]] == ["hello", "task_new"]
+
+
+def test_keep_alive_only_when_idle():
+    llm = FlakyModel(messages=replies(), calls=[])
+    warmer = ModelWarmer(llm, [[HumanMessage(content="hello")]], keep_alive_interval=0.05)
+
+    async def run():
+        warmer.start()
+        await warmer.ready.wait()
+        # 持续有请求时不发送 keep-alive
+        for _ in range(10):
+            warmer.touch()
+            await asyncio.sleep(0.01)
+        busy = warmer.pings
+        await asyncio.sleep(0.2)
+        await warmer.stop()
+        return busy
+
+    assert asyncio.run(run()) == 0
+    assert warmer.pings >= 2
@@ -0,0 +1,96 @@
+import time
+import asyncio
+import threading
+from collections import Counter
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+from service.chat.pipeline.stage.pipeline import (PipelineWorkflow, PipelineStatus, AnalysisWorkflowStages,
+                                                  LINEAR_STAGE_DEPENDENCIES)
+
+
+class AlwaysCompleted(PipelineWorkflow):
+    def route_state_running(self, state):
+        return PipelineStatus.COMPLETED.value
+
+
+def steps(workflow):
+    """
+    每一步执行的阶段
+    """
+    graph = workflow.compile()
+    found = {}
+    for event in graph.stream({"messages": ["start"]}, {"configurable": {"thread_id": "1"}}, stream_mode="debug"):
+        if event["type"] == "task":
+            found.setdefault(event["step"], []).append(event["payload"]["name"])
+    return [sorted(found[step]) for step in sorted(found)]
+
+
+def test_independent_stages_run_in_the_same_step():
+    workflow = AlwaysCompleted(checkpointer=MemorySaver())
+    # 所有阶段共用一个阶段子图
+    assert len({id(graph) for graph in workflow.stage_dict.values()}) == 1
+
+    found = steps(workflow)
+    assert ["backing-up", "notify"] in found
+    assert found[-1] == ["completed"] and found.index(["cleaning-up"]) == len(found) - 2
+    assert len(found) == 8
+
+
+def test_linear_dependencies_and_invalid_graphs():
+    assert len(steps(AlwaysCompleted(checkpointer=MemorySaver(), dependencies=LINEAR_STAGE_DEPENDENCIES))) == 9
+
+    cycle = {**LINEAR_STAGE_DEPENDENCIES, AnalysisWorkflowStages.INIT: (AnalysisWorkflowStages.COMPLETED,)}
+    with pytest.raises(ValueError, match="cycle"):
+        PipelineWorkflow(checkpointer=MemorySaver(), dependencies=cycle)
+    with pytest.raises(ValueError, match="not in the workflow"):
+        PipelineWorkflow(checkpointer=MemorySaver(), dependencies={"init": (), "notify": ("analyzing",)})
+
+
+class FlakySamples(AlwaysCompleted):
+    """
+    s2 的下载前两次出错，s3 的下载总是出错；记录每个样本执行的次数和同时执行的样本数
+    """
+    def __init__(self, **kwargs):
+        self.runs = Counter()
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        super().__init__(checkpointer=MemorySaver(), retry_interval=0, **kwargs)
+
+    def pipeline_running(self, state):
+        with self.lock:
+            self.runs[(state.stage, state.sample)] += 1
+            attempt = self.runs[(state.stage, state.sample)]
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if state.stage == "downloading" and (state.sample == "s3" or (state.sample == "s2" and attempt <= 2)):
+            raise RuntimeError(f"download of {state.sample} failed")
+        return state
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_per_sample_fan_out_retries_only_failed_samples(use_async):
+    workflow = FlakySamples(max_concurrency=2)
+    graph = workflow.compile()
+    samples = ["s1", "s2", "s3", "s4", "s5"]
+    config = {"configurable": {"thread_id": "samples"}}
+    if use_async:
+        result = asyncio.run(graph.ainvoke({"messages": ["start"], "samples": samples}, config))
+    else:
+        result = graph.invoke({"messages": ["start"], "samples": samples}, config)
+
+    downloads = result["results"]["downloading"]
+    assert downloads["s2"]["status"] == "completed" and downloads["s2"]["attempts"] == 3
+    assert downloads["s3"]["status"] == "failed" and "download of s3 failed" in downloads["s3"]["error"]
+    assert all(downloads[s]["attempts"] == 1 for s in ("s1", "s4", "s5"))
+    assert workflow.runs[("downloading", "s1")] == 1 and workflow.runs[("downloading", "s3")] == 3
+    # 失败的样本不再进入后面的阶段，其他阶段整体执行一次
+    assert sorted(result["results"]["md5-checking"]) == ["s1", "s2", "s4", "s5"]
+    assert workflow.runs[("analyzing", None)] == 1
+    assert workflow.peak <= 2
+    assert any(m.content == "downloading: 4/5 samples completed, 4 retries, failed: s3" for m in result["messages"])